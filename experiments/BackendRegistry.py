@@ -0,0 +1,160 @@
+import importlib
+import subprocess
+import sys
+
+# model name used in the notebooks -> (module, class, constructor arguments). Modules are only imported when a model is created.
+BACKENDS = {
+    "GPT-3_5-Turbo": ("OpenAIModel", "OpenAIModel", ("gpt-3.5-turbo",), {}),
+    "GPT-4": ("OpenAIModel", "OpenAIModel", ("gpt-4",), {}),
+    "DeepSeek-Coder-V2": ("DeepSeek", "DeepSeek", (), {}),
+    "CodeQwen1_5-7B-Chat": ("CodeQwen", "CodeQwen", (), {}),
+    "Artigenz-Coder-DS-6_7B": ("ArtigenzCoder", "ArtigenzCoder", (), {}),
+    "Gemini-1_5-Pro": ("Gemini", "Gemini", (), {}),
+}
+
+# metric -> language -> (module, function), matching the per-language function dicts in code_metrics.ipynb
+METRICS = {
+    "loc": {
+        "python": ("CodeMetricCalculator", "get_loc"),
+        "JS": ("CodeMetricCalculator", "get_loc"),
+        "TS": ("CodeMetricCalculator", "get_loc"),
+    },
+    "cc": {
+        "python": ("CodeMetricCalculator", "get_cc_py"),
+        "JS": ("CodeMetricCalculator", "get_cc_js"),
+        "TS": ("CodeMetricCalculator", "get_cc_js"),
+    },
+    "cog": {
+        "python": ("CodeMetricCalculator", "get_cog_complexity_py"),
+        "JS": ("CodeMetricCalculator", "get_cog_complexity_js"),
+        "TS": ("CodeMetricCalculator", "get_cog_complexity_js"),
+    },
+    "halstead": {
+        "python": ("CodeMetricCalculator", "get_halstead_py"),
+        "JS": ("CodeMetricCalculator", "get_halstead_js"),
+        "TS": ("CodeMetricCalculator", "get_halstead_js"),
+    },
+    "codebleu": {
+        "python": ("CodebleuCalculator", "codebleu_score_calculator"),
+        "JS": ("CodebleuCalculator", "codebleu_score_calculator"),
+        "TS": ("CodebleuCalculator", "codebleu_score_calculator"),
+    },
+}
+
+def register_backend(name: str, module: str, class_name: str, *args, **kwargs) -> None:
+    """
+    Register a model name, e.g. a LocalLLM with a specific checkpoint, without importing its module.
+
+    Args:
+        name (str): The model name, as used for the generated function directories.
+        module (str): The module defining the backend class.
+        class_name (str): The name of the backend class.
+        *args, **kwargs: Arguments for the backend class.
+    """
+    BACKENDS[name] = (module, class_name, args, kwargs)
+
+def _resolve(module: str, attribute: str):
+    return getattr(importlib.import_module(module), attribute)
+
+def get_backend_class(name: str) -> type:
+    """
+    Import and return the backend class of a registered model name.
+
+    Args:
+        name (str): The model name, e.g. "GPT-4".
+
+    Returns:
+        type: The LLMInterface subclass.
+    """
+    if name not in BACKENDS:
+        raise KeyError(f"Unknown model {name}, expected one of {list(BACKENDS)}")
+
+    module, class_name, _, _ = BACKENDS[name]
+    return _resolve(module, class_name)
+
+def create_backend(name: str, **kwargs):
+    """
+    Create the backend of a registered model name, importing only the module it needs.
+
+    Args:
+        name (str): The model name, e.g. "GPT-4".
+        **kwargs: Arguments overriding the registered constructor arguments.
+
+    Returns:
+        LLMInterface: The backend.
+    """
+    backend_class = get_backend_class(name)
+    _, _, args, registered_kwargs = BACKENDS[name]
+    return backend_class(*args, **{**registered_kwargs, **kwargs})
+
+def create_model_dict(names: list[str]) -> dict:
+    """
+    Create the model_dict used by the notebooks for the given model names only.
+
+    Args:
+        names (list[str]): The model names, e.g. ["GPT-4", "DeepSeek-Coder-V2"].
+
+    Returns:
+        dict: Mapping of model name to backend.
+    """
+    return {name: create_backend(name) for name in names}
+
+def get_metric(metric: str, language: str):
+    """
+    Import and return the function computing a metric for a language.
+
+    Args:
+        metric (str): One of "loc", "cc", "cog", "halstead" and "codebleu".
+        language (str): One of "python", "JS" and "TS".
+
+    Returns:
+        The metric function.
+    """
+    if metric not in METRICS or language not in METRICS[metric]:
+        raise KeyError(f"Unknown metric {metric} for language {language}")
+
+    return _resolve(*METRICS[metric][language])
+
+
+def _import_time(modules: list[str]) -> float:
+    """
+    Time importing modules in a fresh interpreter, so that nothing is already cached in sys.modules.
+    """
+    code = (
+        "import time; start = time.perf_counter()\n"
+        f"for module in {modules!r}: __import__(module)\n"
+        "print(time.perf_counter() - start)"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"WARNING: Importing {modules} failed: {result.stderr.strip().splitlines()[-1]}")
+        return None
+    return float(result.stdout.strip())
+
+def benchmark_import_time() -> dict:
+    """
+    Compare the startup cost of importing every backend and metric module up front, as the notebooks used to, with importing the registry and only the module a run uses.
+
+    Returns:
+        dict: The import time in seconds of each case, None if a dependency is missing.
+    """
+    backend_modules = sorted({module for module, _, _, _ in BACKENDS.values()})
+    cases = {
+        "all backends (eager)": ["LLMInterface", *backend_modules, "LocalLLM"],
+        "registry only": ["BackendRegistry"],
+        "registry + GPT-4": ["BackendRegistry", BACKENDS["GPT-4"][0]],
+        "registry + Artigenz-Coder-DS-6_7B": ["BackendRegistry", BACKENDS["Artigenz-Coder-DS-6_7B"][0]],
+        "metrics module": ["CodeMetricCalculator"],
+    }
+
+    results = {}
+    for name, modules in cases.items():
+        results[name] = _import_time(modules)
+        if results[name] is not None:
+            print(f"{name}: {results[name]:.3f}s")
+
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_import_time()
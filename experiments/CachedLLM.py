@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from LLMInterface import LLMInterface, accepts_sample_index
+from Telemetry import annotate_record
+
+class ResponseCache():
+    def __init__(self, cache_dir: str = ".llm-cache", max_size_bytes: int = 256 * 1024 * 1024) -> None:
+        """
+        Initialize a disk-backed, content-addressed response cache. Every entry is stored as a JSON file named after the hash of its key.
+        Once the cache grows beyond max_size_bytes, the least recently used entries are evicted.
+
+        Args:
+            cache_dir (str, optional): The directory to store the cache entries in. Defaults to ".llm-cache".
+            max_size_bytes (int, optional): The maximum total size of the cache entries. Defaults to 256 MiB.
+        """
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+
+        # entry path -> (size in bytes, last access time), rebuilt from disk so that the LRU order survives restarts
+        self._entries = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if file.endswith(".json"):
+                    path = os.path.join(root, file)
+                    stat = os.stat(path)
+                    self._entries[path] = (stat.st_size, stat.st_mtime)
+        self._size = sum(size for size, _ in self._entries.values())
+
+    @staticmethod
+    def make_key(backend: str, model_name: str, params: dict, sample_index: int, prompt: str) -> str:
+        """
+        Make the cache key for a generation.
+
+        Args:
+            backend (str): The name of the backend class.
+            model_name (str): The model name used by the backend.
+            params (dict): The sampling parameters of the generation.
+            sample_index (int): The index of the sample among samples of the same prompt.
+            prompt (str): The prompt.
+
+        Returns:
+            str: The hex digest identifying the generation.
+        """
+        key = {
+            "backend": backend,
+            "model_name": model_name,
+            "params": params,
+            "sample_index": sample_index,
+            "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> str:
+        """
+        Get a cached response.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            str: The cached response text, or None if the key is not cached.
+        """
+        path = self._path(key)
+        with self._lock:
+            if path not in self._entries:
+                return None
+
+            try:
+                with open(path, "r") as f:
+                    entry = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._remove(path)
+                return None
+
+            now = time.time()
+            os.utime(path, (now, now))
+            self._entries[path] = (self._entries[path][0], now)
+
+        return entry["response_text"]
+
+    def put(self, key: str, response_text: str, metadata: dict = None) -> None:
+        """
+        Store a response, evicting the least recently used entries if the cache grows too large.
+
+        Args:
+            key (str): The cache key.
+            response_text (str): The response text to store.
+            metadata (dict, optional): Extra information to keep next to the response, such as the backend and model name. Defaults to None.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._lock:
+            # write to a temporary file first so that a concurrent reader never sees a partial entry
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"response_text": response_text, "metadata": metadata or {}, "created": time.time()}, f)
+            os.replace(tmp_path, path)
+
+            if path in self._entries:
+                self._size -= self._entries[path][0]
+            size = os.path.getsize(path)
+            self._entries[path] = (size, time.time())
+            self._size += size
+
+            self._evict()
+
+    def _remove(self, path: str) -> None:
+        size, _ = self._entries.pop(path)
+        self._size -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        if self._size <= self.max_size_bytes:
+            return
+
+        for path, _ in sorted(self._entries.items(), key=lambda item: item[1][1]):
+            if self._size <= self.max_size_bytes:
+                break
+            self._remove(path)
+
+    def clear(self) -> None:
+        """
+        Remove every entry from the cache.
+        """
+        with self._lock:
+            for path in list(self._entries):
+                self._remove(path)
+
+
+class CachedLLM(LLMInterface):
+    def __init__(self, backend: LLMInterface, cache: ResponseCache = None) -> None:
+        """
+        Wrap any LLMInterface with a persistent response cache.
+
+        Responses are keyed by the sample index the caller passes, e.g. the generation index of a notebook loop, and not by how often the prompt was asked for before.
+        Re-running those loops, in the same kernel or a new one, therefore returns the same responses without calling the backend.
+
+        Args:
+            backend (LLMInterface): The model to cache the responses of.
+            cache (ResponseCache, optional): The cache to use. Defaults to a ResponseCache in ".llm-cache".
+        """
+        self.backend = backend
+        self.cache = cache if cache is not None else ResponseCache()
+        self.max_concurrency = backend.max_concurrency
+        self.model_name = getattr(backend, "model_name", None)
+
+    def generation_params(self) -> dict:
+        return self.backend.generation_params()
+
+    def _key(self, prompt: str, sample_index: int, kwargs: dict) -> tuple[str, int]:
+        params = {**self.backend.generation_params(), **kwargs}
+        key = ResponseCache.make_key(type(self.backend).__name__, self.model_name, params, sample_index, prompt)
+        return key, sample_index
+
+    def _backend_kwargs(self, sample_index: int, kwargs: dict) -> dict:
+        # a wrapped SingleFlightLLM must keep different samples of a prompt apart, plain backends do not take the sample index
+        if accepts_sample_index(self.backend):
+            return {**kwargs, "sample_index": sample_index}
+        return kwargs
+
+    def _metadata(self, sample_index: int) -> dict:
+        return {"backend": type(self.backend).__name__, "model_name": self.model_name, "sample_index": sample_index}
+
+    def generate(self, prompt: str, *args, sample_index: int = 1, refresh: bool = False, **kwargs) -> str:
+        """
+        Generate text based on the given prompt, serving it from the cache if this sample was generated before.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            sample_index (int, optional): The index of the sample to return, e.g. the generation index of the calling loop. Calls asking for several samples of a prompt must pass different indices. Defaults to 1.
+            refresh (bool, optional): If True, bypass the cache, generate a fresh sample and overwrite the cached one. Defaults to False.
+
+        Returns:
+            str: The string response from the model.
+        """
+        key, sample_index = self._key(prompt, sample_index, kwargs)
+
+        response_text = None if refresh else self.cache.get(key)
+        if response_text is None:
+            response_text = self.backend.generate(prompt, *args, **self._backend_kwargs(sample_index, kwargs))
+            self.cache.put(key, response_text, self._metadata(sample_index))
+        else:
+            annotate_record(cache_hit=True, input_tokens=0, output_tokens=0)
+
+        self.response_text = response_text
+        return response_text
+
+    async def agenerate(self, prompt: str, *args, sample_index: int = 1, refresh: bool = False, **kwargs) -> str:
+        """
+        Asynchronously generate text based on the given prompt, serving it from the cache if this sample was generated before.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            sample_index (int, optional): The index of the sample to return, e.g. the generation index of the calling loop. Calls asking for several samples of a prompt must pass different indices. Defaults to 1.
+            refresh (bool, optional): If True, bypass the cache, generate a fresh sample and overwrite the cached one. Defaults to False.
+
+        Returns:
+            str: The string response from the model.
+        """
+        key, sample_index = self._key(prompt, sample_index, kwargs)
+
+        response_text = None if refresh else self.cache.get(key)
+        if response_text is None:
+            response_text = await self.backend.agenerate(prompt, *args, **self._backend_kwargs(sample_index, kwargs))
+            self.cache.put(key, response_text, self._metadata(sample_index))
+        else:
+            annotate_record(cache_hit=True, input_tokens=0, output_tokens=0)
+
+        self.response_text = response_text
+        return response_text
+
+    def _cached_samples(self, prompt: str, n: int, refresh: bool, kwargs: dict) -> tuple[list[str], list[str]]:
+        keys = [self._key(prompt, sample_index, kwargs)[0] for sample_index in range(1, n + 1)]
+        sample_texts = [None if refresh else self.cache.get(key) for key in keys]
+        return keys, sample_texts
+
+    def _store_samples(self, keys: list[str], sample_texts: list[str], fresh_sample_texts: list[str]) -> list[str]:
+        missing = [i for i, sample_text in enumerate(sample_texts) if sample_text is None]
+        if not missing:
+            annotate_record(cache_hit=True, input_tokens=0, output_tokens=0)
+        for i, sample_text in zip(missing, fresh_sample_texts):
+            sample_texts[i] = sample_text
+            self.cache.put(keys[i], sample_text, self._metadata(i + 1))
+
+        self.sample_texts = sample_texts
+        return sample_texts
+
+    def generate_samples(self, prompt: str, n: int, refresh: bool = False, **kwargs) -> list[str]:
+        """
+        Generate samples 1 to n for the given prompt. Only the samples missing from the cache are generated, in a single generate_samples call on the backend.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            n (int): The number of samples to generate.
+            refresh (bool, optional): If True, bypass the cache and generate all n samples again. Defaults to False.
+
+        Returns:
+            list[str]: The n responses.
+        """
+        keys, sample_texts = self._cached_samples(prompt, n, refresh, kwargs)
+
+        missing_count = sample_texts.count(None)
+        fresh_sample_texts = self.backend.generate_samples(prompt, missing_count, **kwargs) if missing_count else []
+        return self._store_samples(keys, sample_texts, fresh_sample_texts)
+
+    async def agenerate_samples(self, prompt: str, n: int, refresh: bool = False, **kwargs) -> list[str]:
+        """
+        Asynchronously generate samples 1 to n for the given prompt. Only the samples missing from the cache are generated, in a single agenerate_samples call on the backend.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            n (int): The number of samples to generate.
+            refresh (bool, optional): If True, bypass the cache and generate all n samples again. Defaults to False.
+
+        Returns:
+            list[str]: The n responses.
+        """
+        keys, sample_texts = self._cached_samples(prompt, n, refresh, kwargs)
+
+        missing_count = sample_texts.count(None)
+        fresh_sample_texts = await self.backend.agenerate_samples(prompt, missing_count, **kwargs) if missing_count else []
+        return self._store_samples(keys, sample_texts, fresh_sample_texts)
+
+    def write_to_file(self, filename: str) -> None:
+        """
+        Write the last generated text to a file.
+
+        Args:
+            filename (str): The path to the file to write to.
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        with open(filename, "w") as f:
+            f.write(self.response_text)
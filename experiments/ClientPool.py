@@ -0,0 +1,155 @@
+import asyncio
+import importlib.util
+import json
+import threading
+import weakref
+from functools import lru_cache
+from dotenv import load_dotenv
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+import httpx
+
+# connection pool settings of the shared clients, change with configure_client_pool before the first client is created
+POOL_SETTINGS = {
+    "max_connections": 64,
+    "max_keepalive_connections": 32,
+    "keepalive_expiry": 60.0,
+    # HTTP/2 multiplexes concurrent requests over one connection, but needs the optional h2 package
+    "http2": importlib.util.find_spec("h2") is not None,
+}
+
+_clients = {}
+# async clients are bound to the event loop they are used on, so they are kept per loop
+_async_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+def configure_client_pool(**settings) -> None:
+    """
+    Change the connection pool settings used for clients created from now on.
+
+    Args:
+        **settings: Any of max_connections, max_keepalive_connections, keepalive_expiry and http2.
+    """
+    unknown = set(settings) - set(POOL_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown pool settings: {unknown}")
+
+    POOL_SETTINGS.update(settings)
+
+@lru_cache(maxsize=None)
+def load_environment() -> None:
+    """
+    Load the .env file once per process instead of once per backend instance.
+    """
+    load_dotenv()
+
+def _key(api_key: str, base_url: str, client_kwargs: dict) -> str:
+    return json.dumps([api_key, base_url, client_kwargs], sort_keys=True, default=str)
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=POOL_SETTINGS["max_connections"],
+        max_keepalive_connections=POOL_SETTINGS["max_keepalive_connections"],
+        keepalive_expiry=POOL_SETTINGS["keepalive_expiry"],
+    )
+
+def get_openai_client(api_key: str, base_url: str = None, **client_kwargs) -> OpenAI:
+    """
+    Get the OpenAI client shared by every backend with the same base URL, API key and client options, so that they reuse one pool of warm keep-alive connections.
+
+    Args:
+        api_key (str): The API key.
+        base_url (str, optional): The base URL of the OpenAI-compatible API. Defaults to None, i.e. the OpenAI API.
+        **client_kwargs: Other arguments for OpenAI, e.g. max_retries.
+
+    Returns:
+        OpenAI: The shared client.
+    """
+    key = _key(api_key, base_url, client_kwargs)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=DefaultHttpxClient(limits=_limits(), http2=POOL_SETTINGS["http2"]),
+                **client_kwargs
+            )
+        return _clients[key]
+
+def get_async_openai_client(api_key: str, base_url: str = None, **client_kwargs) -> AsyncOpenAI:
+    """
+    Get the AsyncOpenAI client shared by every backend with the same base URL, API key and client options on the running event loop.
+
+    Args:
+        api_key (str): The API key.
+        base_url (str, optional): The base URL of the OpenAI-compatible API. Defaults to None, i.e. the OpenAI API.
+        **client_kwargs: Other arguments for AsyncOpenAI, e.g. max_retries.
+
+    Returns:
+        AsyncOpenAI: The shared client.
+    """
+    loop = asyncio.get_running_loop()
+    key = _key(api_key, base_url, client_kwargs)
+    with _clients_lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        if key not in loop_clients:
+            loop_clients[key] = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=DefaultAsyncHttpxClient(limits=_limits(), http2=POOL_SETTINGS["http2"]),
+                **client_kwargs
+            )
+        return loop_clients[key]
+
+def close_clients() -> None:
+    """
+    Close every shared synchronous client and its connections.
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def benchmark_connection_reuse(request_count: int = 200, concurrency: int = 16, delay: float = 0.005) -> dict:
+    """
+    Compare a fresh client per request with the shared pooled client against a local stub server.
+    Reports the wall time and the number of TCP connections the server accepted in each case.
+
+    Args:
+        request_count (int, optional): Number of requests per case. Defaults to 200.
+        concurrency (int, optional): Number of requests in flight at once. Defaults to 16.
+        delay (float, optional): Seconds the stub server waits before answering. Defaults to 0.005.
+
+    Returns:
+        dict: The wall time and connection count of each case.
+    """
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from StubServer import StubOpenAIServer
+
+    def run(make_client) -> dict:
+        with StubOpenAIServer(delay=delay) as server:
+            def request(_):
+                client = make_client(server.base_url)
+                client.chat.completions.create(model="stub", messages=[{"role": "user", "content": "ping"}])
+
+            start_time = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(request, range(request_count)))
+            elapsed = time.perf_counter() - start_time
+
+            return {"seconds": elapsed, "requests_per_second": request_count / elapsed, "connections": server.connection_count}
+
+    results = {
+        "fresh client per request": run(lambda base_url: OpenAI(api_key="stub", base_url=base_url, max_retries=0)),
+        "shared pooled client": run(lambda base_url: get_openai_client("stub", base_url, max_retries=0)),
+    }
+
+    for name, result in results.items():
+        print(f"{name}: {result['seconds']:.2f}s ({result['requests_per_second']:.0f} req/s), {result['connections']} connections for {request_count} requests")
+
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_connection_reuse()
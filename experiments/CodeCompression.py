@@ -0,0 +1,164 @@
+import importlib
+import os
+import re
+from functools import lru_cache
+from PromptBudget import count_tokens
+from PromptTemplate import read_cached
+
+# language -> (grammar module, function returning the grammar). tree-sitter itself comes with codebleu, the grammars with codebleu[all] and tree-sitter-typescript.
+GRAMMARS = {
+    "python": ("tree_sitter_python", "language"),
+    "js": ("tree_sitter_javascript", "language"),
+    "javascript": ("tree_sitter_javascript", "language"),
+    "ts": ("tree_sitter_typescript", "language_typescript"),
+    "typescript": ("tree_sitter_typescript", "language_typescript"),
+    "tsx": ("tree_sitter_typescript", "language_tsx"),
+}
+
+# context files are compressed by their own language, so that e.g. the JSON and YAML files of a TS codebase are kept as they are
+EXTENSION_LANGUAGES = {".py": "python", ".js": "js", ".mjs": "js", ".cjs": "js", ".jsx": "js", ".ts": "ts", ".mts": "ts", ".cts": "ts", ".tsx": "tsx"}
+
+COMMENT_NODES = {"comment"}
+STRING_NODES = {"string", "template_string"}
+# strings with these children are f-strings or template literals with code inside, which are kept whole
+INTERPOLATION_NODES = {"interpolation", "template_substitution"}
+
+BLANK_RUN = re.compile(r"\n(?:[ \t]*\n){2,}")
+
+@lru_cache(maxsize=None)
+def get_parser(language: str):
+    """
+    Get a tree-sitter parser for a language, or None if tree-sitter or the grammar of the language is not installed.
+
+    Args:
+        language (str): The language of the codebase, e.g. "python", "JS" or "TS".
+
+    Returns:
+        The parser, or None.
+    """
+    grammar = GRAMMARS.get(language.lower())
+    if grammar is None:
+        return None
+
+    try:
+        from tree_sitter import Language, Parser
+        module = importlib.import_module(grammar[0])
+    except ImportError as e:
+        # parsers are cached, so this is printed once per language
+        print(f"WARNING: Could not load the tree-sitter grammar of {language}, its files are not compressed: {e}")
+        return None
+
+    return Parser(Language(getattr(module, grammar[1])()))
+
+def _line_start(source: bytes, position: int) -> int:
+    return source.rfind(b"\n", 0, position) + 1
+
+def _shorten(source: bytes, node, max_string_length: int) -> bytes:
+    # the delimiters, e.g. r""" and """, are the first and last children
+    start, end = node.children[0].end_byte, node.children[-1].start_byte
+    content = source[start:end].decode("utf-8", errors="ignore")
+    first_line = content.strip().split("\n", 1)[0]
+    if len(content) <= max_string_length and "\n" not in content.strip():
+        return None
+
+    # do not leave a dangling escape at the cut
+    shortened = first_line[:max_string_length].rstrip("\\")
+    return source[node.start_byte:start] + f"{shortened}...".encode("utf-8") + source[end:node.end_byte]
+
+@lru_cache(maxsize=128)
+def compress_source(text: str, language: str, max_string_length: int = 80) -> str:
+    """
+    Compress source code for a prompt while keeping its signatures and control flow: comments, including license headers and JSDoc, are removed,
+    string literals and docstrings longer than max_string_length or spanning several lines are cut to their first line, and runs of blank lines are collapsed.
+    Code that cannot be parsed, or in a language without an installed grammar, is returned as it is.
+
+    Args:
+        text (str): The source code.
+        language (str): The language of the code, e.g. "python", "JS" or "TS".
+        max_string_length (int, optional): The maximum length of the contents of a string literal kept whole. Defaults to 80.
+
+    Returns:
+        str: The compressed source code.
+    """
+    parser = get_parser(language)
+    if parser is None:
+        return text
+
+    source = text.encode("utf-8")
+    tree = parser.parse(source)
+    if tree.root_node.has_error:
+        return text
+
+    # (start, end, replacement) of the removed and shortened nodes, in source order
+    edits = []
+    stack = [tree.root_node]
+    while stack:
+        node = stack.pop()
+        if node.type in COMMENT_NODES:
+            start, end = node.start_byte, node.end_byte
+            line_start = _line_start(source, start)
+            line_end = source.find(b"\n", end)
+            line_end = len(source) if line_end == -1 else line_end
+            if source[line_start:start].strip():
+                # a trailing comment goes with the spaces before it
+                start = len(source[:start].rstrip(b" \t"))
+            elif source[end:line_end].strip():
+                # a comment before code on its line goes with the spaces after it
+                end = line_end - len(source[end:line_end].lstrip(b" \t"))
+            else:
+                # a comment on lines of its own goes with its lines
+                start, end = line_start, min(line_end + 1, len(source))
+            edits.append((start, end, b""))
+        elif node.type in STRING_NODES and len(node.children) >= 2 and not any(child.type in INTERPOLATION_NODES for child in node.children):
+            replacement = _shorten(source, node, max_string_length)
+            if replacement is not None:
+                edits.append((node.start_byte, node.end_byte, replacement))
+        else:
+            stack.extend(node.children)
+
+    parts = []
+    position = 0
+    for start, end, replacement in sorted(edits):
+        # comments on consecutive lines share their line breaks
+        start = max(start, position)
+        parts.append(source[position:start])
+        parts.append(replacement)
+        position = max(position, end)
+    parts.append(source[position:])
+
+    compressed = b"".join(parts).decode("utf-8")
+    return BLANK_RUN.sub("\n\n", compressed).strip("\n") + ("\n" if text.endswith("\n") else "")
+
+def compress_file(path: str, max_string_length: int = 80) -> str:
+    """
+    Read a source file compressed with compress_source, in the language of its extension. Files of other languages are returned as they are.
+    """
+    text = read_cached(path)
+    language = EXTENSION_LANGUAGES.get(os.path.splitext(path)[1].lower())
+    return compress_source(text, language, max_string_length) if language is not None else text
+
+def read_source(path: str, compress: bool = False) -> str:
+    """
+    Read a source file to inline in a prompt, compressed with compress_file if compress is set.
+    """
+    return compress_file(path) if compress else read_cached(path)
+
+def report_compression(paths: list[str], model_name: str = "") -> list[dict]:
+    """
+    Print and return the token reduction of compressing each source file, to measure the savings on the summarization calls.
+
+    Args:
+        paths (list[str]): The source files.
+        model_name (str, optional): The model name to count tokens with. Defaults to "" (estimated counts).
+
+    Returns:
+        list[dict]: The path, tokens before and tokens after compression of every file.
+    """
+    reports = [{"path": path, "tokens_before": count_tokens(read_cached(path), model_name), "tokens_after": count_tokens(compress_file(path), model_name)} for path in paths]
+
+    for report in reports:
+        print(f"{report['path']}: {report['tokens_before']} -> {report['tokens_after']} tokens")
+    before = sum(report["tokens_before"] for report in reports)
+    after = sum(report["tokens_after"] for report in reports)
+    print(f"Compressed {len(reports)} files from {before} to {after} tokens ({1 - after / before if before else 0:.0%} fewer)")
+    return reports
@@ -1,13 +1,8 @@
-from pygount import SourceAnalysis
 import json
-from dotenv import load_dotenv
-from complexipy import file_complexity
-from tqdm.notebook import tqdm
-from radon.complexity import cc_visit
 import subprocess
 import re
-import radon
-import radon.metrics
+
+# the metric libraries are imported inside the functions using them, so that importing this module stays cheap
 
 
 def get_loc(filepath: str):
@@ -20,6 +15,8 @@ def get_loc(filepath: str):
     Returns:
         int: The number of lines of code   
     """
+    from pygount import SourceAnalysis
+
     analysis = SourceAnalysis.from_file(filepath, "pygount")
     return analysis.code
 
@@ -34,6 +31,8 @@ def get_cog_complexity_py(filepath: str):
     Returns:
         int: The cognitive complexity of the file
     """
+    from complexipy import file_complexity
+
     fc = file_complexity(filepath)
     return fc.complexity
 
@@ -75,6 +74,8 @@ def get_cc_py(python_file_path: str):
     Returns:
         int: The cyclomatic complexity of the file
     """
+    from radon.complexity import cc_visit
+
     with open(python_file_path, 'r') as f:
         code = f.read()
 
@@ -118,6 +119,8 @@ def get_halstead_py(filepath: str):
     Returns:
         int: The Halstead volume of the file
     """
+    import radon.metrics
+
     with open(filepath, 'r') as f:
         code = f.read()
 
@@ -0,0 +1,301 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from CachedLLM import ResponseCache
+from CodeCompression import read_source, report_compression
+from CreatePrompt import CreatePrompt
+from LLMInterface import LLMInterface, generate_all
+from PromptBudget import PromptBudgeter, count_tokens
+from PromptTemplate import load_template, read_cached
+
+UPDATE_PROMPT_TEMPLATE = "prompt-templates/codebase-summary-update-prompt-template.txt"
+CHUNK_PROMPT_TEMPLATE = "prompt-templates/codebase-chunk-summary-prompt-template.txt"
+MERGE_PROMPT_TEMPLATE = "prompt-templates/codebase-summary-merge-prompt-template.txt"
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SummaryStore():
+    def __init__(self, store_dir: str = ".summary-store") -> None:
+        """
+        Initialize a store of codebase summaries, keyed by the summarization template, language, model and the exact set of context files with their contents.
+
+        Args:
+            store_dir (str, optional): The directory to store the summaries in. Defaults to ".summary-store".
+        """
+        self.store_dir = store_dir
+        self._lock = threading.Lock()
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(template_sha256: str, language: str, model_name: str, files: dict) -> str:
+        """
+        Make the key of a summary.
+
+        Args:
+            template_sha256 (str): The hash of the summarization template.
+            language (str): The language of the codebase.
+            model_name (str): The model name of the summarizing model.
+            files (dict): Mapping of context file path to the hash of its contents.
+
+        Returns:
+            str: The hex digest identifying the summary.
+        """
+        key = {"template_sha256": template_sha256, "language": language, "model_name": model_name, "files": sorted(files.items())}
+        return _sha256(json.dumps(key, sort_keys=True))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.store_dir, f"{key}.json")
+
+    def get(self, key: str) -> dict:
+        """
+        Get a stored summary entry, or None if the key is not stored.
+        """
+        try:
+            with open(self._path(key), "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, entry: dict) -> None:
+        with self._lock:
+            # write to a temporary file first so that a concurrent reader never sees a partial entry
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+
+    def entries(self) -> list[dict]:
+        entries = []
+        for file in os.listdir(self.store_dir):
+            if file.endswith(".json"):
+                entry = self.get(file[:-len(".json")])
+                if entry is not None:
+                    entries.append(entry)
+        return entries
+
+    def closest(self, template_sha256: str, language: str, model_name: str, files: dict, max_depth: int) -> dict:
+        """
+        Find the stored summary of the same template, language and model whose context files overlap most with files, counting a file as shared only if its contents are unchanged.
+
+        Returns:
+            dict: The entry, with its overlap (shared files over all files of both sets) under "overlap", or None if no summary shares a file.
+        """
+        best = None
+        for entry in self.entries():
+            if (entry["template_sha256"], entry["language"], entry["model_name"]) != (template_sha256, language, model_name) or entry["depth"] >= max_depth:
+                continue
+
+            shared = sum(1 for path, sha256 in files.items() if entry["files"].get(path) == sha256)
+            overlap = shared / len(set(files) | set(entry["files"]))
+            if shared and (best is None or overlap > best["overlap"]):
+                best = {**entry, "overlap": overlap}
+        return best
+
+
+def _file_blocks(path: str, language: str, model_name: str, max_tokens: int, compress: bool = False) -> list[tuple[str, int]]:
+    """
+    Format a context file as in the summarization prompt, split by lines into several blocks if it does not fit max_tokens on its own.
+
+    Returns:
+        list[tuple[str, int]]: The blocks with their token counts.
+    """
+    text = read_source(path, compress)
+    block = f"\n\n{path}\n```{language}\n{text}\n```"
+    tokens = count_tokens(block, model_name)
+    if tokens <= max_tokens:
+        return [(block, tokens)]
+
+    lines = text.splitlines(keepends=True)
+    pieces = math.ceil(tokens / max_tokens)
+    while True:
+        size = math.ceil(len(lines) / pieces)
+        blocks = [f"\n\n{path} (part {i + 1} of {pieces})\n```{language}\n{''.join(lines[i * size:(i + 1) * size])}\n```" for i in range(pieces)]
+        counts = [count_tokens(block, model_name) for block in blocks]
+        if max(counts) <= max_tokens or size <= 1:
+            return list(zip(blocks, counts))
+        pieces += 1
+
+def chunk_context_files(paths: list[str], language: str, model_name: str, max_tokens: int, compress: bool = False) -> list[str]:
+    """
+    Pack context files into chunks of at most max_tokens, in path order, so that the chunks, and so their cached summaries, stay the same when other files change.
+
+    Args:
+        paths (list[str]): The context files.
+        language (str): The language of the codebase.
+        model_name (str): The model name of the summarizing model, to count tokens with.
+        max_tokens (int): The token budget of a chunk.
+        compress (bool, optional): Whether to compress the Python, JS and TS files with CodeCompression. Defaults to False.
+
+    Returns:
+        list[str]: The chunks, each the formatted files it holds.
+    """
+    chunks = []
+    chunk, chunk_tokens = [], 0
+    for path in sorted(set(paths)):
+        for block, tokens in _file_blocks(path, language, model_name, max_tokens, compress):
+            if chunk and chunk_tokens + tokens > max_tokens:
+                chunks.append("".join(chunk))
+                chunk, chunk_tokens = [], 0
+            chunk.append(block)
+            chunk_tokens += tokens
+    if chunk:
+        chunks.append("".join(chunk))
+    return chunks
+
+def _generate_cached(model: LLMInterface, prompts: list[str], cache: ResponseCache, level: int) -> list[str]:
+    """
+    Generate the responses to prompts concurrently, reusing the responses to prompts that were seen before.
+    """
+    model_name = getattr(model, "model_name", None)
+    keys = [ResponseCache.make_key(type(model).__name__, model_name, model.generation_params(), 1, prompt) for prompt in prompts]
+    responses = [cache.get(key) for key in keys]
+
+    missing = [i for i, response in enumerate(responses) if response is None]
+
+    def store(index: int, response: str) -> None:
+        # parts are cached as they finish, so a rerun after a failed part only summarizes the failed parts
+        responses[missing[index]] = response
+        cache.put(keys[missing[index]], response, {"model_name": model_name, "summary_level": level})
+
+    errors = [result for result in generate_all([(model, prompts[i], {"summary_level": level}) for i in missing], on_result=store) if isinstance(result, Exception)]
+    if errors:
+        raise errors[0]
+
+    print(f"Summary level {level}: {len(missing)} of {len(prompts)} parts summarized, {len(prompts) - len(missing)} reused")
+    return responses
+
+def summarize_in_chunks(config: dict, model: LLMInterface, cache: ResponseCache = None, max_chunk_tokens: int = None, merge_fan_in: int = 4, compress: bool = False) -> str:
+    """
+    Summarize a codebase too large for one prompt: the context files are split into token-bounded chunks, the chunks are summarized concurrently,
+    and the partial summaries are merged merge_fan_in at a time, level by level, into one summary.
+    Every chunk and merge is cached by the hash of its prompt, so editing one file only summarizes its chunk and the merges above it again.
+
+    Args:
+        config (dict): The experiment config.
+        model (LLMInterface): The summarizing model, e.g. Gemini.
+        cache (ResponseCache, optional): The cache of partial summaries. Defaults to a ResponseCache in ".summary-store/parts".
+        max_chunk_tokens (int, optional): The token budget of every chunk and merge prompt. Defaults to 30000, or less if the context window of the model is smaller.
+        merge_fan_in (int, optional): The maximum number of partial summaries merged by one prompt. Defaults to 4.
+        compress (bool, optional): Whether to compress the Python, JS and TS context files with CodeCompression. Defaults to False.
+
+    Returns:
+        str: The codebase summary.
+    """
+    cache = cache if cache is not None else ResponseCache(os.path.join(".summary-store", "parts"))
+    model_name = getattr(model, "model_name", None) or ""
+    if max_chunk_tokens is None:
+        max_chunk_tokens = min(30000, PromptBudgeter(model_name).max_prompt_tokens or 30000)
+    chunk_template = load_template(CHUNK_PROMPT_TEMPLATE)
+    merge_template = load_template(MERGE_PROMPT_TEMPLATE)
+
+    paths = read_cached(config["files_to_summarize_paths"]).splitlines()
+    chunks = chunk_context_files(paths, config["language"], model_name, max_chunk_tokens - count_tokens(chunk_template.text, model_name), compress)
+    summaries = _generate_cached(model, [chunk_template.render({"files": chunk}) for chunk in chunks], cache, 0)
+
+    merge_budget = max_chunk_tokens - count_tokens(merge_template.text, model_name)
+    level = 0
+    while len(summaries) > 1:
+        level += 1
+        groups = [[]]
+        group_tokens = 0
+        for summary in summaries:
+            tokens = count_tokens(summary, model_name)
+            # every group merges at least two summaries, so that each level shrinks
+            if len(groups[-1]) >= merge_fan_in or (len(groups[-1]) >= 2 and group_tokens + tokens > merge_budget):
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(summary)
+            group_tokens += tokens
+
+        prompts = [merge_template.render({"partial_summaries": "".join(f"\n\nSummary of part {i + 1}:\n{summary}" for i, summary in enumerate(group))}) for group in groups if len(group) > 1]
+        merged = iter(_generate_cached(model, prompts, cache, level))
+        summaries = [next(merged) if len(group) > 1 else group[0] for group in groups]
+
+    return summaries[0]
+
+def summarize_codebase(config: dict, model: LLMInterface, store: SummaryStore = None, min_overlap: float = 0.5, max_depth: int = 3, chunked: bool = None, compress: bool = False) -> str:
+    """
+    Summarize the codebase of a config, reusing the summaries of other configs of the same repository.
+    A config with the same template, language, model and context files as a summarized one reuses its summary without calling the model.
+    If a summary shares at least min_overlap of the context files, only the added, changed and removed files are sent to the model to update it.
+    Otherwise the whole codebase is summarized as before. The summary is written to the config's codebase_summary_save_path and the prompt sent to its codebase_summary_prompt_save_path.
+
+    Args:
+        config (dict): The experiment config.
+        model (LLMInterface): The summarizing model, e.g. Gemini.
+        store (SummaryStore, optional): The store of summaries. Defaults to a SummaryStore in ".summary-store".
+        min_overlap (float, optional): The share of context files a stored summary must have in common to be updated rather than summarizing from scratch. Defaults to 0.5.
+        max_depth (int, optional): The maximum number of updates in a row before summarizing from scratch, so that errors do not pile up. Defaults to 3.
+        chunked (bool, optional): Whether to summarize from scratch in chunks with summarize_in_chunks. Defaults to None, i.e. only if the summarization prompt does not fit the context window of the model.
+        compress (bool, optional): Whether to strip comments, long strings and blank runs from the Python, JS and TS context files (CodeCompression.py) and print the token reduction of the files sent. Defaults to False.
+
+    Returns:
+        str: The codebase summary.
+    """
+    store = store if store is not None else SummaryStore()
+    template = load_template(config["codebase_summary_prompt_template"])
+    template_sha256 = _sha256(template.text)
+    model_name = getattr(model, "model_name", None) or type(model).__name__
+
+    context_files = read_cached(config["files_to_summarize_paths"]).splitlines()
+    # the hashes of the contents sent, so that compressed and uncompressed summaries are stored apart
+    files = {path: _sha256(read_source(path, compress)) for path in context_files}
+    key = SummaryStore.make_key(template_sha256, config["language"], model_name, files)
+
+    entry = store.get(key)
+    if entry is not None:
+        print(f"Reusing the codebase summary of {len(files)} files")
+        summary = entry["summary"]
+    else:
+        base = store.closest(template_sha256, config["language"], model_name, files, max_depth)
+        start_time = time.perf_counter()
+
+        if base is not None and base["overlap"] >= min_overlap:
+            changed = [path for path in context_files if base["files"].get(path) != files[path]]
+            removed = [path for path in base["files"] if path not in files]
+            prompt = load_template(UPDATE_PROMPT_TEMPLATE).render({
+                "codebase_summary": base["summary"],
+                "removed_files": "\n".join(removed) or "None",
+                "changed_files": "".join(f"\n\n{path}\n```{config['language']}\n{read_source(path, compress)}\n```" for path in changed),
+            })
+            if compress:
+                report_compression(changed, model_name)
+            _write(config["codebase_summary_prompt_save_path"], prompt)
+            summary = model.generate(prompt)
+            depth = base["depth"] + 1
+            print(f"Updated a codebase summary for {len(changed)} added or changed and {len(removed)} removed files in {time.perf_counter() - start_time:.1f}s")
+        else:
+            prompt = CreatePrompt.create_summary_prompt(config["codebase_summary_prompt_template"], config["files_to_summarize_paths"], config["language"], config["codebase_summary_prompt_save_path"], compress, model_name)
+            if chunked is None:
+                chunked = not PromptBudgeter(model_name).fits(prompt)
+
+            if chunked:
+                summary = summarize_in_chunks(config, model, ResponseCache(os.path.join(store.store_dir, "parts")), compress=compress)
+            else:
+                summary = model.generate(prompt)
+            depth = 0
+            print(f"Summarized a codebase of {len(files)} files{' in chunks' if chunked else ''} in {time.perf_counter() - start_time:.1f}s")
+
+        store.put(key, {
+            "template_sha256": template_sha256,
+            "language": config["language"],
+            "model_name": model_name,
+            "files": files,
+            "summary": summary,
+            "depth": depth,
+            "created": time.time(),
+        })
+
+    _write(config["codebase_summary_save_path"], summary)
+    return summary
+
+def _write(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "w") as f:
+        f.write(text)
@@ -1,4 +1,25 @@
 import os
+import re
+from CodeCompression import read_source, report_compression
+from PromptBudget import PromptBudgeter
+from PromptTemplate import compile_template, load_template, read_cached
+
+def example_block(i: int) -> str:
+    """
+    Get the i-th example, numbered from 1, as it appears in the type3 template.
+    """
+    return f"Description: {{example_function_description_{i}}}\nFunction_code: \n```\n{{example_function_code_{i}}}\n```\n"
+
+def expand_examples(template_text: str, count: int) -> str:
+    """
+    Repeat or remove the examples of a type3 template so that it has count of them, e.g. for examples picked by ExampleIndex.
+    A template with as many examples, or whose examples are not laid out as example_block, is returned as it is.
+    """
+    slots = len(set(re.findall(r"\{example_function_description_(\d+)\}", template_text)))
+    examples = "\n".join(example_block(i + 1) for i in range(slots))
+    if slots == count or not examples or examples not in template_text:
+        return template_text
+    return template_text.replace(examples, "\n".join(example_block(i + 1) for i in range(count)))
 
 class CreatePrompt():
     def __init__(self):
@@ -7,7 +28,7 @@ class CreatePrompt():
         """
         pass
 
-    def create_summary_prompt(codebase_summary_prompt_template: str, files_to_summarize_paths: str, language: str, codebase_summary_prompt_save_path: str) -> str:
+    def create_summary_prompt(codebase_summary_prompt_template: str, files_to_summarize_paths: str, language: str, codebase_summary_prompt_save_path: str, compress: bool = False, model_name: str = "") -> str:
         """
         Create a prompt for summarization based on the given context files.
 
@@ -16,20 +37,18 @@ class CreatePrompt():
             files_to_summarize_paths (str): The path to the file containing the paths of the files to summarize.
             language (str): The language of the codebase.
             codebase_summary_prompt_save_path (str): The path to save the generated prompt.
+            compress (bool, optional): Whether to strip comments, long strings and blank runs from the Python, JS and TS context files (CodeCompression.py) and print the token reduction of each file. Defaults to False.
+            model_name (str, optional): The model name of the summarizing model, to count the tokens of the reduction with. Defaults to "" (estimated counts).
 
         Returns:
             str: The generated summarization prompt.
         """
 
-        with open(codebase_summary_prompt_template, 'r') as f:
-            summarization_prompt = f.read()
+        context_files = read_cached(files_to_summarize_paths).splitlines()
+        if compress:
+            report_compression(context_files, model_name)
 
-        with open(files_to_summarize_paths, 'r') as f:
-            context_files = f.read().splitlines()
-
-        for file in context_files:
-            with open(file, "r") as f:
-                summarization_prompt += f"\n\n{file}\n```{language}\n{f.read()}\n```"
+        summarization_prompt = "".join([read_cached(codebase_summary_prompt_template), *(f"\n\n{file}\n```{language}\n{read_source(file, compress)}\n```" for file in context_files)])
         
         os.makedirs(os.path.dirname(codebase_summary_prompt_save_path), exist_ok=True)
 
@@ -38,7 +57,7 @@ class CreatePrompt():
             
         return summarization_prompt
 
-    def create_func_description_prompt(function_description_prompt_template: str, chosen_function_path: str, language: str, function_description_prompt_save_path: str) -> str:
+    def create_func_description_prompt(function_description_prompt_template: str, chosen_function_path: str, language: str, function_description_prompt_save_path: str, compress: bool = False, model_name: str = "") -> str:
         """
         Create a prompt for function description based on the given function file.
 
@@ -47,16 +66,17 @@ class CreatePrompt():
             chosen_function_path (str): The path to the chosen function file.
             language (str): The language of the function.
             function_description_prompt_save_path (str): The path to save the generated prompt.
+            compress (bool, optional): Whether to strip comments, long strings and blank runs from the function file (CodeCompression.py) and print its token reduction. Defaults to False.
+            model_name (str, optional): The model name of the describing model, to count the tokens of the reduction with. Defaults to "" (estimated counts).
 
         Returns:
             str: The generated function description prompt.
         """
-        
-        with open(function_description_prompt_template, 'r') as f:
-            func_description_prompt = f.read()
 
-        with open(chosen_function_path, "r") as f:
-            func_description_prompt += f"\n\n{chosen_function_path}\n```{language}\n{f.read()}\n```"
+        if compress:
+            report_compression([chosen_function_path], model_name)
+
+        func_description_prompt = f"{read_cached(function_description_prompt_template)}\n\n{chosen_function_path}\n```{language}\n{read_source(chosen_function_path, compress)}\n```"
 
         os.makedirs(os.path.dirname(function_description_prompt_save_path), exist_ok=True)
 
@@ -65,7 +85,7 @@ class CreatePrompt():
 
         return func_description_prompt
     
-    def create_func_generation_prompt_type1(function_generation_prompt_template_type1: str, codebase_readme_path: str, function_description_save_path: str, function_generation_prompt_type1_save_path: str) -> str:
+    def create_func_generation_prompt_type1(function_generation_prompt_template_type1: str, codebase_readme_path: str, function_description_save_path: str, function_generation_prompt_type1_save_path: str, model_name: str = None, reserve_tokens: int = 1024) -> str:
         """
         Create a prompt for function generation based on the codebase README and function description.
 
@@ -74,21 +94,20 @@ class CreatePrompt():
             codebase_readme_path (str): The path to the codebase README file.
             function_description_save_path (str): The path to the function description file.
             function_generation_prompt_type1_save_path (str): The path to save the generated prompt.
+            model_name (str, optional): If set, the tail of the README is cut to fit the context window of this model, e.g. the model with the smallest window in the run. Defaults to None (no budgeting).
+            reserve_tokens (int, optional): Tokens to keep free for the response when budgeting. Defaults to 1024.
 
         Returns:
             str: The generated function generation prompt.
         """
 
-        with open(function_generation_prompt_template_type1, 'r') as f:
-            function_generation_prompt = f.read()
-
-        with open(codebase_readme_path, 'r') as f:
-            codebase_readme = f.read()
-
-        with open(function_description_save_path, 'r') as f:
-            function_description = f.read()
+        template = load_template(function_generation_prompt_template_type1)
 
-        function_generation_prompt = function_generation_prompt.replace('{codebase_readme}', codebase_readme).replace('{function_description}', function_description)
+        sections = {"codebase_readme": read_cached(codebase_readme_path), "function_description": read_cached(function_description_save_path)}
+        if model_name is None:
+            function_generation_prompt = template.render(sections)
+        else:
+            function_generation_prompt = PromptBudgeter(model_name, reserve_tokens).fit(template.text, sections, [("truncate", "codebase_readme")])
 
         os.makedirs(os.path.dirname(function_generation_prompt_type1_save_path), exist_ok=True)
 
@@ -97,7 +116,7 @@ class CreatePrompt():
 
         return function_generation_prompt
     
-    def create_func_generation_prompt_type2(func_generation_prompt_template_file_type2: str, codebase_summary_file_path: str, func_description_file_path: str, function_generation_prompt_type2_save_path: str) -> str:
+    def create_func_generation_prompt_type2(func_generation_prompt_template_file_type2: str, codebase_summary_file_path: str, func_description_file_path: str, function_generation_prompt_type2_save_path: str, model_name: str = None, reserve_tokens: int = 1024) -> str:
         """
         Create a prompt for function generation based on the codebase summary and function description.
 
@@ -106,21 +125,20 @@ class CreatePrompt():
             codebase_summary_file_path (str): The path to the codebase summary file.
             func_description_file_path (str): The path to the function description file.
             function_generation_prompt_type2_save_path (str): The path to save the generated prompt.
+            model_name (str, optional): If set, the tail of the codebase summary is cut to fit the context window of this model, e.g. the model with the smallest window in the run. Defaults to None (no budgeting).
+            reserve_tokens (int, optional): Tokens to keep free for the response when budgeting. Defaults to 1024.
 
         Returns:
             str: The generated function generation prompt.
         """
         
-        with open(func_generation_prompt_template_file_type2, 'r') as f:
-            function_generation_prompt = f.read()
+        template = load_template(func_generation_prompt_template_file_type2)
 
-        with open(codebase_summary_file_path, 'r') as f:
-            codebase_summary = f.read()
-
-        with open(func_description_file_path, 'r') as f:
-            function_description = f.read()
-
-        function_generation_prompt = function_generation_prompt.replace('{codebase_summary}', codebase_summary).replace('{function_description}', function_description)
+        sections = {"codebase_summary": read_cached(codebase_summary_file_path), "function_description": read_cached(func_description_file_path)}
+        if model_name is None:
+            function_generation_prompt = template.render(sections)
+        else:
+            function_generation_prompt = PromptBudgeter(model_name, reserve_tokens).fit(template.text, sections, [("truncate", "codebase_summary")])
 
         os.makedirs(os.path.dirname(function_generation_prompt_type2_save_path), exist_ok=True)
 
@@ -129,37 +147,39 @@ class CreatePrompt():
 
         return function_generation_prompt
     
-    def create_func_generation_prompt_type3(function_generation_prompt_template_type3: str, codebase_summary_save_path: str, example_functions: list, function_description_save_path: str, function_generation_prompt_type3_save_path: str) -> str:
+    def create_func_generation_prompt_type3(function_generation_prompt_template_type3: str, codebase_summary_save_path: str, example_functions: list, function_description_save_path: str, function_generation_prompt_type3_save_path: str, model_name: str = None, reserve_tokens: int = 1024) -> str:
         """
         Create a prompt for function generation based on the codebase summary, example functions and function description.
 
         Args:
             function_generation_prompt_template_type3 (str): The path to the template file for function generation.
             codebase_summary_save_path (str): The path to the codebase summary file.
-            example_functions (list): List of example functions to include in the prompt.
+            example_functions (list): List of example functions to include in the prompt, as [description path, code path] pairs. The examples of the template are repeated or removed to match, e.g. for the examples picked by retrieve_example_functions (ExampleIndex.py).
             function_description_save_path (str): The path to the function description file.
             function_generation_prompt_type3_save_path (str): The path to save the generated prompt.
+            model_name (str, optional): If set, the examples are dropped, last first, and then the tail of the codebase summary is cut to fit the context window of this model, e.g. the model with the smallest window in the run. Defaults to None (no budgeting).
+            reserve_tokens (int, optional): Tokens to keep free for the response when budgeting. Defaults to 1024.
 
         Returns:
             str: The generated function generation prompt.
         """
     
-        with open(function_generation_prompt_template_type3, 'r') as f:
-            function_generation_prompt = f.read()
-
-        with open(codebase_summary_save_path, 'r') as f:
-            codebase_summary = f.read()
-
-        with open(function_description_save_path, 'r') as f:
-            function_description = f.read()
+        template = compile_template(expand_examples(load_template(function_generation_prompt_template_type3).text, len(example_functions)))
 
+        sections = {}
+        cuts = []
         for i, example_function in enumerate(example_functions):
-            with open(example_function[0], 'r') as f:
-                function_generation_prompt = function_generation_prompt.replace(f'{{example_function_description_{i+1}}}', f.read())
-            with open(example_function[1], 'r') as f:
-                function_generation_prompt = function_generation_prompt.replace(f'{{example_function_code_{i+1}}}', f.read())
-
-        function_generation_prompt = function_generation_prompt.replace('{codebase_summary}', codebase_summary).replace('{function_description}', function_description)
+            sections[f'example_function_description_{i+1}'] = read_cached(example_function[0])
+            sections[f'example_function_code_{i+1}'] = read_cached(example_function[1])
+            # the whole example, as it appears in the template, is dropped when the prompt is too long
+            cuts.insert(0, ("drop", example_block(i + 1)))
+        cuts.append(("truncate", "codebase_summary"))
+
+        sections.update({"codebase_summary": read_cached(codebase_summary_save_path), "function_description": read_cached(function_description_save_path)})
+        if model_name is None:
+            function_generation_prompt = template.render(sections)
+        else:
+            function_generation_prompt = PromptBudgeter(model_name, reserve_tokens).fit(template.text, sections, cuts)
 
         os.makedirs(os.path.dirname(function_generation_prompt_type3_save_path), exist_ok=True)
 
@@ -1,51 +1,163 @@
-from openai import OpenAI
+import asyncio
+import time
+from typing import Iterator
+from ClientPool import load_environment
+from EndpointPool import Endpoint, EndpointPool, chat_completions
 from LLMInterface import LLMInterface
+from PromptBudget import check_prompt_length
+from RateLimiter import ProviderRateLimiter, estimate_tokens, get_rate_limiter, get_used_tokens
 import os
-from dotenv import load_dotenv
 
 class DeepSeek(LLMInterface):
-    def __init__(self, *args, **kwargs):
+    max_concurrency = 8
+
+    def __init__(self, base_url: str = "https://api.deepseek.com", rate_limiter: ProviderRateLimiter = None, endpoints: EndpointPool = None, **kwargs):
+        """
+        Initialize the DeepSeek model. Requests are paced and retried by rate_limiter, which defaults to the limiter shared by all DeepSeek models.
+        The client, and its pool of keep-alive connections, is shared with every other instance using the same base URL, API key and client arguments.
+        Pass endpoints, e.g. endpoint_pool_from_env("deepseek", "https://api.deepseek.com"), to spread the requests over several API keys or endpoints, each with its own rate limiter.
+        """
+
+        load_environment()
+        if endpoints is None:
+            endpoints = EndpointPool([Endpoint(os.getenv("DEEPSEEK_API_KEY"), base_url, rate_limiter if rate_limiter is not None else get_rate_limiter("deepseek"), **kwargs)])
+        self.endpoints = endpoints
+        self.base_url = endpoints.endpoints[0].base_url
+        self.model_name = "deepseek-chat"
+        self.rate_limiter = endpoints.endpoints[0].rate_limiter
+        self.model = endpoints.endpoints[0].client()
+
+    def _messages(self, prompt: str) -> list[dict]:
         """
-        Initialize the DeepSeek model.
+        Build the chat messages for a single prompt, after checking that it fits the context window of the model.
+        """
+        check_prompt_length(self.model_name, prompt)
+        return [
+            {
+                "role": "system",
+                "content": "You are a helpful assistant well versed in coding.",
+            },
+            {
+                "role": "user",
+                "content": prompt,
+            }
+        ]
+
+    def generate(self, prompt:str, *args, **kwargs):
+        """
+        Generate text based on the given prompt.
         """
 
-        load_dotenv()
-        self.__api_key = os.getenv("DEEPSEEK_API_KEY")
-        self.model = OpenAI(
-            api_key=self.__api_key,
-            base_url="https://api.deepseek.com",
+        response = self.endpoints.call(
+            chat_completions,
+            estimated_tokens=estimate_tokens(prompt),
+            used_tokens=get_used_tokens,
+            model=self.model_name,
+            messages=self._messages(prompt),
             *args,
             **kwargs
         )
-    
-    def generate(self, prompt:str, *args, **kwargs):
+
+        self.response = response
+        return response.choices[0].message.content
+
+    async def agenerate(self, prompt:str, *args, **kwargs):
         """
-        Generate text based on the given prompt.
+        Asynchronously generate text based on the given prompt using the async OpenAI client.
         """
 
-        self.response = self.model.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant well versed in coding.",
-                },
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
+        response = await self.endpoints.acall(
+            chat_completions,
+            estimated_tokens=estimate_tokens(prompt),
+            used_tokens=get_used_tokens,
+            model=self.model_name,
+            messages=self._messages(prompt),
             *args,
             **kwargs
         )
 
-        return self.response.choices[0].message.content
-    
-    def write_to_file(self, filename: str):
+        self.response = response
+        return response.choices[0].message.content
+
+    def generate_samples(self, prompt: str, n: int, **kwargs) -> list[str]:
+        """
+        Generate n samples for the given prompt using the API's n parameter.
+        If the endpoint returns fewer than n choices, the remaining samples are requested separately.
+        """
+
+        response = self.endpoints.call(
+            chat_completions,
+            estimated_tokens=estimate_tokens(prompt),
+            used_tokens=get_used_tokens,
+            model=self.model_name,
+            messages=self._messages(prompt),
+            n=n,
+            **kwargs
+        )
+
+        sample_texts = [choice.message.content for choice in response.choices]
+        while len(sample_texts) < n:
+            sample_texts.append(self.generate(prompt, **kwargs))
+
+        self.response = response
+        self.sample_texts = sample_texts[:n]
+        return self.sample_texts
+
+    async def agenerate_samples(self, prompt: str, n: int, **kwargs) -> list[str]:
+        """
+        Asynchronously generate n samples for the given prompt using the API's n parameter.
+        If the endpoint returns fewer than n choices, the remaining samples are requested separately.
+        """
+
+        response = await self.endpoints.acall(
+            chat_completions,
+            estimated_tokens=estimate_tokens(prompt),
+            used_tokens=get_used_tokens,
+            model=self.model_name,
+            messages=self._messages(prompt),
+            n=n,
+            **kwargs
+        )
+
+        sample_texts = [choice.message.content for choice in response.choices]
+        if len(sample_texts) < n:
+            sample_texts += await asyncio.gather(*(self.agenerate(prompt, **kwargs) for _ in range(n - len(sample_texts))))
+
+        self.response = response
+        self.sample_texts = sample_texts[:n]
+        return self.sample_texts
+
+    def stream(self, prompt: str, stop_at_code_block: bool = False, **kwargs) -> Iterator[str]:
+        """
+        Generate text based on the given prompt, yielding chunks as the API streams them.
+        If stop_at_code_block is set, the request is closed as soon as the first complete code block has arrived.
+        Timing information is stored in self.stream_stats and the complete text in self.response_text.
+        """
+
+        start_time = time.perf_counter()
+        response = self.endpoints.call(
+            chat_completions,
+            estimated_tokens=estimate_tokens(prompt),
+            used_tokens=get_used_tokens,
+            model=self.model_name,
+            messages=self._messages(prompt),
+            stream=True,
+            **kwargs
+        )
+        self.response = None
+
+        chunks = (chunk.choices[0].delta.content for chunk in response if chunk.choices)
+        yield from self._timed_stream(chunks, start_time, stop_at_code_block, cancel=response.close)
+
+    def write_to_file(self, filename: str, choice: int = 0):
         """
-        Write the last generated text to a file.
+        Write the last generated text to a file. choice selects the sample when the last response holds several.
         """
         os.makedirs(os.path.dirname(filename), exist_ok=True)
 
         with open(filename, "w") as f:
-            f.write(self.response.choices[0].message.content)
+            # a streamed response is only kept as text
+            if self.response is None:
+                f.write(self.response_text)
+            else:
+                f.write(self.response.choices[choice].message.content)
@@ -0,0 +1,149 @@
+import os
+import threading
+from ClientPool import get_async_openai_client, get_openai_client, load_environment
+from RateLimiter import ProviderRateLimiter, default_rate_limits
+
+def chat_completions(client):
+    """
+    Get the chat completions create method of an OpenAI or AsyncOpenAI client.
+    """
+    return client.chat.completions.create
+
+
+class Endpoint():
+    def __init__(self, api_key: str, base_url: str = None, rate_limiter: ProviderRateLimiter = None, name: str = None, **client_kwargs) -> None:
+        """
+        Initialize one credential and endpoint of an OpenAI-compatible API, with the rate limiter tracking its own quota.
+
+        Args:
+            api_key (str): The API key.
+            base_url (str, optional): The base URL of the API. Defaults to None, i.e. the OpenAI API.
+            rate_limiter (ProviderRateLimiter, optional): The rate limiter pacing the requests made with this key. Defaults to an unlimited one.
+            name (str, optional): The name shown in stats and warnings. Defaults to the base URL and the last characters of the key.
+            **client_kwargs: Other arguments for the client, e.g. max_retries.
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.rate_limiter = rate_limiter if rate_limiter is not None else ProviderRateLimiter()
+        self.name = name if name is not None else f"{base_url or 'default'} (...{(api_key or '')[-4:]})"
+        # retries are handled by the rate limiter, which also honors Retry-After across instances
+        client_kwargs.setdefault("max_retries", 0)
+        self.client_kwargs = client_kwargs
+
+        self.outstanding = 0
+        self.request_count = 0
+        self.error_count = 0
+
+    def client(self):
+        return get_openai_client(self.api_key, self.base_url, **self.client_kwargs)
+
+    def async_client(self):
+        return get_async_openai_client(self.api_key, self.base_url, **self.client_kwargs)
+
+
+class EndpointPool():
+    def __init__(self, endpoints: list[Endpoint]) -> None:
+        """
+        Initialize a pool of credentials and endpoints serving the same models, e.g. several API keys of an organization or several self-hosted OpenAI-compatible servers.
+        Every request goes to the endpoint with the fewest requests outstanding among those whose quota allows it right away, or else to the one whose quota frees up first.
+
+        Args:
+            endpoints (list[Endpoint]): The endpoints.
+        """
+        if not endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+
+    def _acquire(self, estimated_tokens: int) -> Endpoint:
+        with self._lock:
+            endpoint = min(self.endpoints, key=lambda endpoint: (endpoint.rate_limiter.expected_wait(estimated_tokens), endpoint.outstanding))
+            endpoint.outstanding += 1
+            endpoint.request_count += 1
+            return endpoint
+
+    def _release(self, endpoint: Endpoint, failed: bool) -> None:
+        with self._lock:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.error_count += 1
+
+    def call(self, method, *args, estimated_tokens: int = 0, used_tokens=None, **kwargs):
+        """
+        Call a method of the client of the chosen endpoint through the endpoint's rate limiter.
+
+        Args:
+            method: Function that takes a client and returns the method to call, e.g. chat_completions.
+            estimated_tokens (int, optional): The number of tokens the call is expected to use. Defaults to 0.
+            used_tokens (optional): Function that takes the result and returns the number of tokens actually used. Defaults to None.
+
+        Returns:
+            The result of the method.
+        """
+        endpoint = self._acquire(estimated_tokens)
+        failed = True
+        try:
+            result = endpoint.rate_limiter.call(method(endpoint.client()), *args, estimated_tokens=estimated_tokens, used_tokens=used_tokens, **kwargs)
+            failed = False
+            return result
+        finally:
+            self._release(endpoint, failed)
+
+    async def acall(self, method, *args, estimated_tokens: int = 0, used_tokens=None, **kwargs):
+        """
+        Asynchronous version of call, using the async client of the chosen endpoint.
+        """
+        endpoint = self._acquire(estimated_tokens)
+        failed = True
+        try:
+            result = await endpoint.rate_limiter.acall(method(endpoint.async_client()), *args, estimated_tokens=estimated_tokens, used_tokens=used_tokens, **kwargs)
+            failed = False
+            return result
+        finally:
+            self._release(endpoint, failed)
+
+    def stats(self) -> dict:
+        """
+        Get the requests, errors, outstanding requests and retries of every endpoint.
+
+        Returns:
+            dict: Mapping of endpoint name to its counters.
+        """
+        with self._lock:
+            return {
+                endpoint.name: {"requests": endpoint.request_count, "errors": endpoint.error_count, "outstanding": endpoint.outstanding, "retries": endpoint.rate_limiter.retries}
+                for endpoint in self.endpoints
+            }
+
+
+def endpoint_pool_from_env(provider: str, base_url: str = None, **limits) -> EndpointPool:
+    """
+    Create an endpoint pool from the environment (or .env file). The API keys are read from the comma-separated <PROVIDER>_API_KEYS, falling back to <PROVIDER>_API_KEY,
+    and the base URLs from the comma-separated <PROVIDER>_BASE_URLS, falling back to base_url. A single key is used with every base URL and a single base URL with every key,
+    otherwise keys and base URLs are paired in order.
+
+    Args:
+        provider (str): The provider name, e.g. "openai" or "deepseek".
+        base_url (str, optional): The base URL when <PROVIDER>_BASE_URLS is not set. Defaults to None, i.e. the OpenAI API.
+        **limits: Arguments for the ProviderRateLimiter of every key, e.g. its requests_per_minute. Default to the provider's default_rate_limits.
+
+    Returns:
+        EndpointPool: The pool, with one rate limiter per endpoint.
+    """
+    load_environment()
+    prefix = provider.upper()
+    api_keys = [key.strip() for key in (os.getenv(f"{prefix}_API_KEYS") or os.getenv(f"{prefix}_API_KEY") or "").split(",") if key.strip()]
+    base_urls = [url.strip() for url in (os.getenv(f"{prefix}_BASE_URLS") or "").split(",") if url.strip()] or [base_url]
+
+    if not api_keys:
+        raise ValueError(f"Set {prefix}_API_KEYS or {prefix}_API_KEY to use the {provider} endpoints")
+    if len(api_keys) == 1:
+        api_keys = api_keys * len(base_urls)
+    elif len(base_urls) == 1:
+        base_urls = base_urls * len(api_keys)
+    elif len(api_keys) != len(base_urls):
+        raise ValueError(f"Got {len(api_keys)} keys for {len(base_urls)} base URLs of {provider}, expected one key, one base URL or as many of each")
+
+    limits = {**default_rate_limits(provider), **limits}
+    return EndpointPool([Endpoint(api_key, url, ProviderRateLimiter(**limits)) for api_key, url in zip(api_keys, base_urls)])
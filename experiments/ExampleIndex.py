@@ -0,0 +1,271 @@
+import glob
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from PromptBudget import count_tokens
+from PromptTemplate import read_cached
+from RetrievalIndex import tokenize_code
+
+# the fields of a config the index reads
+CONFIG_FIELDS = ("language", "function_description_save_path", "original_function_save_path")
+
+class ExampleIndex():
+    def __init__(self, dataset_dir: str = ".", index_path: str = ".example-index/index.json") -> None:
+        """
+        Initialize a TF-IDF index over the description and original code of every function of the dataset, i.e. every <repository>/function<N>/config.json under dataset_dir,
+        to pick the few-shot examples of a type3 prompt by similarity to the function description instead of the two fixed examples of its config.
+        The terms of every function are stored in index_path and only tokenized again when its description or code changes. The ranking of the other functions for the description of
+        every function is computed whenever a function changes and stored with them, so that picking the examples of a config is a lookup.
+
+        Args:
+            dataset_dir (str, optional): The directory holding the repository directories. Defaults to ".", i.e. experiments/ as in the notebooks.
+            index_path (str, optional): The file to store the terms in. Defaults to ".example-index/index.json".
+        """
+        self.dataset_dir = dataset_dir
+        self.index_path = index_path
+        self._lock = threading.Lock()
+
+        # original code path -> {"language", "description_path", "code_path", "version", "description_terms", "terms"}
+        self.functions = {}
+        # original code path -> [(original code path, score)] of the other functions, best first
+        self.rankings = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                stored = json.load(f)
+            self.functions = stored["functions"]
+            self.rankings = stored["rankings"]
+
+        self.idf = {}
+        # term -> [(original code path, weight)]
+        self.postings = {}
+        self.update()
+
+    def _configs(self) -> list[dict]:
+        configs = []
+        for path in sorted(glob.glob(os.path.join(self.dataset_dir, "*", "function*", "config.json"))):
+            # a broken config only leaves its own function out of the index
+            try:
+                with open(path, "r") as f:
+                    config = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"WARNING: Could not read {path}, its function is not indexed: {e}")
+                continue
+            missing = [field for field in CONFIG_FIELDS if not isinstance(config, dict) or not isinstance(config.get(field), str)]
+            if missing:
+                print(f"WARNING: {path} has no {', '.join(missing)}, its function is not indexed")
+                continue
+
+            if os.path.exists(config["function_description_save_path"]) and os.path.exists(config["original_function_save_path"]):
+                configs.append(config)
+        return configs
+
+    def update(self) -> dict:
+        """
+        Bring the index up to date with the functions of the dataset, tokenizing only added or changed functions, and rank the functions again if any changed.
+
+        Returns:
+            dict: The number of functions added or changed, removed and unchanged.
+        """
+        with self._lock:
+            counts = {"updated": 0, "removed": 0, "unchanged": 0}
+            configs = self._configs()
+
+            for config in configs:
+                description_path, code_path = config["function_description_save_path"], config["original_function_save_path"]
+                version = [[os.stat(path).st_mtime_ns, os.stat(path).st_size] for path in (description_path, code_path)]
+                entry = self.functions.get(code_path)
+                if entry is not None and entry["version"] == version:
+                    counts["unchanged"] += 1
+                    continue
+
+                description_terms = Counter(tokenize_code(read_cached(description_path)))
+                terms = description_terms + Counter(tokenize_code(read_cached(code_path)))
+                self.functions[code_path] = {
+                    "language": config["language"], "description_path": description_path, "code_path": code_path, "version": version,
+                    "description_terms": dict(description_terms), "terms": dict(terms),
+                }
+                counts["updated"] += 1
+
+            code_paths = {config["original_function_save_path"] for config in configs}
+            for code_path in set(self.functions) - code_paths:
+                del self.functions[code_path]
+                counts["removed"] += 1
+
+            changed = counts["updated"] or counts["removed"] or not os.path.exists(self.index_path)
+            self._build(rank=changed)
+            if changed:
+                os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+                tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump({"functions": self.functions, "rankings": self.rankings}, f)
+                os.replace(tmp_path, self.index_path)
+
+            return counts
+
+    def _build(self, rank: bool) -> None:
+        document_frequencies = Counter(term for entry in self.functions.values() for term in entry["terms"])
+        total = len(self.functions)
+        self.idf = {term: math.log((1 + total) / (1 + frequency)) + 1 for term, frequency in document_frequencies.items()}
+
+        self.postings = {}
+        for code_path, entry in self.functions.items():
+            vector = {term: (1 + math.log(count)) * self.idf[term] for term, count in entry["terms"].items()}
+            norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+            for term, weight in vector.items():
+                self.postings.setdefault(term, []).append((code_path, weight / norm))
+
+        if rank:
+            self.rankings = {code_path: [(other, score) for other, score in self._score(entry["description_terms"]) if other != code_path] for code_path, entry in self.functions.items()}
+
+    def _score(self, query: dict) -> list[tuple[str, float]]:
+        vector = {term: (1 + math.log(count)) * self.idf[term] for term, count in query.items() if term in self.idf}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+
+        scores = Counter()
+        # only the postings of the terms of the query are visited
+        for term, query_weight in vector.items():
+            for code_path, weight in self.postings[term]:
+                scores[code_path] += query_weight / norm * weight
+        return scores.most_common()
+
+    def _filter(self, ranked: list[tuple[str, float]], k: int, language: str, exclude: set) -> list[tuple[dict, float]]:
+        results = []
+        for code_path, score in ranked:
+            if code_path not in exclude and (language is None or self.functions[code_path]["language"] == language):
+                results.append((self.functions[code_path], score))
+                if len(results) == k:
+                    break
+        return results
+
+    def search(self, description: str, k: int = None, language: str = None, exclude: set = ()) -> list[tuple[dict, float]]:
+        """
+        Rank the functions of the dataset by the cosine similarity of their description and code to a function description.
+
+        Args:
+            description (str): The description of the function to generate.
+            k (int, optional): The number of functions to return. Defaults to None (all functions with a positive score).
+            language (str, optional): Only return functions of this language. Defaults to None (any language).
+            exclude (set, optional): The original code paths of functions not to return, e.g. the function to generate. Defaults to ().
+
+        Returns:
+            list[tuple[dict, float]]: The index entries of the functions with their scores, best first.
+        """
+        return self._filter(self._score(Counter(tokenize_code(description))), k, language, exclude)
+
+    def similar_functions(self, code_path: str, k: int = None, language: str = None, exclude: set = ()) -> list[tuple[dict, float]]:
+        """
+        Get the functions of the dataset most similar to the description of an indexed function from the precomputed rankings. Same as search with its description, without scoring.
+
+        Args:
+            code_path (str): The original code path of the indexed function.
+            k (int, optional): The number of functions to return. Defaults to None (all functions with a positive score).
+            language (str, optional): Only return functions of this language. Defaults to None (any language).
+            exclude (set, optional): The original code paths of other functions not to return. Defaults to ().
+
+        Returns:
+            list[tuple[dict, float]]: The index entries of the functions with their scores, best first.
+        """
+        return self._filter(self.rankings[code_path], k, language, exclude)
+
+
+_example_index = None
+_example_index_lock = threading.Lock()
+
+def get_example_index(dataset_dir: str = ".") -> ExampleIndex:
+    """
+    Get the example index of the process, building it the first time and bringing it up to date only when asked with update().
+    """
+    global _example_index
+    with _example_index_lock:
+        if _example_index is None or _example_index.dataset_dir != dataset_dir:
+            _example_index = ExampleIndex(dataset_dir)
+        return _example_index
+
+def retrieve_example_functions(config: dict, k: int = 2, max_tokens: int = None, model_name: str = "", index: ExampleIndex = None) -> list[list[str]]:
+    """
+    Pick the few-shot examples of a config's type3 prompt: the k functions of the same language most similar to its function description whose descriptions and code fit max_tokens.
+    The function of the config itself is never picked.
+
+    Args:
+        config (dict): The experiment config.
+        k (int, optional): The maximum number of examples. Defaults to 2, as in the configs.
+        max_tokens (int, optional): The token budget of the examples. Defaults to None (no budget).
+        model_name (str, optional): The model name to count tokens with. Defaults to "" (estimated counts).
+        index (ExampleIndex, optional): The index to search. Defaults to the index of the dataset in the working directory.
+
+    Returns:
+        list[list[str]]: The description and code paths of every example, most similar first, as taken by create_func_generation_prompt_type3.
+    """
+    index = index if index is not None else get_example_index()
+    code_path = config["original_function_save_path"]
+    if code_path in index.rankings:
+        ranked = index.similar_functions(code_path, language=config["language"])
+    else:
+        ranked = index.search(read_cached(config["function_description_save_path"]), language=config["language"], exclude={code_path})
+
+    example_functions = []
+    tokens = 0
+    for entry, _ in ranked:
+        if len(example_functions) >= k:
+            break
+        if max_tokens is not None:
+            entry_tokens = count_tokens(read_cached(entry["description_path"]) + read_cached(entry["code_path"]), model_name)
+            if tokens + entry_tokens > max_tokens:
+                continue
+            tokens += entry_tokens
+        example_functions.append([entry["description_path"], entry["code_path"]])
+
+    return example_functions
+
+
+def benchmark_lookup(functions: int = 500, lookups: int = 1000) -> dict:
+    """
+    Measure the time to pick the examples of a function from an index of synthetic functions, with the precomputed rankings and by scoring its description.
+
+    Returns:
+        dict: The seconds per lookup of each case.
+    """
+    import random
+    import tempfile
+
+    rng = random.Random(0)
+    vocabulary = [f"{prefix}{suffix}{i}" for prefix in ("get", "put", "delete", "list", "handle", "parse", "send", "log") for suffix in ("Stack", "Order", "Package", "User", "Event", "Token", "Payment", "Tag", "Release", "Queue") for i in range(25)]
+
+    with tempfile.TemporaryDirectory() as dataset_dir:
+        for i in range(functions):
+            function_dir = os.path.join(dataset_dir, f"repo{i // 10}", f"function{i % 10 + 1}")
+            os.makedirs(function_dir)
+            config = {"language": "JS", "function_description_save_path": os.path.join(function_dir, "function-description.txt"), "original_function_save_path": os.path.join(function_dir, "ORIGINAL-handler.js")}
+            for path, size in ((config["function_description_save_path"], 60), (config["original_function_save_path"], 300)):
+                with open(path, "w") as f:
+                    f.write(" ".join(rng.choices(vocabulary, k=size)))
+            with open(os.path.join(function_dir, "config.json"), "w") as f:
+                json.dump(config, f)
+
+        start_time = time.perf_counter()
+        index = ExampleIndex(dataset_dir, os.path.join(dataset_dir, ".example-index", "index.json"))
+        build_time = time.perf_counter() - start_time
+
+        code_paths = rng.choices(list(index.functions), k=lookups)
+        descriptions = {code_path: read_cached(index.functions[code_path]["description_path"]) for code_path in code_paths}
+        results = {}
+
+        start_time = time.perf_counter()
+        for code_path in code_paths:
+            index.similar_functions(code_path, k=2, language="JS")
+        results["precomputed"] = (time.perf_counter() - start_time) / lookups
+
+        start_time = time.perf_counter()
+        for code_path in code_paths:
+            index.search(descriptions[code_path], k=2, language="JS", exclude={code_path})
+        results["scored"] = (time.perf_counter() - start_time) / lookups
+
+    print(f"{functions} functions indexed in {build_time:.2f}s: {results['precomputed'] * 1e3:.3f}ms per precomputed lookup, {results['scored'] * 1e3:.3f}ms per scored lookup")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_lookup()
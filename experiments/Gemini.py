@@ -1,18 +1,44 @@
 import google.generativeai as genai
 from LLMInterface import LLMInterface
+from RateLimiter import ProviderRateLimiter, estimate_tokens, get_rate_limiter, get_used_tokens
 import os
+import time
+from typing import Iterator
 from dotenv import load_dotenv
 
+def _chunk_text(chunk) -> str:
+    # chunk.text raises a ValueError for chunks without text parts, e.g. a last chunk carrying only the finish reason
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+def _cancel_stream(response) -> None:
+    # GenerateContentResponse has no public way to close its stream, so the gRPC or REST response iterator it reads from is cancelled
+    cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+    if cancel is None:
+        print("WARNING: Could not cancel the Gemini stream, google-generativeai may have changed: the request runs until the response is complete")
+        return
+    cancel()
+
 class Gemini(LLMInterface):
-    def __init__(self):
+    # at most 2 requests in flight. This caps concurrency, not the rate: to stay within the 2 requests per minute of the free tier, set GEMINI_REQUESTS_PER_MINUTE=2 for the rate limiter
+    max_concurrency = 2
+
+    def __init__(self, rate_limiter: ProviderRateLimiter = None):
         """
         Initialize the Gemini model.
+
+        Args:
+            rate_limiter (ProviderRateLimiter, optional): The rate limiter to pace and retry requests with. Defaults to the limiter shared by all Gemini models.
         """
         
         load_dotenv()
         self.api_key = os.getenv("GEMINI_API_KEY")
         genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel("gemini-1.5-pro")
+        self.model_name = "gemini-1.5-pro"
+        self.model = genai.GenerativeModel(self.model_name)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter("gemini")
 
     def generate(self, prompt: str) -> str:
         """
@@ -25,9 +51,30 @@ class Gemini(LLMInterface):
                 str: Returns the cleaned string response from the model. The entire response object is stored in self.response. 
         """
 
-        self.response = self.model.generate_content(prompt)
-        return self.response.text
+        response = self.rate_limiter.call(self.model.generate_content, prompt, estimated_tokens=estimate_tokens(prompt), used_tokens=get_used_tokens)
+        self.response = response
+        return response.text
     
+    def stream(self, prompt: str, stop_at_code_block: bool = False) -> Iterator[str]:
+        """
+        Generate text based on the given prompt, yielding chunks as the API streams them.
+        If the stream is not read to the end, e.g. with stop_at_code_block, the request is cancelled.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            stop_at_code_block (bool, optional): Stop reading once the first complete fenced code block has arrived. Defaults to False.
+
+        Yields:
+            str: The chunks of the response. Timing information is stored in self.stream_stats and the complete text in self.response_text.
+        """
+
+        start_time = time.perf_counter()
+        response = self.rate_limiter.call(self.model.generate_content, prompt, stream=True, estimated_tokens=estimate_tokens(prompt))
+        self.response = None
+
+        chunks = (_chunk_text(chunk) for chunk in response)
+        yield from self._timed_stream(chunks, start_time, stop_at_code_block, cancel=lambda: _cancel_stream(response))
+
     def write_to_file(self, filename: str) -> None:
         """
         Write the generated text to a file.
@@ -38,4 +85,8 @@ class Gemini(LLMInterface):
         os.makedirs(os.path.dirname(filename), exist_ok=True)
 
         with open(filename, "w") as file:
-            file.write(self.response.text)
\ No newline at end of file
+            # a streamed response is only kept as text
+            if self.response is None:
+                file.write(self.response_text)
+            else:
+                file.write(self.response.text)
\ No newline at end of file
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import time
+import weakref
+from gradio_client import Client
+from LLMInterface import LLMInterface
+from PromptBudget import check_prompt_length
+from Telemetry import add_to_record
+
+# event loop -> Space -> semaphore capping the jobs in flight on that Space, shared by every instance using it
+_space_semaphores = weakref.WeakKeyDictionary()
+
+class GradioSpaceLLM(LLMInterface):
+    # jobs are queued by the Space and served by its replicas, so several can be in flight at once
+    max_concurrency = 4
+    # seconds between polls of submitted jobs
+    poll_interval = 0.1
+
+    def __init__(self, space: str, max_concurrency: int = None, **client_kwargs) -> None:
+        """
+        Initialize a model hosted as a gradio app, e.g. a Hugging Face Space, that exposes a "/predict" endpoint taking input_text.
+
+        Args:
+            space (str): The Space name (e.g. "userName/CodeQwen1.5-7B-Chat") or the URL of the gradio app.
+            max_concurrency (int, optional): Maximum number of jobs in flight on the Space. Defaults to the class's max_concurrency.
+            **client_kwargs: Other arguments for gradio_client.Client, e.g. hf_token.
+        """
+        self.model_name = space
+        self.model = Client(self.model_name, **client_kwargs)
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+
+    def generate(self, prompt: str, *args, **kwargs) -> str:
+        """
+        Generate text based on the given prompt.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+
+        Returns:
+            str: Returns the cleaned string response from the model. The entire response object is stored in self.response.
+        """
+        check_prompt_length(self.model_name, prompt)
+        response = self.model.predict(
+            input_text=prompt,
+            api_name="/predict",
+        )
+
+        self.response = response
+        self.response_text = response
+        return response
+
+    def _space_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        return _space_semaphores.setdefault(loop, {}).setdefault(self.model_name, asyncio.Semaphore(self.max_concurrency))
+
+    async def agenerate(self, prompt: str, *args, **kwargs) -> str:
+        """
+        Asynchronously generate text based on the given prompt. The prompt is submitted as a gradio job and polled without blocking a thread,
+        so generate_many and generate_samples keep up to max_concurrency jobs in flight on the Space and collect the results in order.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+
+        Returns:
+            str: Returns the cleaned string response from the model. The entire response object is stored in self.response.
+        """
+        check_prompt_length(self.model_name, prompt)
+        queued = time.perf_counter()
+        async with self._space_semaphore():
+            add_to_record(queue_wait=time.perf_counter() - queued)
+            job = self.model.submit(
+                input_text=prompt,
+                api_name="/predict",
+            )
+            while not job.done():
+                await asyncio.sleep(self.poll_interval)
+            response = job.result()
+
+        self.response = response
+        self.response_text = response
+        return response
+
+    def write_to_file(self, filename: str) -> None:
+        """
+        Write the generated text to a file.
+
+        Args:
+            filepath (str): The path to the file to write to.
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        with open(filename, 'w') as f:
+            f.write(self.response_text)
@@ -0,0 +1,297 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from LLMInterface import LLMInterface, run_coroutine
+from Telemetry import add_to_record, annotate_record
+
+class LatencyTracker():
+    def __init__(self, window: int = 200) -> None:
+        """
+        Initialize a record of the latencies of the last successful or cancelled calls to a backend.
+
+        Args:
+            window (int, optional): Number of latencies to keep. Defaults to 200.
+        """
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, percentile: float) -> float:
+        """
+        Get a percentile of the recorded latencies.
+
+        Args:
+            percentile (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: The latency in seconds, or None if nothing was recorded yet.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(int(len(latencies) * percentile / 100), len(latencies) - 1)]
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+
+class CircuitBreaker():
+    def __init__(self, failure_rate: float = 0.5, window: int = 20, min_calls: int = 5, cooldown: float = 30.0) -> None:
+        """
+        Initialize a circuit breaker that stops sending calls to a backend whose error rate spikes.
+        Once the breaker opens, calls are refused for cooldown seconds, after which a single trial call decides whether it closes again.
+
+        Args:
+            failure_rate (float, optional): Share of failed calls among the last window calls that opens the breaker. Defaults to 0.5.
+            window (int, optional): Number of recent call outcomes considered. Defaults to 20.
+            min_calls (int, optional): Number of outcomes needed before the breaker can open. Defaults to 5.
+            cooldown (float, optional): Seconds the breaker stays open. Defaults to 30.0.
+        """
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+
+        self.state = "closed"
+        self.opened_at = None
+        self._outcomes = deque(maxlen=window)
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Check whether a call may be sent to the backend.
+        """
+        with self._lock:
+            if self.state == "closed":
+                return True
+
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half-open"
+
+            # only one trial call at a time while half-open
+            if self.state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._outcomes.append(True)
+            if self.state == "half-open":
+                self.state = "closed"
+                self._outcomes.clear()
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if self.state == "half-open" or (len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate):
+                if self.state != "open":
+                    print(f"WARNING: Opening the circuit breaker after {failures} failures in the last {len(self._outcomes)} calls")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release(self) -> None:
+        """
+        Give up a call that was allowed but cancelled before it finished, e.g. the losing duplicate of a hedged call.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class HedgedLLM(LLMInterface):
+    def __init__(self, backends: list[LLMInterface], hedge_percentile: float = 95, initial_hedge_delay: float = 30.0, min_observations: int = 20, max_hedges: int = 1, breaker_kwargs: dict = None) -> None:
+        """
+        Wrap several backends serving the same model, e.g. the same model behind a second API key or endpoint, or a fallback provider, to cut tail latency and survive outages.
+        Each call goes to the first backend whose circuit breaker is closed. If it takes longer than the hedge_percentile of that backend's observed latencies, a duplicate is
+        sent to the next backend and whichever returns first wins, the other being cancelled. If a call fails, the next backend is tried at once.
+
+        Args:
+            backends (list[LLMInterface]): The backends, in order of preference.
+            hedge_percentile (float, optional): The percentile of the observed latency after which a duplicate is sent. Defaults to 95.
+            initial_hedge_delay (float, optional): Seconds to wait before sending a duplicate until min_observations latencies have been observed. Defaults to 30.0.
+            min_observations (int, optional): Number of latencies to observe before using the percentile. Defaults to 20.
+            max_hedges (int, optional): Maximum number of duplicates per call. Defaults to 1.
+            breaker_kwargs (dict, optional): Arguments for the CircuitBreaker of every backend. Defaults to None.
+        """
+        if not backends:
+            raise ValueError("HedgedLLM needs at least one backend")
+
+        self.backends = backends
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_observations = min_observations
+        self.max_hedges = max_hedges
+        self.max_concurrency = backends[0].max_concurrency
+        self.model_name = getattr(backends[0], "model_name", None)
+
+        self.latencies = [LatencyTracker() for _ in backends]
+        self.breakers = [CircuitBreaker(**(breaker_kwargs or {})) for _ in backends]
+        self.hedge_count = 0
+        self.fallback_count = 0
+
+    def generation_params(self) -> dict:
+        return self.backends[0].generation_params()
+
+    def hedge_delay(self, index: int) -> float:
+        """
+        Get the seconds to wait for a call to a backend before sending a duplicate.
+        """
+        if len(self.latencies[index]) < self.min_observations:
+            return self.initial_hedge_delay
+        return self.latencies[index].percentile(self.hedge_percentile)
+
+    async def _timed_call(self, index: int, prompt: str, args: tuple, kwargs: dict) -> str:
+        start_time = time.perf_counter()
+        try:
+            response_text = await self.backends[index].agenerate(prompt, *args, **kwargs)
+        except asyncio.CancelledError:
+            # a call cancelled because its duplicate won was at least this slow, so its elapsed time is kept as a lower bound of its latency.
+            # Leaving it out would keep only the calls fast enough to finish, lowering the percentile and with it the hedge delay with every hedge.
+            self.latencies[index].add(time.perf_counter() - start_time)
+            self.breakers[index].release()
+            raise
+        except Exception:
+            self.breakers[index].record_failure()
+            raise
+
+        self.latencies[index].add(time.perf_counter() - start_time)
+        self.breakers[index].record_success()
+        return response_text
+
+    async def agenerate(self, prompt: str, *args, **kwargs) -> str:
+        """
+        Asynchronously generate text based on the given prompt, hedging slow calls and falling back to the next backend on errors.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+
+        Returns:
+            str: The string response of the first backend to answer.
+
+        Raises:
+            RuntimeError: If every circuit breaker is open.
+        """
+        candidates = iter(index for index, breaker in enumerate(self.breakers) if breaker.allow())
+        tasks = {}
+        hedges = 0
+        last_error = None
+
+        def launch() -> bool:
+            index = next(candidates, None)
+            if index is None:
+                return False
+            tasks[asyncio.ensure_future(self._timed_call(index, prompt, args, kwargs))] = index
+            return True
+
+        if not launch():
+            raise RuntimeError(f"All {len(self.backends)} backends of {self.model_name} are unavailable, their circuit breakers are open")
+
+        try:
+            while tasks:
+                # the newest call decides when the next duplicate is due
+                timeout = self.hedge_delay(list(tasks.values())[-1]) if hedges < self.max_hedges else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if launch():
+                        hedges += 1
+                        self.hedge_count += 1
+                        add_to_record(hedges=1)
+                    else:
+                        # nothing left to hedge with, wait for the calls in flight
+                        hedges = self.max_hedges
+                    continue
+
+                for task in done:
+                    index = tasks.pop(task)
+                    if task.exception() is None:
+                        annotate_record(backend=type(self.backends[index]).__name__, model=getattr(self.backends[index], "model_name", None))
+                        self.response_text = task.result()
+                        return self.response_text
+
+                    last_error = task.exception()
+                    print(f"WARNING: Backend {index} of {self.model_name} failed, trying the next one: {last_error}")
+
+                # fall back at once instead of waiting for a hedge delay
+                if not tasks:
+                    if not launch():
+                        raise last_error
+                    self.fallback_count += 1
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        raise last_error
+
+    def generate(self, prompt: str, *args, **kwargs) -> str:
+        """
+        Generate text based on the given prompt, hedging slow calls and falling back to the next backend on errors. Blocking version of agenerate.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+
+        Returns:
+            str: The string response of the first backend to answer.
+        """
+        return run_coroutine(self.agenerate(prompt, *args, **kwargs))
+
+    def write_to_file(self, filename: str) -> None:
+        """
+        Write the last generated text to a file.
+
+        Args:
+            filename (str): The path to the file to write to.
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        with open(filename, "w") as f:
+            f.write(self.response_text)
+
+
+def benchmark_hedging(calls: int = 40, delay: float = 0.05, slow_every: int = 10, slow_delay: float = 2.0) -> dict:
+    """
+    Compare the latency of calls to a stub server that is occasionally slow with and without a hedged duplicate to a second stub server.
+
+    Returns:
+        dict: The mean, p95 and maximum latency in seconds of each case.
+    """
+    from OpenAIModel import OpenAIModel
+    from StubServer import StubOpenAIServer
+
+    def measure(model: LLMInterface) -> dict:
+        latencies = []
+        for i in range(calls):
+            start_time = time.perf_counter()
+            model.generate(f"Write function {i}")
+            latencies.append(time.perf_counter() - start_time)
+        latencies.sort()
+        return {"mean": sum(latencies) / calls, "p95": latencies[int(calls * 0.95) - 1], "max": latencies[-1]}
+
+    # the stub servers accept any key
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+    results = {}
+    with StubOpenAIServer(delay=delay, slow_every=slow_every, slow_delay=slow_delay) as primary, StubOpenAIServer(delay=delay, slow_every=slow_every, slow_delay=slow_delay) as secondary:
+        results["single backend"] = measure(OpenAIModel("gpt-4", base_url=primary.base_url))
+        results["hedged"] = measure(HedgedLLM([
+            OpenAIModel("gpt-4", base_url=primary.base_url),
+            OpenAIModel("gpt-4", base_url=secondary.base_url),
+        ], hedge_percentile=90, initial_hedge_delay=delay * 4, min_observations=5))
+
+    for name, result in results.items():
+        print(f"{name}: mean {result['mean']:.3f}s, p95 {result['p95']:.3f}s, max {result['max']:.3f}s")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_hedging()
@@ -1,4 +1,6 @@
 import json
+import os
+from LLMInterface import agenerate_samples_all, run_coroutine
 
 def validate_config(config: dict):
     """
@@ -94,3 +96,104 @@ def get_name(config):
     """
     repo, func = config['original_function_save_path'].split('/')[:-1]
     return repo, func[-1]
+
+def write_generated_function(generated_function: str, generated_function_save_path: str):
+    """
+    Write a generated function to its save path
+
+    Args:
+        generated_function (str): The generated function text
+        generated_function_save_path (str): The path to save the generated function to
+    """
+    os.makedirs(os.path.dirname(generated_function_save_path), exist_ok=True)
+
+    with open(generated_function_save_path, 'w') as f:
+        f.write(generated_function)
+
+def generate_function_matrix(config: dict, model_dict: dict, function_generation_prompts: dict, generation_count: int=1, max_concurrency: int=None):
+    """
+    Generate the functions for every prompt type x model in one concurrent run and write them to the paths given by get_function_paths.
+    The generation_count samples of a prompt are requested together, so backends that support it process the prompt only once.
+    The functions of a prompt type x model are written as soon as they are generated, and a failed prompt type x model is reported without losing the others.
+
+    Args:
+        config (dict): The experiment config
+        model_dict (dict): Mapping of model name to LLMInterface instance
+        function_generation_prompts (dict): Mapping of prompt type to the function generation prompt
+        generation_count (int): Number of functions to generate per model and prompt type. Defaults to 1.
+        max_concurrency (int): Maximum number of concurrent prompts per model. Defaults to the max_concurrency of each model.
+
+    Returns:
+        dict: The generated function save paths, keyed by prompt type and model name. The paths of failed prompt type x models are left out.
+    """
+    jobs = []
+    generated_function_save_paths = {prompt_type: {model_name: [] for model_name in model_dict} for prompt_type in function_generation_prompts}
+
+    for prompt_type, prompt in function_generation_prompts.items():
+        if prompt_type == "type3" and config["generated_function_type3_save_dir"] == "":
+            print("Skipping function generation prompt type 3")
+            continue
+
+        for model_name, model in model_dict.items():
+            save_paths = [get_function_paths(config, model_name, prompt_type, i)["generated"] for i in range(1, generation_count + 1)]
+            # tags of the telemetry records, to compare latency and cost across prompt types and models
+            tags = {"prompt_type": prompt_type, "model_key": model_name, "chosen_function": config["chosen_function"]}
+            jobs.append((model, prompt, tags, save_paths))
+            generated_function_save_paths[prompt_type][model_name] = save_paths
+
+    def write_job(index: int, generated_functions: list):
+        for generated_function, generated_function_save_path in zip(generated_functions, jobs[index][3]):
+            write_generated_function(generated_function, generated_function_save_path)
+
+    generated_samples = run_coroutine(agenerate_samples_all([(model, prompt, tags) for model, prompt, tags, _ in jobs], generation_count, max_concurrency, write_job))
+
+    for (_, _, tags, _), generated_functions in zip(jobs, generated_samples):
+        if isinstance(generated_functions, Exception):
+            generated_function_save_paths[tags["prompt_type"]][tags["model_key"]] = []
+
+    return generated_function_save_paths
+
+def generate_function_matrix_batch(configs: list, model_dict: dict, batch_dir: str, generation_count: int=1, poll_interval: float=60, timeout: float=None):
+    """
+    Generate the missing functions of every config with OpenAI batch jobs (one per model) instead of interactive requests, and write them to the paths given by get_function_paths
+
+    Args:
+        configs (list): The experiment configs
+        model_dict (dict): Mapping of model name to OpenAIModel instance
+        batch_dir (str): The directory to write the JSONL batch files to
+        generation_count (int): Number of functions to generate per model and prompt type. Defaults to 1.
+        poll_interval (float): Seconds between polls of the batch status. Defaults to 60.
+        timeout (float): Maximum seconds to wait for each batch. Defaults to None (wait until the batch finishes).
+
+    Returns:
+        dict: The generated function save paths, keyed by model name
+    """
+    generated_function_save_paths = {}
+
+    for model_name, model in model_dict.items():
+        # the save path is unique per request, so it doubles as the custom id of the batch request
+        pending_prompts = {}
+        for config in configs:
+            function_generation_prompts = dict(zip(["type1", "type2", "type3"], load_func_generation_prompts(config)))
+            for prompt_type, prompt in function_generation_prompts.items():
+                if prompt_type == "type3" and config["generated_function_type3_save_dir"] == "":
+                    continue
+
+                for i in range(1, generation_count + 1):
+                    generated_function_save_path = get_function_paths(config, model_name, prompt_type, i)["generated"]
+                    if not os.path.exists(generated_function_save_path):
+                        pending_prompts[generated_function_save_path] = prompt
+
+        if not pending_prompts:
+            print(f"Nothing to generate for {model_name}")
+            generated_function_save_paths[model_name] = []
+            continue
+
+        results = model.generate_batch_job(pending_prompts, f"{batch_dir}/{model_name}.jsonl", poll_interval, timeout)
+        for generated_function_save_path, generated_function in results.items():
+            write_generated_function(generated_function, generated_function_save_path)
+
+        generated_function_save_paths[model_name] = list(results)
+        print(f"Generated {len(results)} of {len(pending_prompts)} functions with {model_name}")
+
+    return generated_function_save_paths
@@ -1,6 +1,28 @@
+import asyncio
+import contextvars
+import inspect
+import os
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator
+from Telemetry import add_to_record, annotate_record, telemetry_tags, track_call, tracked
+
+# methods that write a telemetry record per call, in every backend
+TRACKED_METHODS = ("generate", "agenerate", "generate_samples", "agenerate_samples", "stream")
 
 class LLMInterface(ABC):
+    # maximum number of requests a single backend instance keeps in flight in generate_many / generate_all
+    max_concurrency = 4
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        # backends define generate & co. themselves, so the telemetry wrapper is applied to every subclass
+        for name in TRACKED_METHODS:
+            method = cls.__dict__.get(name)
+            if method is not None and not getattr(method, "_tracked", False):
+                setattr(cls, name, tracked(method))
+
     @abstractmethod
     def __init__(self, *args, **kwargs):
         """
@@ -14,5 +36,340 @@ class LLMInterface(ABC):
         """
         Generate text based on the given prompt.
         """
-        
+
         pass
+
+    def generation_params(self) -> dict:
+        """
+        Get the sampling parameters that affect the generated text, beyond the prompt and model name.
+
+        Returns:
+            dict: The sampling parameters. Defaults to an empty dict, i.e. the provider defaults.
+        """
+
+        return {}
+
+    @tracked
+    async def agenerate(self, prompt: str, *args, **kwargs) -> str:
+        """
+        Asynchronously generate text based on the given prompt.
+        The default implementation runs the blocking generate in a worker thread, which suits backends without an async client (gradio, Gemini, local models).
+        Backends with a native async client override this.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+
+        Returns:
+            str: The string response from the model.
+        """
+
+        return await asyncio.to_thread(self.generate, prompt, *args, **kwargs)
+
+    async def agenerate_many(self, prompts: list[str], max_concurrency: int = None, **kwargs) -> list[str]:
+        """
+        Asynchronously generate a response for every prompt, keeping at most max_concurrency requests in flight.
+
+        Args:
+            prompts (list[str]): The prompts to generate responses for.
+            max_concurrency (int, optional): Maximum number of concurrent requests. Defaults to self.max_concurrency.
+
+        Returns:
+            list[str]: The responses, or the exceptions of the failed prompts, in the same order as prompts.
+        """
+
+        return await agenerate_all([(self, prompt) for prompt in prompts], max_concurrency, **kwargs)
+
+    def generate_many(self, prompts: list[str], max_concurrency: int = None, **kwargs) -> list[str]:
+        """
+        Blocking version of agenerate_many. Safe to call from a notebook cell.
+
+        Args:
+            prompts (list[str]): The prompts to generate responses for.
+            max_concurrency (int, optional): Maximum number of concurrent requests. Defaults to self.max_concurrency.
+
+        Returns:
+            list[str]: The responses, or the exceptions of the failed prompts, in the same order as prompts.
+        """
+
+        return run_coroutine(self.agenerate_many(prompts, max_concurrency, **kwargs))
+
+    @tracked
+    async def agenerate_samples(self, prompt: str, n: int, **kwargs) -> list[str]:
+        """
+        Asynchronously generate n samples for the same prompt.
+        The default implementation issues n concurrent requests. Backends that can return several samples from one request override this so that the prompt is only processed once.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            n (int): The number of samples to generate.
+
+        Returns:
+            list[str]: The n responses. They are also stored in self.sample_texts.
+        """
+
+        self.sample_texts = list(await asyncio.gather(*(self.agenerate(prompt, **kwargs) for _ in range(n))))
+        return self.sample_texts
+
+    @tracked
+    def generate_samples(self, prompt: str, n: int, **kwargs) -> list[str]:
+        """
+        Generate n samples for the same prompt. Blocking version of agenerate_samples.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            n (int): The number of samples to generate.
+
+        Returns:
+            list[str]: The n responses. They are also stored in self.sample_texts.
+        """
+
+        return run_coroutine(self.agenerate_samples(prompt, n, **kwargs))
+
+    @tracked
+    def stream(self, prompt: str, stop_at_code_block: bool = False, **kwargs) -> Iterator[str]:
+        """
+        Generate text based on the given prompt, yielding it in chunks as it arrives.
+        The default implementation does not stream and yields the whole response as one chunk. Backends that can stream override this.
+        Timing information is stored in self.stream_stats and the complete text in self.response_text once the stream ends.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            stop_at_code_block (bool, optional): Stop once the first complete fenced code block has arrived. Defaults to False.
+
+        Yields:
+            str: The chunks of the response.
+        """
+        start_time = time.perf_counter()
+        yield from self._timed_stream(iter([self.generate(prompt, **kwargs)]), start_time, stop_at_code_block)
+
+    def generate_streaming(self, prompt: str, stop_at_code_block: bool = True, **kwargs) -> str:
+        """
+        Generate text based on the given prompt by consuming stream, so that latency is recorded in self.stream_stats and generation can stop at the end of the first code block.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            stop_at_code_block (bool, optional): Stop once the first complete fenced code block has arrived. Defaults to True.
+
+        Returns:
+            str: The streamed response.
+        """
+
+        return "".join(self.stream(prompt, stop_at_code_block, **kwargs))
+
+    def _timed_stream(self, chunks: Iterator[str], start_time: float, stop_at_code_block: bool = False, cancel: Callable[[], None] = None) -> Iterator[str]:
+        """
+        Pass through the chunks of a streamed response while recording time to first token and total latency in self.stream_stats.
+
+        Args:
+            chunks (Iterator[str]): The text chunks of the response.
+            start_time (float): The time.perf_counter() value taken just before the request was sent.
+            stop_at_code_block (bool, optional): Stop once the first complete fenced code block has arrived. Defaults to False.
+            cancel (Callable[[], None], optional): Called to abort the underlying request if the stream is not consumed to the end. Defaults to None.
+
+        Yields:
+            str: The chunks of the response, truncated at the end of the first code block if stop_at_code_block is set.
+        """
+        self.stream_stats = {"time_to_first_token": None, "total_latency": None, "stopped_early": False}
+        text = ""
+        finished = False
+
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+
+                if self.stream_stats["time_to_first_token"] is None:
+                    self.stream_stats["time_to_first_token"] = time.perf_counter() - start_time
+                    annotate_record(time_to_first_token=self.stream_stats["time_to_first_token"])
+
+                if stop_at_code_block:
+                    code_block_end = find_code_block_end(text + chunk)
+                    if code_block_end != -1:
+                        chunk = (text + chunk)[len(text):code_block_end]
+                        text += chunk
+                        self.stream_stats["stopped_early"] = True
+                        yield chunk
+                        break
+
+                text += chunk
+                yield chunk
+            else:
+                finished = True
+        finally:
+            if not finished and cancel is not None:
+                cancel()
+
+            self.stream_stats["total_latency"] = time.perf_counter() - start_time
+            self.response_text = text
+
+    def write_samples_to_files(self, filenames: list[str]) -> None:
+        """
+        Write the samples of the last generate_samples call to files, the i-th sample to the i-th filename.
+
+        Args:
+            filenames (list[str]): The paths to write the samples to, e.g. the numbered GENERATED-<name>_<i> paths.
+        """
+        for filename, sample_text in zip(filenames, self.sample_texts):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+            with open(filename, "w") as f:
+                f.write(sample_text)
+
+
+def _report_failures(jobs: list, results: list) -> None:
+    failures = [(job, result) for job, result in zip(jobs, results) if isinstance(result, Exception)]
+    if failures:
+        print(f"WARNING: {len(failures)} of {len(jobs)} jobs failed, the results of the others are kept:")
+        for job, error in failures:
+            print(f"  {type(job[0]).__name__} {job[2] if len(job) > 2 else ''}: {type(error).__name__}: {error}")
+
+async def agenerate_all(jobs: list[tuple[LLMInterface, str]], max_concurrency: int = None, on_result: Callable[[int, str], None] = None, **kwargs) -> list[str]:
+    """
+    Asynchronously run (model, prompt) jobs across any number of backends.
+    Every backend gets its own concurrency limit, so a slow backend does not hold back the others.
+    A failed job does not stop the others: its exception takes the place of its response, and the failed jobs are reported once every job has finished.
+
+    Args:
+        jobs (list[tuple[LLMInterface, str]]): The (model, prompt) pairs to generate. A job can carry a third element, a dict of telemetry tags such as the prompt type.
+        max_concurrency (int, optional): Maximum number of concurrent requests per backend. Defaults to the max_concurrency of each backend.
+        on_result (Callable[[int, str], None], optional): Called with the index of a job and its response as soon as the job succeeds, e.g. to write it to a file. Defaults to None.
+
+    Returns:
+        list[str]: The responses, or the exceptions of the failed jobs, in the same order as jobs.
+    """
+    semaphores = {}
+
+    async def bounded_generate(index: int, model: LLMInterface, prompt: str, tags: dict = None) -> str:
+        if id(model) not in semaphores:
+            semaphores[id(model)] = asyncio.Semaphore(max_concurrency or model.max_concurrency)
+
+        try:
+            # the record is opened before the semaphore, so that the time spent queueing for it is recorded too
+            with telemetry_tags(**(tags or {})), track_call(model, "agenerate", prompt) as record:
+                queued = time.perf_counter()
+                async with semaphores[id(model)]:
+                    add_to_record(queue_wait=time.perf_counter() - queued)
+                    record["_result"] = await model.agenerate(prompt, **kwargs)
+                    result = record["_result"]
+        except Exception as e:
+            return e
+
+        if on_result is not None:
+            on_result(index, result)
+        return result
+
+    results = await asyncio.gather(*(bounded_generate(i, *job) for i, job in enumerate(jobs)))
+    _report_failures(jobs, results)
+    return results
+
+async def agenerate_samples_all(jobs: list[tuple[LLMInterface, str]], n: int, max_concurrency: int = None, on_result: Callable[[int, list[str]], None] = None, **kwargs) -> list[list[str]]:
+    """
+    Asynchronously generate n samples for every (model, prompt) job across any number of backends.
+    Every backend gets its own concurrency limit on the number of jobs in flight.
+    A failed job does not stop the others: its exception takes the place of its samples, and the failed jobs are reported once every job has finished.
+
+    Args:
+        jobs (list[tuple[LLMInterface, str]]): The (model, prompt) pairs to generate. A job can carry a third element, a dict of telemetry tags such as the prompt type.
+        n (int): The number of samples per job.
+        max_concurrency (int, optional): Maximum number of concurrent jobs per backend. Defaults to the max_concurrency of each backend.
+        on_result (Callable[[int, list[str]], None], optional): Called with the index of a job and its samples as soon as the job succeeds, e.g. to write them to files. Defaults to None.
+
+    Returns:
+        list[list[str]]: The n responses of every job, or the exceptions of the failed jobs, in the same order as jobs.
+    """
+    semaphores = {}
+
+    async def bounded_generate_samples(index: int, model: LLMInterface, prompt: str, tags: dict = None) -> list[str]:
+        if id(model) not in semaphores:
+            semaphores[id(model)] = asyncio.Semaphore(max_concurrency or model.max_concurrency)
+
+        try:
+            with telemetry_tags(**(tags or {})), track_call(model, "agenerate_samples", prompt, n) as record:
+                queued = time.perf_counter()
+                async with semaphores[id(model)]:
+                    add_to_record(queue_wait=time.perf_counter() - queued)
+                    record["_result"] = await model.agenerate_samples(prompt, n, **kwargs)
+                    result = record["_result"]
+        except Exception as e:
+            return e
+
+        if on_result is not None:
+            on_result(index, result)
+        return result
+
+    results = await asyncio.gather(*(bounded_generate_samples(i, *job) for i, job in enumerate(jobs)))
+    _report_failures(jobs, results)
+    return results
+
+def generate_all(jobs: list[tuple[LLMInterface, str]], max_concurrency: int = None, on_result: Callable[[int, str], None] = None, **kwargs) -> list[str]:
+    """
+    Blocking version of agenerate_all. Safe to call from a notebook cell.
+
+    Args:
+        jobs (list[tuple[LLMInterface, str]]): The (model, prompt) pairs to generate.
+        max_concurrency (int, optional): Maximum number of concurrent requests per backend. Defaults to the max_concurrency of each backend.
+        on_result (Callable[[int, str], None], optional): Called with the index of a job and its response as soon as the job succeeds. Defaults to None.
+
+    Returns:
+        list[str]: The responses, or the exceptions of the failed jobs, in the same order as jobs.
+    """
+
+    return run_coroutine(agenerate_all(jobs, max_concurrency, on_result, **kwargs))
+
+def accepts_sample_index(model: LLMInterface) -> bool:
+    """
+    Check whether a model's generate takes a sample_index, as wrappers such as CachedLLM and SingleFlightLLM do, so that wrappers can pass the sample index on.
+
+    Args:
+        model (LLMInterface): The model.
+
+    Returns:
+        bool: True if generate has a sample_index parameter.
+    """
+    return "sample_index" in inspect.signature(model.generate).parameters
+
+def find_code_block_end(text: str) -> int:
+    """
+    Find the end of the first complete fenced (```) code block in the text.
+
+    Args:
+        text (str): The text to search.
+
+    Returns:
+        int: The index just after the closing fence, or -1 if no code block has been closed yet.
+    """
+    opening_fence = text.find("```")
+    if opening_fence == -1:
+        return -1
+
+    # the opening fence runs to the end of its line, e.g. ```python
+    opening_line_end = text.find("\n", opening_fence)
+    if opening_line_end == -1:
+        return -1
+
+    closing_fence = text.find("```", opening_line_end)
+    if closing_fence == -1:
+        return -1
+
+    return closing_fence + 3
+
+def run_coroutine(coroutine):
+    """
+    Run a coroutine to completion from synchronous code.
+    Jupyter already runs an event loop in the main thread, so in that case the coroutine is driven by a fresh loop in a worker thread.
+
+    Args:
+        coroutine: The coroutine to run.
+
+    Returns:
+        The result of the coroutine.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # the worker thread runs in a copy of the current context, so that telemetry tags and the call in progress carry over
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(context.run, asyncio.run, coroutine).result()
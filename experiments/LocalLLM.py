@@ -1,5 +1,10 @@
 # %%
+import asyncio
 import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterator
 from LLMInterface import LLMInterface
 # %%
 
@@ -10,9 +15,41 @@ from LLMInterface import LLMInterface
 # os.environ["HF_HOME"] = cache_dir
 # os.environ["HF_DATASETS_CACHE"] = cache_dir
 
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer, pipeline
+
+class EventStoppingCriteria(StoppingCriteria):
+    def __init__(self, stop_event: threading.Event) -> None:
+        """
+        Stopping criteria that ends generation once stop_event is set, used to cancel a streamed generation from another thread.
+
+        Args:
+            stop_event (threading.Event): The event that signals generation should stop.
+        """
+        self.stop_event = stop_event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.stop_event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+def _common_prefix_length(a: tuple, b: list) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+def _cache_bytes(past_key_values: DynamicCache) -> int:
+    return sum(tensor.numel() * tensor.element_size() for tensor in [*past_key_values.key_cache, *past_key_values.value_cache])
+
+def _copy_cache(past_key_values: DynamicCache) -> DynamicCache:
+    # generate, crop and batch_repeat_interleave replace the tensors of a cache instead of writing into them, so a new cache holding the same tensors leaves the cached ones intact
+    return DynamicCache.from_legacy_cache(past_key_values.to_legacy_cache())
 
 class LocalLLM(LLMInterface):
+    # a single local model cannot serve concurrent pipeline calls, so requests are run one at a time
+    max_concurrency = 1
+
     def __init__(self, 
                 model_name:str,
                 max_new_tokens:int=1024,
@@ -24,7 +61,9 @@ class LocalLLM(LLMInterface):
                 repetition_penalty:float=1.1,
                 model_args=[], model_kwargs={},
                 tokenizer_args=[], tokenizer_kwargs={},
-                pipeline_args=[], pipeline_kwargs={}) -> None:
+                pipeline_args=[], pipeline_kwargs={},
+                prefix_cache_bytes:int=0,
+                min_prefix_tokens:int=256) -> None:
         """
         Initialize the model from huggingface hub. The model will run locally with device_map set to auto.
 
@@ -43,6 +82,8 @@ class LocalLLM(LLMInterface):
             tokenizer_kwargs (dict, optional): keyword arguments to pass to AutoTokenizer.from_pretrained. Defaults to {}.
             pipeline_args (list, optional): arguments to pass to pipeline. Defaults to [].
             pipeline_kwargs (dict, optional): keyword arguments to pass to pipeline. Defaults to {}.
+            prefix_cache_bytes (int, optional): Maximum size of the past key/values kept for prompt prefixes, see generate. The past key/values of a 10k token prompt of a 6.7B model without grouped-query attention take about 5 GB. Defaults to 0, i.e. no prefix caching, so that every prompt goes through the pipeline.
+            min_prefix_tokens (int, optional): Minimum number of leading tokens a prompt must share with a cached prompt for its past key/values to be reused. Defaults to 256.
         """        
         self.model_name = model_name
         self.max_new_tokens = max_new_tokens
@@ -53,6 +94,13 @@ class LocalLLM(LLMInterface):
         self.top_k = top_k
         self.repetition_penalty = repetition_penalty
 
+        # token ids of a prompt prefix -> its past key/values, least recently used first. prefix_tokens and prompt_tokens add up over the calls, like hits and misses
+        self.prefix_cache_bytes = prefix_cache_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+        self._prefix_cache = OrderedDict()
+        self._prefix_cache_size = 0
+        self.prefix_cache_stats = {"hits": 0, "misses": 0, "prefix_tokens": 0, "prompt_tokens": 0}
+
         self.model = AutoModelForCausalLM.from_pretrained(
             self.model_name,
             torch_dtype="auto",
@@ -82,6 +130,23 @@ class LocalLLM(LLMInterface):
             **pipeline_kwargs
         )
 
+    def generation_params(self) -> dict:
+        """
+        Get the sampling parameters the pipeline was created with.
+
+        Returns:
+            dict: The sampling parameters.
+        """
+        return {
+            "max_new_tokens": self.max_new_tokens,
+            "do_sample": self.do_sample,
+            "num_beams": self.num_beams,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "top_k": self.top_k,
+            "repetition_penalty": self.repetition_penalty,
+        }
+
     def chat_generate(self, messages: list[dict], *args, **kwargs) -> str:
         """
         Generate a response from a list of messages.
@@ -96,32 +161,281 @@ class LocalLLM(LLMInterface):
         self.last_response = self.pipe(messages, *args, **kwargs)
         return self.last_response[0]['generated_text'][-1]['content'].replace("\\n", "\n")
     
-    def generate(self, prompt: str, *args, **kwargs) -> str:
+    def generate(self, prompt: str, *args, prefix: str = None, **kwargs) -> str:
         """
         Generate a response from a single prompt. This is equivalent to calling generate with the prompt after system message specified in this function.
+        With prefix_cache_bytes set, the past key/values of the prompt are cached, and a later prompt sharing at least min_prefix_tokens leading tokens with a cached one,
+        e.g. the type2 and type3 prompts of a config, which share everything up to the end of the codebase summary, only prefills the tokens after the shared ones.
 
         Args:
             prompt (str): Prompt to pass as user content to the model
+            prefix (str, optional): A leading part of prompt to cache the past key/values of, instead of the part shared with a cached prompt. Defaults to None.
 
         Returns:
             str: Returns the cleaned string response from the model. The entire response object is stored in self.last_response.
         """        
-        messages = [
+        # the pipeline ignores positional arguments with a warning, so calls with them go through it unchanged
+        if self.prefix_cache_bytes > 0 and not args:
+            return self._generate_with_prefix(prompt, prefix, 1, **kwargs)[0]
+
+        messages = self._messages(prompt)
+        self.last_response = self.pipe(messages, *args, **kwargs)
+        return self.last_response[0]['generated_text'][-1]['content'].replace("\\n", "\n")
+
+    def stream(self, prompt: str, stop_at_code_block: bool = False, *args, **kwargs) -> Iterator[str]:
+        """
+        Generate a response from a single prompt, yielding decoded text as tokens are produced.
+        The pipeline runs in a background thread feeding a TextIteratorStreamer. If stop_at_code_block is set, generation is stopped once the first complete code block has been produced.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            stop_at_code_block (bool, optional): Stop once the first complete fenced code block has been produced. Defaults to False.
+
+        Yields:
+            str: The chunks of the response. Timing information is stored in self.stream_stats and the complete text in self.response_text.
+        """
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop_event = threading.Event()
+
+        def run_pipeline():
+            self.last_response = self.pipe(
+                self._messages(prompt),
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([EventStoppingCriteria(stop_event)]),
+                *args,
+                **kwargs
+            )
+
+        start_time = time.perf_counter()
+        thread = threading.Thread(target=run_pipeline, daemon=True)
+        thread.start()
+
+        try:
+            yield from self._timed_stream(streamer, start_time, stop_at_code_block, cancel=stop_event.set)
+        finally:
+            stop_event.set()
+            thread.join()
+            # the pipeline result holds the untruncated text, so write_to_file falls back to the streamed text
+            self.last_response = None
+
+    def generate_samples(self, prompt: str, n: int, *args, prefix: str = None, **kwargs) -> list[str]:
+        """
+        Generate n samples for a single prompt in one call using num_return_sequences, so the prompt is prefilled once instead of n times. With prefix_cache_bytes set, the past key/values of the prompt are cached and reused as in generate.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            n (int): The number of samples to generate.
+            prefix (str, optional): A leading part of prompt to cache the past key/values of, instead of the part shared with a cached prompt. Defaults to None.
+
+        Returns:
+            list[str]: The n cleaned string responses. The entire response object is stored in self.last_response.
+        """
+        if self.prefix_cache_bytes > 0 and not args:
+            self.sample_texts = self._generate_with_prefix(prompt, prefix, n, **kwargs)
+            return self.sample_texts
+
+        messages = self._messages(prompt)
+        self.last_response = self.pipe(messages, num_return_sequences=n, *args, **kwargs)
+        self.sample_texts = [sample['generated_text'][-1]['content'].replace("\\n", "\n") for sample in self.last_response]
+        return self.sample_texts
+
+    def _cache_prefix(self, key: tuple, past_key_values: DynamicCache) -> None:
+        """
+        Keep the past key/values of a prefix, dropping the least recently used ones beyond prefix_cache_bytes.
+        """
+        size = _cache_bytes(past_key_values)
+        if size > self.prefix_cache_bytes:
+            print(f"WARNING: The past key/values of a {len(key)} token prefix take {size / 1024 ** 2:.0f} MiB, more than prefix_cache_bytes ({self.prefix_cache_bytes / 1024 ** 2:.0f} MiB), and are not cached")
+            return
+
+        self._prefix_cache[key] = past_key_values
+        self._prefix_cache_size += size
+        while self._prefix_cache_size > self.prefix_cache_bytes:
+            _, dropped = self._prefix_cache.popitem(last=False)
+            self._prefix_cache_size -= _cache_bytes(dropped)
+
+    def _prefix_past_key_values(self, input_ids: torch.LongTensor, prefix_length: int = None) -> tuple[DynamicCache, int]:
+        """
+        Get the past key/values to start generating from input_ids with, and the number of cached tokens that were reused.
+        With prefix_length, the past key/values of the first prefix_length tokens are reused or prefilled and cached. Otherwise the cached prefix sharing the most
+        leading tokens with input_ids is reused if it shares at least min_prefix_tokens, and the past key/values of all tokens but the last are cached for later prompts.
+        """
+        token_ids = input_ids[0].tolist()
+        if prefix_length is not None:
+            key = tuple(token_ids[:prefix_length])
+            reused = prefix_length if key in self._prefix_cache else 0
+            cached_key = key
+        else:
+            # the last token is left for generate to prefill
+            key = tuple(token_ids[:-1])
+            cached_key, reused = max(((cached_key, _common_prefix_length(cached_key, key)) for cached_key in self._prefix_cache), key=lambda item: item[1], default=(None, 0))
+            if reused < self.min_prefix_tokens:
+                reused = 0
+
+        if reused > 0:
+            self._prefix_cache.move_to_end(cached_key)
+            self.prefix_cache_stats["hits"] += 1
+            past_key_values = _copy_cache(self._prefix_cache[cached_key])
+            if past_key_values.get_seq_length() > reused:
+                past_key_values.crop(reused)
+        else:
+            self.prefix_cache_stats["misses"] += 1
+            past_key_values = DynamicCache()
+
+        if reused < len(key):
+            with torch.no_grad():
+                self.model(input_ids[:, reused:len(key)], past_key_values=past_key_values, use_cache=True)
+            self._cache_prefix(key, past_key_values)
+            past_key_values = _copy_cache(past_key_values)
+
+        return past_key_values, reused
+
+    def _generate_with_prefix(self, prompt: str, prefix: str, n: int, **kwargs) -> list[str]:
+        """
+        Generate n samples for a prompt, reusing cached past key/values of its leading tokens so that only the remaining tokens are prefilled.
+        """
+        if prefix is not None and not prompt.startswith(prefix):
+            raise ValueError("The prompt does not start with the given prefix")
+
+        messages = self._messages(prompt)
+        text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        input_ids = self.tokenizer(text, return_tensors="pt", add_special_tokens=False).input_ids.to(self.model.device)
+
+        prefix_length = None
+        if prefix is not None:
+            # the prefix ends inside the chat template, after everything that comes before the user content
+            prefix_text = text[:text.index(prompt) + len(prefix)]
+            prefix_ids = self.tokenizer(prefix_text, add_special_tokens=False).input_ids
+
+            # tokens at the end of the prefix can merge with the text after it, so only the tokens both tokenizations agree on are reused,
+            # and at least one token is left for generate to prefill
+            prefix_length = min(_common_prefix_length(tuple(prefix_ids), input_ids[0].tolist()), input_ids.shape[1] - 1)
+
+        past_key_values, reused = self._prefix_past_key_values(input_ids, prefix_length)
+        if n > 1:
+            past_key_values.batch_repeat_interleave(n)
+        input_ids = input_ids.repeat(n, 1)
+
+        # the generation settings of the pipeline, i.e. those it was created with including pipeline_kwargs, overridden by those of the call, as the pipeline merges them
+        _, call_params, _ = self.pipe._sanitize_parameters(**kwargs)
+        generate_kwargs = {"generation_config": self.pipe.generation_config, **self.pipe._forward_params, **call_params}
+        if self.tokenizer.pad_token_id is None:
+            generate_kwargs.setdefault("pad_token_id", self.tokenizer.eos_token_id)
+
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past_key_values,
+                **generate_kwargs
+            )
+
+        self.prefix_cache_stats["prefix_tokens"] += reused
+        self.prefix_cache_stats["prompt_tokens"] += input_ids.shape[1]
+
+        texts = [self.tokenizer.decode(output[input_ids.shape[1]:], skip_special_tokens=True).replace("\\n", "\n") for output in outputs]
+        # same shape as the pipeline output, so that write_to_file works unchanged
+        self.last_response = [{"generated_text": [*messages, {"role": "assistant", "content": text}]} for text in texts]
+        return texts
+
+    def clear_prefix_cache(self) -> None:
+        """
+        Drop the cached past key/values of every prefix, e.g. to free memory once a repository is done.
+        """
+        self._prefix_cache.clear()
+        self._prefix_cache_size = 0
+
+    async def agenerate_samples(self, prompt: str, n: int, *args, **kwargs) -> list[str]:
+        """
+        Asynchronously generate n samples for a single prompt. Runs generate_samples in a worker thread.
+        """
+        return await asyncio.to_thread(self.generate_samples, prompt, n, *args, **kwargs)
+
+    def generate_batch(self, prompts: list[str], batch_size: int=4, verbose: bool=True, *args, **kwargs) -> list[str]:
+        """
+        Generate responses for many prompts, running batch_size prompts through the pipeline together.
+        Prompts are sorted by token length before batching so that each batch carries as little padding as possible.
+        The throughput of every batch is stored in self.batch_stats, which can be used to choose the best batch size for a host.
+
+        Args:
+            prompts (list[str]): Prompts to pass as user content to the model
+            batch_size (int, optional): Number of prompts per batch. Defaults to 4.
+            verbose (bool, optional): Print the tokens/sec of every batch. Defaults to True.
+
+        Returns:
+            list[str]: The cleaned string responses, in the same order as prompts. The entire response object of the last prompt is stored in self.last_response.
+        """
+        # decoder-only models must be padded on the left so that generation continues right after each prompt.
+        # The tokenizer is shared with generate and stream, so its padding settings are restored afterwards.
+        pad_token, padding_side = self.tokenizer.pad_token, self.tokenizer.padding_side
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = "left"
+
+        try:
+            messages = [self._messages(prompt) for prompt in prompts]
+            prompt_lengths = [len(self.tokenizer.apply_chat_template(m, add_generation_prompt=True)) for m in messages]
+            order = sorted(range(len(prompts)), key=lambda i: prompt_lengths[i])
+
+            responses = [None] * len(prompts)
+            self.batch_stats = []
+
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+
+                start_time = time.perf_counter()
+                outputs = self.pipe([messages[i] for i in batch], batch_size=len(batch), *args, **kwargs)
+                elapsed = time.perf_counter() - start_time
+
+                new_tokens = 0
+                for i, output in zip(batch, outputs):
+                    responses[i] = output
+                    new_tokens += len(self.tokenizer.encode(output[0]['generated_text'][-1]['content'], add_special_tokens=False))
+
+                stats = {
+                    "batch_size": len(batch),
+                    "prompt_tokens": sum(prompt_lengths[i] for i in batch),
+                    "padded_prompt_tokens": len(batch) * max(prompt_lengths[i] for i in batch),
+                    "new_tokens": new_tokens,
+                    "seconds": elapsed,
+                    "tokens_per_second": new_tokens / elapsed if elapsed > 0 else 0.0,
+                }
+                self.batch_stats.append(stats)
+
+                if verbose:
+                    print(f"Batch {len(self.batch_stats)}: {stats['batch_size']} prompts, {stats['new_tokens']} new tokens in {stats['seconds']:.1f}s ({stats['tokens_per_second']:.1f} tokens/s)")
+
+            if responses:
+                self.last_response = responses[-1]
+
+            return [response[0]['generated_text'][-1]['content'].replace("\\n", "\n") for response in responses]
+        finally:
+            self.tokenizer.pad_token = pad_token
+            self.tokenizer.padding_side = padding_side
+
+    def _messages(self, prompt: str) -> list[dict]:
+        """
+        Build the chat messages for a single prompt.
+        """
+        return [
                 {
                     "role": "system", "content": "You are a helpful coding chatbot. You will answer the user's questions to the best of your ability.",
                     "role": "user", "content": prompt,
                 },
         ]
-        self.last_response = self.pipe(messages, *args, **kwargs)
-        return self.last_response[0]['generated_text'][-1]['content'].replace("\\n", "\n")
     
-    def write_to_file(self, filepath: str) -> None:
+    def write_to_file(self, filepath: str, choice: int = 0) -> None:
         """Write the text of the last response to a file.
 
         Args:
             filepath (str): The path to the file to write to.
+            choice (int, optional): The sample of the last response to write, when it holds several. Defaults to 0.
         """ 
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
                
         with open(filepath, "w") as f:
-            f.write(self.last_response[0]['generated_text'][-1]['content'].replace("\\n", "\n"))
+            # a streamed response is only kept as text
+            if self.last_response is None:
+                f.write(self.response_text.replace("\\n", "\n"))
+            else:
+                f.write(self.last_response[choice]['generated_text'][-1]['content'].replace("\\n", "\n"))
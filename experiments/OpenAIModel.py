@@ -1,25 +1,53 @@
-from openai import OpenAI
+import json
+import time
+from typing import Iterator
+from ClientPool import load_environment
+from EndpointPool import Endpoint, EndpointPool, chat_completions
 from LLMInterface import LLMInterface
+from PromptBudget import check_prompt_length
+from RateLimiter import ProviderRateLimiter, estimate_tokens, get_rate_limiter, get_used_tokens
 import os
-from dotenv import load_dotenv
 
 class OpenAIModel(LLMInterface):
-    def __init__(self, model_name: str) -> None:
+    max_concurrency = 8
+
+    def __init__(self, model_name: str, base_url: str = None, rate_limiter: ProviderRateLimiter = None, endpoints: EndpointPool = None) -> None:
         """
         Initialize the OpenAI model.
 
         Args:
             model_name (str): The model name to use.
+            base_url (str, optional): The base URL of an OpenAI-compatible API. Defaults to None, i.e. the OpenAI API.
+            rate_limiter (ProviderRateLimiter, optional): The rate limiter to pace and retry requests with. Defaults to the limiter shared by all OpenAI models.
+            endpoints (EndpointPool, optional): Several API keys or endpoints to spread the requests over, e.g. endpoint_pool_from_env("openai"). Defaults to None, i.e. OPENAI_API_KEY at base_url.
+
+        Models with the same base URL and API key share one client, and so one pool of keep-alive connections.
         """
 
-        load_dotenv()
-        self.api_key = os.getenv("OPENAI_API_KEY")
-        self.model = OpenAI(
-            api_key=self.api_key,
-        )
+        load_environment()
+        if endpoints is None:
+            endpoints = EndpointPool([Endpoint(os.getenv("OPENAI_API_KEY"), base_url, rate_limiter if rate_limiter is not None else get_rate_limiter("openai"))])
+        self.endpoints = endpoints
+        # batch jobs are bound to the key that submitted them, so they always use the first endpoint
+        self.api_key = endpoints.endpoints[0].api_key
+        self.base_url = endpoints.endpoints[0].base_url
+        self.model = endpoints.endpoints[0].client()
         self.model_name = model_name
+        self.rate_limiter = endpoints.endpoints[0].rate_limiter
+
+    def _messages(self, prompt: str) -> list[dict]:
+        """
+        Build the chat messages for a single prompt, after checking that it fits the context window of the model.
+        """
+        check_prompt_length(self.model_name, prompt)
+        return [
+            {
+                "role": "user",
+                "content": prompt,
+            }
+        ]
 
-    def generate(self, prompt: str) -> str:
+    def generate(self, prompt: str, **kwargs) -> str:
         """
         Generate text based on the given prompt.
 
@@ -28,28 +56,240 @@ class OpenAIModel(LLMInterface):
 
         Returns:
             str: Returns the cleaned string response from the model. The entire response object is stored in self.last_response.
-        """     
+        """
 
-        self.response = self.model.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
+        response = self.endpoints.call(
+            chat_completions,
+            estimated_tokens=estimate_tokens(prompt),
+            used_tokens=get_used_tokens,
+            messages=self._messages(prompt),
+            model=self.model_name,
+            **kwargs
+        )
+
+        self.response = response
+        return response.choices[0].message.content
+
+    async def agenerate(self, prompt: str, **kwargs) -> str:
+        """
+        Asynchronously generate text based on the given prompt using the async OpenAI client.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+
+        Returns:
+            str: Returns the cleaned string response from the model. The entire response object is stored in self.response.
+        """
+
+        response = await self.endpoints.acall(
+            chat_completions,
+            estimated_tokens=estimate_tokens(prompt),
+            used_tokens=get_used_tokens,
+            messages=self._messages(prompt),
+            model=self.model_name,
+            **kwargs
+        )
+
+        self.response = response
+        return response.choices[0].message.content
+
+    def generate_samples(self, prompt: str, n: int, **kwargs) -> list[str]:
+        """
+        Generate n samples for the given prompt in a single request using the API's n parameter, so the prompt is only processed once.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            n (int): The number of samples to generate.
+
+        Returns:
+            list[str]: The n responses. The entire response object is stored in self.response.
+        """
+
+        response = self.endpoints.call(
+            chat_completions,
+            estimated_tokens=estimate_tokens(prompt),
+            used_tokens=get_used_tokens,
+            messages=self._messages(prompt),
+            model=self.model_name,
+            n=n,
+            **kwargs
+        )
+
+        self.response = response
+        self.sample_texts = [choice.message.content for choice in response.choices]
+        return self.sample_texts
+
+    async def agenerate_samples(self, prompt: str, n: int, **kwargs) -> list[str]:
+        """
+        Asynchronously generate n samples for the given prompt in a single request using the API's n parameter.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            n (int): The number of samples to generate.
+
+        Returns:
+            list[str]: The n responses. The entire response object is stored in self.response.
+        """
+
+        response = await self.endpoints.acall(
+            chat_completions,
+            estimated_tokens=estimate_tokens(prompt),
+            used_tokens=get_used_tokens,
+            messages=self._messages(prompt),
+            model=self.model_name,
+            n=n,
+            **kwargs
+        )
+
+        self.response = response
+        self.sample_texts = [choice.message.content for choice in response.choices]
+        return self.sample_texts
+
+    def stream(self, prompt: str, stop_at_code_block: bool = False, **kwargs) -> Iterator[str]:
+        """
+        Generate text based on the given prompt, yielding chunks as the API streams them.
+        If stop_at_code_block is set, the request is closed as soon as the first complete code block has arrived, so no output tokens are spent on trailing explanations.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            stop_at_code_block (bool, optional): Stop once the first complete fenced code block has arrived. Defaults to False.
+
+        Yields:
+            str: The chunks of the response. Timing information is stored in self.stream_stats and the complete text in self.response_text.
+        """
+
+        start_time = time.perf_counter()
+        response = self.endpoints.call(
+            chat_completions,
+            estimated_tokens=estimate_tokens(prompt),
+            used_tokens=get_used_tokens,
+            messages=self._messages(prompt),
             model=self.model_name,
+            stream=True,
+            **kwargs
+        )
+        self.response = None
+
+        chunks = (chunk.choices[0].delta.content for chunk in response if chunk.choices)
+        yield from self._timed_stream(chunks, start_time, stop_at_code_block, cancel=response.close)
+
+    def submit_batch(self, prompts: dict, batch_file_path: str, **kwargs) -> str:
+        """
+        Submit prompts as an offline batch job. The requests are serialized to a JSONL batch file, uploaded and queued with the Batch API, which is cheaper than interactive requests.
+
+        Args:
+            prompts (dict): Mapping of a unique custom id (e.g. the path to save the response to) to the prompt.
+            batch_file_path (str): The path to write the JSONL batch file to.
+
+        Returns:
+            str: The id of the batch job.
+        """
+        os.makedirs(os.path.dirname(batch_file_path), exist_ok=True)
+
+        with open(batch_file_path, "w") as f:
+            for custom_id, prompt in prompts.items():
+                request = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {"model": self.model_name, "messages": self._messages(prompt), **kwargs},
+                }
+                f.write(json.dumps(request) + "\n")
+
+        with open(batch_file_path, "rb") as f:
+            batch_file = self.model.files.create(file=f, purpose="batch")
+
+        batch = self.model.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
         )
+        return batch.id
+
+    def wait_for_batch(self, batch_id: str, poll_interval: float = 60, timeout: float = None):
+        """
+        Poll a batch job until it has finished.
+
+        Args:
+            batch_id (str): The id of the batch job.
+            poll_interval (float, optional): Seconds between polls. Defaults to 60.
+            timeout (float, optional): Maximum seconds to wait. Defaults to None (wait until the batch finishes).
+
+        Returns:
+            Batch: The finished batch job.
+        """
+        start_time = time.monotonic()
+        while True:
+            batch = self.model.batches.retrieve(batch_id)
+            if batch.status in ("completed", "failed", "expired", "cancelled"):
+                return batch
+
+            if timeout is not None and time.monotonic() - start_time > timeout:
+                raise TimeoutError(f"Batch {batch_id} did not finish within {timeout} seconds (status: {batch.status})")
+
+            time.sleep(poll_interval)
+
+    def get_batch_results(self, batch) -> dict:
+        """
+        Download the responses of a finished batch job.
+
+        Args:
+            batch (Batch): The finished batch job, as returned by wait_for_batch.
+
+        Returns:
+            dict: Mapping of custom id to the response text. Requests that failed are left out.
+        """
+        if batch.status != "completed" or batch.output_file_id is None:
+            print(f"WARNING: Batch {batch.id} finished with status {batch.status}")
+            return {}
+
+        results = {}
+        for line in self.model.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") != 200:
+                print(f"WARNING: Batch request {result['custom_id']} failed: {result.get('error')}")
+                continue
+
+            results[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+
+        return results
+
+    def generate_batch_job(self, prompts: dict, batch_file_path: str, poll_interval: float = 60, timeout: float = None, **kwargs) -> dict:
+        """
+        Generate responses for many prompts with one offline batch job: submit, wait for it to finish and download the results.
+
+        Args:
+            prompts (dict): Mapping of a unique custom id (e.g. the path to save the response to) to the prompt.
+            batch_file_path (str): The path to write the JSONL batch file to.
+            poll_interval (float, optional): Seconds between polls. Defaults to 60.
+            timeout (float, optional): Maximum seconds to wait. Defaults to None (wait until the batch finishes).
+
+        Returns:
+            dict: Mapping of custom id to the response text.
+        """
+        batch_id = self.submit_batch(prompts, batch_file_path, **kwargs)
+        print(f"Submitted batch {batch_id} with {len(prompts)} requests")
+
+        batch = self.wait_for_batch(batch_id, poll_interval, timeout)
+        return self.get_batch_results(batch)
 
-        return self.response.choices[0].message.content
-    
-    def write_to_file(self, filename: str) -> None:
+    def write_to_file(self, filename: str, choice: int = 0) -> None:
         """
         Write the generated text to a file.
 
         Args:
             filepath (str): The path to the file to write to.
+            choice (int, optional): The sample of the last response to write, when it holds several. Defaults to 0.
         """
         os.makedirs(os.path.dirname(filename), exist_ok=True)
 
         with open(filename, "w") as file:
-            file.write(self.response.choices[0].message.content)
\ No newline at end of file
+            # a streamed response is only kept as text
+            if self.response is None:
+                file.write(self.response_text)
+            else:
+                file.write(self.response.choices[choice].message.content)
@@ -0,0 +1,210 @@
+import importlib.util
+from functools import lru_cache
+from PromptTemplate import compile_template
+from RateLimiter import estimate_tokens
+
+# model name fragment -> context window in tokens. The longest fragment contained in a model name wins, so "gpt-4o" is not mistaken for "gpt-4".
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "deepseek": 65536,
+    "gemini-1.5-pro": 2097152,
+    "CodeQwen1.5": 65536,
+    "Artigenz-Coder-DS-6.7B": 16384,
+}
+
+# model name fragment -> Hugging Face tokenizer used to count its tokens. OpenAI models are counted with tiktoken.
+HF_TOKENIZERS = {
+    "deepseek": "deepseek-ai/DeepSeek-V2.5",
+    "CodeQwen1.5": "Qwen/CodeQwen1.5-7B-Chat",
+    "Artigenz-Coder-DS-6.7B": "Artigenz/Artigenz-Coder-DS-6.7B",
+}
+
+# tokens added by the chat format (role markers, system message) on top of the prompt itself
+CHAT_OVERHEAD_TOKENS = 32
+
+TRUNCATION_MARKER = "\n[...]"
+
+def _match(table: dict, model_name: str) -> str:
+    fragments = [fragment for fragment in table if fragment.lower() in model_name.lower()]
+    return max(fragments, key=len) if fragments else None
+
+def context_window(model_name: str) -> int:
+    """
+    Get the context window of a model.
+
+    Args:
+        model_name (str): The model name used by the backend, e.g. "gpt-3.5-turbo" or "userName/Artigenz-Artigenz-Coder-DS-6.7B".
+
+    Returns:
+        int: The context window in tokens, or None if it is not known.
+    """
+    fragment = _match(CONTEXT_WINDOWS, model_name)
+    return CONTEXT_WINDOWS[fragment] if fragment else None
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_name: str, local_files_only: bool = False):
+    """
+    Load the tokenizer of a model once per process.
+
+    Args:
+        model_name (str): The model name used by the backend.
+        local_files_only (bool, optional): Only load a Hugging Face tokenizer already in the local cache instead of downloading it, e.g. while a request is being sent. Defaults to False.
+
+    Returns:
+        A function that takes a text and returns its token ids, or None if no tokenizer is available (tiktoken and transformers are optional) or it could not be loaded.
+    """
+    if model_name.startswith("gpt-") and importlib.util.find_spec("tiktoken") is not None:
+        import tiktoken
+
+        try:
+            try:
+                return tiktoken.encoding_for_model(model_name).encode
+            except KeyError:
+                return tiktoken.get_encoding("cl100k_base").encode
+        except Exception as e:
+            print(f"WARNING: Could not load the tokenizer of {model_name}, estimating token counts instead: {e}")
+            return None
+
+    fragment = _match(HF_TOKENIZERS, model_name)
+    if fragment and importlib.util.find_spec("transformers") is not None:
+        from transformers import AutoTokenizer
+
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(HF_TOKENIZERS[fragment], local_files_only=local_files_only)
+            return lambda text: tokenizer.encode(text, add_special_tokens=False)
+        except Exception as e:
+            # a tokenizer missing from the local cache is expected, and only means that the prompt length is not checked
+            if not local_files_only:
+                print(f"WARNING: Could not load the tokenizer of {model_name}, estimating token counts instead: {e}")
+
+    return None
+
+def count_tokens(text: str, model_name: str) -> int:
+    """
+    Count the tokens of a text for a model, falling back to a rough estimate if its tokenizer is not available.
+
+    Args:
+        text (str): The text.
+        model_name (str): The model name used by the backend.
+
+    Returns:
+        int: The number of tokens.
+    """
+    encode = get_tokenizer(model_name)
+    return len(encode(text)) if encode is not None else estimate_tokens(text)
+
+def check_prompt_length(model_name: str, prompt: str, reserve_tokens: int = 0) -> None:
+    """
+    Check before sending a request that the prompt fits in the context window of the model, so that an oversized prompt fails without a paid round-trip.
+    The check never downloads a tokenizer, and is skipped when the tokens of the model cannot be counted exactly, rather than rejecting a prompt on an estimate.
+
+    Args:
+        model_name (str): The model name used by the backend.
+        prompt (str): The prompt.
+        reserve_tokens (int, optional): Tokens to keep free for the response. Defaults to 0.
+
+    Raises:
+        ValueError: If the prompt does not fit.
+    """
+    window = context_window(model_name)
+    if window is None:
+        return
+
+    encode = get_tokenizer(model_name, local_files_only=True)
+    if encode is None:
+        return
+
+    tokens = len(encode(prompt)) + CHAT_OVERHEAD_TOKENS
+    if tokens + reserve_tokens > window:
+        raise ValueError(f"The prompt has {tokens} tokens, which does not fit the {window} token context window of {model_name} with {reserve_tokens} tokens reserved for the response")
+
+
+class PromptBudgeter():
+    def __init__(self, model_name: str, reserve_tokens: int = 1024, max_prompt_tokens: int = None) -> None:
+        """
+        Initialize a budgeter that shrinks prompts to fit the context window of a model.
+
+        Args:
+            model_name (str): The model name used by the backend. When a prompt is shared by several models, use the one with the smallest context window.
+            reserve_tokens (int, optional): Tokens to keep free for the response. Defaults to 1024.
+            max_prompt_tokens (int, optional): The token budget of the prompt. Defaults to the context window of the model minus reserve_tokens.
+        """
+        self.model_name = model_name
+        if max_prompt_tokens is None:
+            window = context_window(model_name)
+            max_prompt_tokens = window - reserve_tokens - CHAT_OVERHEAD_TOKENS if window is not None else None
+        self.max_prompt_tokens = max_prompt_tokens
+        self.last_report = None
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.model_name)
+
+    def fits(self, prompt: str) -> bool:
+        return self.max_prompt_tokens is None or self.count(prompt) <= self.max_prompt_tokens
+
+    @staticmethod
+    def render(template: str, sections: dict) -> str:
+        """
+        Fill the {name} placeholders of a template with the sections, in one pass over the compiled template.
+        """
+        return compile_template(template).render(sections)
+
+    def _truncate(self, template: str, sections: dict, name: str) -> str:
+        """
+        Find the longest head of a section, in characters, with which the prompt fits.
+        """
+        text = sections[name]
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.fits(self.render(template, {**sections, name: text[:middle] + TRUNCATION_MARKER})):
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low] + TRUNCATION_MARKER if low > 0 else ""
+
+    def fit(self, template: str, sections: dict, cuts: list[tuple[str, str]]) -> str:
+        """
+        Render a template and shrink it until it fits the budget, applying the cuts in order and only as far as needed.
+        A summary of what was cut is stored in self.last_report.
+
+        Args:
+            template (str): The prompt template with {name} placeholders.
+            sections (dict): Mapping of placeholder name to its text.
+            cuts (list[tuple[str, str]]): The lowest-priority parts first. ("drop", text) removes text, e.g. an extra example with its placeholders, from the template.
+                ("truncate", name) cuts the tail of a section, e.g. the end of the README.
+
+        Returns:
+            str: The prompt.
+
+        Raises:
+            ValueError: If the prompt does not fit even after all cuts.
+        """
+        sections = dict(sections)
+        self.last_report = {"dropped": [], "truncated": []}
+
+        for action, target in cuts:
+            if self.fits(self.render(template, sections)):
+                break
+
+            if action == "drop" and target in template:
+                template = template.replace(target, "")
+                self.last_report["dropped"].append(target)
+            elif action == "truncate" and target in sections:
+                sections[target] = self._truncate(template, sections, target)
+                self.last_report["truncated"].append(target)
+
+        prompt = self.render(template, sections)
+        self.last_report["tokens"] = self.count(prompt)
+        self.last_report["max_prompt_tokens"] = self.max_prompt_tokens
+
+        if not self.fits(prompt):
+            raise ValueError(f"The prompt has {self.last_report['tokens']} tokens after all cuts, over the budget of {self.max_prompt_tokens} tokens for {self.model_name}")
+
+        if self.last_report["dropped"] or self.last_report["truncated"]:
+            print(f"WARNING: Shrunk the prompt to {self.last_report['tokens']} tokens for {self.model_name}: dropped {len(self.last_report['dropped'])} parts, truncated {self.last_report['truncated']}")
+
+        return prompt
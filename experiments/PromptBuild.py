@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable
+from CodebaseSummary import summarize_codebase
+from CreatePrompt import CreatePrompt
+from LLMInterface import LLMInterface
+from PromptTemplate import read_cached
+
+class Artifact():
+    def __init__(self, name: str, output_path: str, inputs: list[str], build: Callable[[], None], params: dict = None, calls_model: bool = False) -> None:
+        """
+        Initialize a step of the prompt build: a file built from input files, e.g. a prompt from its template and the files it inlines.
+
+        Args:
+            name (str): The name of the step, e.g. "type1_prompt".
+            output_path (str): The file the step writes.
+            inputs (list[str]): The files the output depends on.
+            build (Callable[[], None]): Function writing the output.
+            params (dict, optional): Other settings the output depends on, e.g. the model that generates it. Settings set to None are not compared. Defaults to None.
+            calls_model (bool, optional): Whether building the output calls a model. Defaults to False.
+        """
+        self.name = name
+        self.output_path = output_path
+        self.inputs = inputs
+        self.build = build
+        self.params = params or {}
+        self.calls_model = calls_model
+
+
+class BuildManifest():
+    def __init__(self, path: str = ".prompt-build/manifest.json") -> None:
+        """
+        Initialize the record of every built output with the content hashes of the inputs it was built from.
+
+        Args:
+            path (str, optional): The JSON file of the records. Defaults to ".prompt-build/manifest.json".
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+        # output path -> {"name", "inputs": input path -> sha256, "params", "built"}
+        self.records = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.records = json.load(f)
+
+    def get(self, output_path: str) -> dict:
+        with self._lock:
+            return self.records.get(output_path)
+
+    def put(self, output_path: str, record: dict) -> None:
+        """
+        Record a built output and save the manifest, so that the outputs built before a failure are not built again.
+        """
+        with self._lock:
+            self.records[output_path] = record
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.records, f, indent=1)
+            os.replace(tmp_path, self.path)
+
+
+def _file_sha256(path: str) -> str:
+    if not os.path.exists(path):
+        return None
+    return hashlib.sha256(read_cached(path).encode("utf-8")).hexdigest()
+
+def _generate_to_file(model: LLMInterface, prompt_path: str, save_path: str) -> None:
+    model.generate(read_cached(prompt_path))
+    model.write_to_file(save_path)
+
+def prompt_build_graph(config: dict, model: LLMInterface = None) -> list[Artifact]:
+    """
+    Get the build steps of a config in the order the runner notebook runs them: the summarization and function description prompts, the codebase summary and
+    function description generated from them, and the three function generation prompts.
+
+    Args:
+        config (dict): The experiment config.
+        model (LLMInterface, optional): The model generating the codebase summary and function description, e.g. Gemini. Defaults to None, e.g. for a dry run.
+
+    Returns:
+        list[Artifact]: The steps, every step after the steps it depends on.
+    """
+    language = config["language"]
+    model_name = (getattr(model, "model_name", None) or type(model).__name__) if model is not None else None
+
+    files_to_summarize_paths = config["files_to_summarize_paths"]
+    context_files = read_cached(files_to_summarize_paths).splitlines() if os.path.exists(files_to_summarize_paths) else []
+    summary_inputs = [config["codebase_summary_prompt_template"], files_to_summarize_paths, *context_files]
+
+    artifacts = [
+        Artifact(
+            "summary_prompt", config["codebase_summary_prompt_save_path"], summary_inputs,
+            lambda: CreatePrompt.create_summary_prompt(config["codebase_summary_prompt_template"], files_to_summarize_paths, language, config["codebase_summary_prompt_save_path"]),
+            {"language": language},
+        ),
+        Artifact(
+            "description_prompt", config["function_description_prompt_save_path"], [config["function_description_prompt_template"], config["chosen_function_path"]],
+            lambda: CreatePrompt.create_func_description_prompt(config["function_description_prompt_template"], config["chosen_function_path"], language, config["function_description_prompt_save_path"]),
+            {"language": language},
+        ),
+        # the summary depends on the files the prompt is made of rather than the prompt file, which summarize_codebase overwrites with the prompt it sends
+        Artifact(
+            "codebase_summary", config["codebase_summary_save_path"], summary_inputs,
+            lambda: summarize_codebase(config, model),
+            {"language": language, "model_name": model_name}, calls_model=True,
+        ),
+        Artifact(
+            "function_description", config["function_description_save_path"], [config["function_description_prompt_save_path"]],
+            lambda: _generate_to_file(model, config["function_description_prompt_save_path"], config["function_description_save_path"]),
+            {"model_name": model_name}, calls_model=True,
+        ),
+        Artifact(
+            "type1_prompt", config["function_generation_prompt_type1_save_path"],
+            [config["function_generation_prompt_template_type1"], config["codebase_readme_path"], config["function_description_save_path"]],
+            lambda: CreatePrompt.create_func_generation_prompt_type1(config["function_generation_prompt_template_type1"], config["codebase_readme_path"], config["function_description_save_path"], config["function_generation_prompt_type1_save_path"]),
+        ),
+        Artifact(
+            "type2_prompt", config["function_generation_prompt_type2_save_path"],
+            [config["function_generation_prompt_template_type2"], config["codebase_summary_save_path"], config["function_description_save_path"]],
+            lambda: CreatePrompt.create_func_generation_prompt_type2(config["function_generation_prompt_template_type2"], config["codebase_summary_save_path"], config["function_description_save_path"], config["function_generation_prompt_type2_save_path"]),
+        ),
+    ]
+
+    if config["function_generation_prompt_type3_save_path"] != "":
+        example_functions = [[config["example_function_description1"], config["example_function_code1"]], [config["example_function_description2"], config["example_function_code2"]]]
+        artifacts.append(Artifact(
+            "type3_prompt", config["function_generation_prompt_type3_save_path"],
+            [config["function_generation_prompt_template_type3"], config["codebase_summary_save_path"], *(path for example in example_functions for path in example), config["function_description_save_path"]],
+            lambda: CreatePrompt.create_func_generation_prompt_type3(config["function_generation_prompt_template_type3"], config["codebase_summary_save_path"], example_functions, config["function_description_save_path"], config["function_generation_prompt_type3_save_path"]),
+        ))
+
+    return artifacts
+
+def _stale_reason(artifact: Artifact, record: dict, pending: set) -> str:
+    if not os.path.exists(artifact.output_path):
+        return "output missing"
+    if record is None:
+        return "not built before"
+    if any(value is not None and record["params"].get(key, value) != value for key, value in artifact.params.items()):
+        return "parameters changed"
+    if set(record["inputs"]) != set(artifact.inputs):
+        return "inputs added or removed"
+
+    for path in artifact.inputs:
+        if path in pending:
+            return f"{path} is rebuilt"
+        sha256 = _file_sha256(path)
+        if sha256 is None:
+            return f"{path} is missing"
+        if sha256 != record["inputs"][path]:
+            return f"{path} changed"
+    return None
+
+def build_prompts(config: dict, model: LLMInterface = None, dry_run: bool = False, manifest: BuildManifest = None, adopt_existing: bool = False) -> list[tuple[str, str]]:
+    """
+    Build only the stale outputs of a config: those that are missing, were never built, or whose inputs or model changed since they were built.
+    An output is only stale after an input it depends on changed content, so editing one template only rebuilds that prompt, and a rebuilt prompt that comes out the same rebuilds nothing after it.
+
+    Args:
+        config (dict): The experiment config.
+        model (LLMInterface, optional): The model generating the codebase summary and function description, e.g. Gemini. Needed to build them, and in dry runs to notice a change of model. Defaults to None.
+        dry_run (bool, optional): Whether to only list what would be rebuilt. Everything after a stale output is listed too, since it may change. Defaults to False.
+        manifest (BuildManifest, optional): The record of built outputs. Defaults to a BuildManifest in ".prompt-build".
+        adopt_existing (bool, optional): Whether to record outputs that exist but were never built by build_prompts, e.g. the prompts and summaries of the dataset, as built from their current inputs instead of building them again. Defaults to False.
+
+    Returns:
+        list[tuple[str, str]]: The name and reason of every rebuilt (or, in a dry run, stale) output.
+    """
+    manifest = manifest if manifest is not None else BuildManifest()
+    rebuilt = []
+    # outputs a dry run would rebuild, whose new content is not known
+    pending = set()
+
+    for artifact in prompt_build_graph(config, model):
+        record = manifest.get(artifact.output_path)
+        reason = _stale_reason(artifact, record, pending)
+        if reason is None:
+            continue
+
+        if adopt_existing and record is None and os.path.exists(artifact.output_path) and all(os.path.exists(path) for path in artifact.inputs):
+            reason = None
+        elif dry_run:
+            print(f"Would rebuild {artifact.name} ({artifact.output_path}): {reason}")
+            rebuilt.append((artifact.name, reason))
+            pending.add(artifact.output_path)
+            continue
+        else:
+            if artifact.calls_model and model is None:
+                raise ValueError(f"Building {artifact.name} calls a model, pass one to build_prompts")
+            print(f"Rebuilding {artifact.name} ({artifact.output_path}): {reason}")
+            artifact.build()
+            rebuilt.append((artifact.name, reason))
+
+        manifest.put(artifact.output_path, {
+            "name": artifact.name,
+            "inputs": {path: _file_sha256(path) for path in artifact.inputs},
+            # settings not known in this run, e.g. the model in a dry run, are not recorded
+            "params": {key: value for key, value in artifact.params.items() if value is not None},
+            "built": time.time() if reason is not None else None,
+        })
+
+    return rebuilt
+
+def build_corpus(config_paths: list[str], model: LLMInterface = None, dry_run: bool = False, manifest: BuildManifest = None, adopt_existing: bool = False) -> dict:
+    """
+    Build the stale outputs of several configs, e.g. every config.json of the dataset, with build_prompts.
+
+    Args:
+        config_paths (list[str]): The paths to the configs.
+        model (LLMInterface, optional): The model generating the codebase summaries and function descriptions. Defaults to None.
+        dry_run (bool, optional): Whether to only list what would be rebuilt. Defaults to False.
+        manifest (BuildManifest, optional): The record of built outputs. Defaults to a BuildManifest in ".prompt-build".
+        adopt_existing (bool, optional): Whether to record existing outputs never built by build_prompts instead of building them. Defaults to False.
+
+    Returns:
+        dict: Mapping of config path to the name and reason of every rebuilt (or stale) output.
+    """
+    manifest = manifest if manifest is not None else BuildManifest()
+    results = {}
+    for config_path in config_paths:
+        with open(config_path, "r") as f:
+            config = json.load(f)
+        results[config_path] = build_prompts(config, model, dry_run, manifest, adopt_existing)
+
+    total = sum(len(rebuilt) for rebuilt in results.values())
+    print(f"{'Would rebuild' if dry_run else 'Rebuilt'} {total} outputs of {len(config_paths)} configs")
+    return results
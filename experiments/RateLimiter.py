@@ -0,0 +1,330 @@
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from Telemetry import add_to_record, record_usage
+
+# requests and tokens per minute allowed for each provider, None means unlimited, i.e. paced only by the provider's 429s and Retry-After headers.
+# Quotas depend on the account tier, so set them with <PROVIDER>_REQUESTS_PER_MINUTE and <PROVIDER>_TOKENS_PER_MINUTE in the environment (or .env file) or with configure_rate_limiter.
+DEFAULT_RATE_LIMITS = {
+    "openai": {"requests_per_minute": None, "tokens_per_minute": None},
+    "deepseek": {"requests_per_minute": None, "tokens_per_minute": None},
+    "gemini": {"requests_per_minute": None, "tokens_per_minute": None},
+}
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+class TokenBucket():
+    def __init__(self, per_minute: float) -> None:
+        """
+        Initialize a token bucket refilled at per_minute tokens per minute, holding at most one minute's worth of tokens.
+        Acquiring more tokens than are available reserves them in advance, so callers are served in order.
+
+        Args:
+            per_minute (float): The number of tokens added to the bucket every minute.
+        """
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount tokens from the bucket.
+
+        Args:
+            amount (float): The number of tokens to take.
+
+        Returns:
+            float: The number of seconds to wait before the reserved tokens are actually available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def peek(self, amount: float) -> float:
+        """
+        Get the number of seconds a reservation of amount tokens would have to wait, without taking them.
+        """
+        with self._lock:
+            tokens = min(self.capacity, self.tokens + (time.monotonic() - self.updated) * self.rate)
+            return max(0.0, (amount - tokens) / self.rate)
+
+    def refund(self, amount: float) -> None:
+        """
+        Return tokens to the bucket, e.g. when fewer were used than reserved. A negative amount takes additional tokens.
+
+        Args:
+            amount (float): The number of tokens to return.
+        """
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ProviderRateLimiter():
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None, max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0) -> None:
+        """
+        Initialize a rate limiter for one provider. It paces calls with request and token buckets and retries transient errors with jittered exponential backoff, honoring Retry-After headers.
+
+        Args:
+            requests_per_minute (float, optional): Maximum requests per minute. Defaults to None (unlimited).
+            tokens_per_minute (float, optional): Maximum tokens per minute. Defaults to None (unlimited).
+            max_retries (int, optional): Maximum number of retries of a failed call. Defaults to 6.
+            base_delay (float, optional): The backoff delay of the first retry in seconds. Defaults to 1.0.
+            max_delay (float, optional): The maximum backoff delay in seconds. Defaults to 60.0.
+        """
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+        # set from a Retry-After header, so that every caller of the provider backs off, not just the one that was rejected
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        wait = max(0.0, self.blocked_until - time.monotonic())
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.reserve(estimated_tokens))
+        return wait
+
+    def expected_wait(self, estimated_tokens: int = 0) -> float:
+        """
+        Get the number of seconds a call using estimated_tokens would wait for the rate limits now, without reserving anything.
+        """
+        wait = max(0.0, self.blocked_until - time.monotonic())
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.peek(1))
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.peek(estimated_tokens))
+        return wait
+
+    def _release(self, estimated_tokens: int) -> None:
+        # a failed attempt gives its tokens back, so that a call reserves its tokens once however often it is retried.
+        # The request is still counted, since the provider counts rejected requests too.
+        if self.token_bucket is not None:
+            self.token_bucket.refund(estimated_tokens)
+
+    def _settle(self, estimated_tokens: int, used_tokens: int) -> None:
+        if self.token_bucket is not None and used_tokens is not None:
+            self.token_bucket.refund(estimated_tokens - used_tokens)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """
+        Get the delay before retrying a failed call, or None if the error should not be retried.
+        """
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            with self._lock:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            return retry_after
+
+        # full jitter: uniform in [0, base_delay * 2^attempt], capped at max_delay
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, function, *args, estimated_tokens: int = 0, used_tokens=None, **kwargs):
+        """
+        Call function once the rate limits allow it, retrying transient errors.
+
+        Args:
+            function: The function to call.
+            estimated_tokens (int, optional): The number of tokens the call is expected to use. Defaults to 0.
+            used_tokens (optional): Function that takes the result and returns the number of tokens actually used, to correct the estimate. Defaults to None.
+
+        Returns:
+            The result of the function.
+        """
+        attempt = 0
+        while True:
+            wait = self._reserve(estimated_tokens)
+            add_to_record(queue_wait=wait)
+            time.sleep(wait)
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                self._release(estimated_tokens)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                self.retries += 1
+                add_to_record(retries=1, queue_wait=delay)
+                time.sleep(delay)
+                continue
+
+            self._settle(estimated_tokens, used_tokens(result) if used_tokens else None)
+            record_usage(result)
+            return result
+
+    async def acall(self, function, *args, estimated_tokens: int = 0, used_tokens=None, **kwargs):
+        """
+        Await the coroutine function once the rate limits allow it, retrying transient errors.
+
+        Args:
+            function: The coroutine function to call.
+            estimated_tokens (int, optional): The number of tokens the call is expected to use. Defaults to 0.
+            used_tokens (optional): Function that takes the result and returns the number of tokens actually used, to correct the estimate. Defaults to None.
+
+        Returns:
+            The result of the coroutine.
+        """
+        attempt = 0
+        while True:
+            wait = self._reserve(estimated_tokens)
+            add_to_record(queue_wait=wait)
+            await asyncio.sleep(wait)
+            try:
+                result = await function(*args, **kwargs)
+            except Exception as e:
+                self._release(estimated_tokens)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                self.retries += 1
+                add_to_record(retries=1, queue_wait=delay)
+                await asyncio.sleep(delay)
+                continue
+
+            self._settle(estimated_tokens, used_tokens(result) if used_tokens else None)
+            record_usage(result)
+            return result
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def default_rate_limits(provider: str) -> dict:
+    """
+    Get the default limits of a provider: its DEFAULT_RATE_LIMITS, overridden by <PROVIDER>_REQUESTS_PER_MINUTE and <PROVIDER>_TOKENS_PER_MINUTE if set in the environment.
+
+    Args:
+        provider (str): The provider name, e.g. "openai", "deepseek" or "gemini".
+
+    Returns:
+        dict: Arguments for ProviderRateLimiter.
+    """
+    limits = dict(DEFAULT_RATE_LIMITS.get(provider, {}))
+    for name in ("requests_per_minute", "tokens_per_minute"):
+        value = os.getenv(f"{provider.upper()}_{name.upper()}")
+        if value:
+            limits[name] = float(value)
+    return limits
+
+def get_rate_limiter(provider: str) -> ProviderRateLimiter:
+    """
+    Get the rate limiter shared by every backend instance of a provider.
+
+    Args:
+        provider (str): The provider name, e.g. "openai", "deepseek" or "gemini".
+
+    Returns:
+        ProviderRateLimiter: The shared rate limiter.
+    """
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            _rate_limiters[provider] = ProviderRateLimiter(**default_rate_limits(provider))
+        return _rate_limiters[provider]
+
+def configure_rate_limiter(provider: str, **kwargs) -> ProviderRateLimiter:
+    """
+    Replace the shared rate limiter of a provider, e.g. to match the quota of your API key.
+
+    Args:
+        provider (str): The provider name, e.g. "openai", "deepseek" or "gemini".
+        **kwargs: Arguments for ProviderRateLimiter.
+
+    Returns:
+        ProviderRateLimiter: The new shared rate limiter.
+    """
+    with _rate_limiters_lock:
+        _rate_limiters[provider] = ProviderRateLimiter(**{**default_rate_limits(provider), **kwargs})
+        return _rate_limiters[provider]
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimate the number of tokens in a text, at about 4 characters per token.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return len(text) // 4 + 1
+
+def get_status_code(error: Exception) -> int:
+    """
+    Get the HTTP status code of an error raised by the openai or google clients, if any.
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(error, "code", None)
+    return status_code if isinstance(status_code, int) else None
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Check whether an error is transient: rate limiting, server errors, timeouts and dropped connections.
+    """
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+
+    return any(name in type(error).__name__ for name in ("Timeout", "Connection", "ResourceExhausted", "ServiceUnavailable"))
+
+def get_retry_after(error: Exception) -> float:
+    """
+    Get the delay requested by the Retry-After (or retry-after-ms) header of an error response, in seconds.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    # Retry-After may also be an HTTP date
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def get_used_tokens(response) -> int:
+    """
+    Get the total number of tokens reported in the usage of an openai or gemini response, if any.
+    """
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return getattr(usage, "total_tokens", None)
+
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if usage_metadata is not None:
+        return getattr(usage_metadata, "total_token_count", None)
+
+    return None
@@ -0,0 +1,307 @@
+import asyncio
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+from typing import Callable
+from LLMInterface import LLMInterface
+
+class ReplayArchive():
+    def __init__(self, path: str = ".llm-replay/archive.jsonl") -> None:
+        """
+        Initialize an archive of recorded responses. Every response is appended as a line of JSON with the model, sampling parameters, prompt hash and latency of its call.
+
+        Args:
+            path (str, optional): The JSONL file. Defaults to ".llm-replay/archive.jsonl".
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+        # (model name, prompt hash) -> entries in the order they were recorded
+        self._entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        self._index(json.loads(line))
+
+    def _index(self, entry: dict) -> None:
+        self._entries.setdefault((entry["model_name"], entry["prompt_sha256"]), []).append(entry)
+
+    def add(self, backend: str, model_name: str, params: dict, prompt: str, response_text: str, latency: float) -> None:
+        """
+        Append a recorded response to the archive.
+
+        Args:
+            backend (str): The name of the backend class that served the call.
+            model_name (str): The model name used by the backend.
+            params (dict): The sampling parameters of the call.
+            prompt (str): The prompt.
+            response_text (str): The response.
+            latency (float): Seconds the call took. Samples returned by one request share its latency.
+        """
+        entry = {
+            "backend": backend,
+            "model_name": model_name,
+            "params": params,
+            "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+            "response_text": response_text,
+            "latency": latency,
+            "recorded": time.time(),
+        }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+            self._index(entry)
+
+    def get(self, model_name: str, prompt: str) -> list[dict]:
+        """
+        Get the recorded responses of a model to a prompt.
+
+        Returns:
+            list[dict]: The entries, in the order they were recorded. Empty if the prompt was never recorded.
+        """
+        prompt_sha256 = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            return list(self._entries.get((model_name, prompt_sha256), []))
+
+    def latencies(self, model_name: str) -> list[float]:
+        """
+        Get every recorded latency of a model.
+        """
+        with self._lock:
+            return [entry["latency"] for (name, _), entries in self._entries.items() if name == model_name for entry in entries]
+
+    def model_names(self) -> list[str]:
+        with self._lock:
+            return sorted({name for name, _ in self._entries})
+
+
+class RecordingLLM(LLMInterface):
+    def __init__(self, backend: LLMInterface, archive: ReplayArchive = None) -> None:
+        """
+        Wrap any LLMInterface so that every response and the latency of its call are appended to a replay archive.
+
+        Args:
+            backend (LLMInterface): The model to record.
+            archive (ReplayArchive, optional): The archive to record to. Defaults to a ReplayArchive in ".llm-replay".
+        """
+        self.backend = backend
+        self.archive = archive if archive is not None else ReplayArchive()
+        self.max_concurrency = backend.max_concurrency
+        self.model_name = getattr(backend, "model_name", None)
+
+    def generation_params(self) -> dict:
+        return self.backend.generation_params()
+
+    def _record(self, prompt: str, response_texts: list[str], latency: float, kwargs: dict) -> None:
+        params = {**self.backend.generation_params(), **kwargs}
+        for response_text in response_texts:
+            self.archive.add(type(self.backend).__name__, self.model_name, params, prompt, response_text, latency)
+
+    def generate(self, prompt: str, *args, **kwargs) -> str:
+        """
+        Generate text based on the given prompt and record the response.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+
+        Returns:
+            str: The string response from the model.
+        """
+        start_time = time.perf_counter()
+        self.response_text = self.backend.generate(prompt, *args, **kwargs)
+        self._record(prompt, [self.response_text], time.perf_counter() - start_time, kwargs)
+        return self.response_text
+
+    async def agenerate(self, prompt: str, *args, **kwargs) -> str:
+        """
+        Asynchronously generate text based on the given prompt and record the response.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+
+        Returns:
+            str: The string response from the model.
+        """
+        start_time = time.perf_counter()
+        self.response_text = await self.backend.agenerate(prompt, *args, **kwargs)
+        self._record(prompt, [self.response_text], time.perf_counter() - start_time, kwargs)
+        return self.response_text
+
+    def generate_samples(self, prompt: str, n: int, **kwargs) -> list[str]:
+        """
+        Generate n samples for the given prompt and record them.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            n (int): The number of samples to generate.
+
+        Returns:
+            list[str]: The n responses.
+        """
+        start_time = time.perf_counter()
+        self.sample_texts = self.backend.generate_samples(prompt, n, **kwargs)
+        self._record(prompt, self.sample_texts, time.perf_counter() - start_time, kwargs)
+        return self.sample_texts
+
+    async def agenerate_samples(self, prompt: str, n: int, **kwargs) -> list[str]:
+        """
+        Asynchronously generate n samples for the given prompt and record them.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            n (int): The number of samples to generate.
+
+        Returns:
+            list[str]: The n responses.
+        """
+        start_time = time.perf_counter()
+        self.sample_texts = await self.backend.agenerate_samples(prompt, n, **kwargs)
+        self._record(prompt, self.sample_texts, time.perf_counter() - start_time, kwargs)
+        return self.sample_texts
+
+    def write_to_file(self, filename: str) -> None:
+        """
+        Write the last generated text to a file.
+
+        Args:
+            filename (str): The path to the file to write to.
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        with open(filename, "w") as f:
+            f.write(self.response_text)
+
+
+class ReplayLLM(LLMInterface):
+    def __init__(self, model_name: str, archive: ReplayArchive = None, latency: str | Callable[[dict], float] = None, time_scale: float = 1.0, default_response: str = None, max_concurrency: int = None) -> None:
+        """
+        Initialize a model that serves the responses recorded by RecordingLLM instead of calling a provider, so that the pipeline can be run and benchmarked offline and deterministically.
+        Repeated calls with the same prompt return the recorded samples in order, starting over once all of them were served.
+
+        Args:
+            model_name (str): The model name of the recorded backend, e.g. "gpt-4".
+            archive (ReplayArchive, optional): The archive to replay. Defaults to a ReplayArchive in ".llm-replay".
+            latency (str | Callable[[dict], float], optional): The latency model. None returns responses immediately, "recorded" waits for the recorded latency of each response
+                (the median latency of the model for default responses), and a function of the entry returns the seconds to wait. Defaults to None.
+            time_scale (float, optional): Factor applied to every wait, e.g. 0.1 to replay ten times faster than recorded. Defaults to 1.0.
+            default_response (str, optional): The response to prompts that were never recorded. Defaults to None, i.e. raising a KeyError.
+            max_concurrency (int, optional): Maximum number of calls in flight in generate_many / generate_all. Defaults to the class's max_concurrency.
+        """
+        self.model_name = model_name
+        self.archive = archive if archive is not None else ReplayArchive()
+        self.latency = latency
+        self.time_scale = time_scale
+        self.default_response = default_response
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+
+        self._served_counts = {}
+        self._served_counts_lock = threading.Lock()
+
+    def _next_entry(self, prompt: str, sample_index: int) -> dict:
+        entries = self.archive.get(self.model_name, prompt)
+        if not entries:
+            if self.default_response is None:
+                raise KeyError(f"No response of {self.model_name} to this prompt was recorded in {self.archive.path}")
+            latencies = self.archive.latencies(self.model_name)
+            return {"response_text": self.default_response, "latency": statistics.median(latencies) if latencies else 0.0}
+
+        if sample_index is None:
+            with self._served_counts_lock:
+                sample_index = self._served_counts.get(prompt, 0) + 1
+                self._served_counts[prompt] = sample_index
+        return entries[(sample_index - 1) % len(entries)]
+
+    def _delay(self, entry: dict) -> float:
+        if self.latency is None:
+            return 0.0
+        delay = entry["latency"] if self.latency == "recorded" else self.latency(entry)
+        return max(delay * self.time_scale, 0.0)
+
+    def generate(self, prompt: str, *args, sample_index: int = None, **kwargs) -> str:
+        """
+        Return the recorded response to the given prompt, after the delay of the latency model.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            sample_index (int, optional): The index of the recorded sample to return. Defaults to the number of previous calls with this prompt plus one.
+
+        Returns:
+            str: The recorded response.
+        """
+        entry = self._next_entry(prompt, sample_index)
+        time.sleep(self._delay(entry))
+
+        self.response_text = entry["response_text"]
+        return self.response_text
+
+    async def agenerate(self, prompt: str, *args, sample_index: int = None, **kwargs) -> str:
+        """
+        Asynchronously return the recorded response to the given prompt, after the delay of the latency model. Waiting does not block the event loop, so concurrent calls overlap as real requests would.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            sample_index (int, optional): The index of the recorded sample to return. Defaults to the number of previous calls with this prompt plus one.
+
+        Returns:
+            str: The recorded response.
+        """
+        entry = self._next_entry(prompt, sample_index)
+        await asyncio.sleep(self._delay(entry))
+
+        self.response_text = entry["response_text"]
+        return self.response_text
+
+    def reset(self) -> None:
+        """
+        Serve the recorded samples from the first one again, so that a rerun of the pipeline gets the same responses.
+        """
+        with self._served_counts_lock:
+            self._served_counts.clear()
+
+    def write_to_file(self, filename: str) -> None:
+        """
+        Write the last generated text to a file.
+
+        Args:
+            filename (str): The path to the file to write to.
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        with open(filename, "w") as f:
+            f.write(self.response_text)
+
+
+def record_model_dict(model_dict: dict, archive: ReplayArchive = None) -> dict:
+    """
+    Wrap every model of a model_dict in a RecordingLLM writing to the same archive.
+
+    Args:
+        model_dict (dict): Mapping of model name to backend, e.g. from create_model_dict.
+        archive (ReplayArchive, optional): The archive to record to. Defaults to a ReplayArchive in ".llm-replay".
+
+    Returns:
+        dict: Mapping of model name to recording backend.
+    """
+    archive = archive if archive is not None else ReplayArchive()
+    return {name: RecordingLLM(model, archive) for name, model in model_dict.items()}
+
+def replay_model_dict(model_names: dict, archive: ReplayArchive = None, **kwargs) -> dict:
+    """
+    Create a model_dict of ReplayLLMs standing in for the recorded models.
+
+    Args:
+        model_names (dict): Mapping of notebook model name to the model name of its backend, e.g. {"GPT-4": "gpt-4"}.
+        archive (ReplayArchive, optional): The archive to replay. Defaults to a ReplayArchive in ".llm-replay".
+        **kwargs: Other arguments for ReplayLLM, e.g. latency="recorded".
+
+    Returns:
+        dict: Mapping of notebook model name to ReplayLLM.
+    """
+    archive = archive if archive is not None else ReplayArchive()
+    return {name: ReplayLLM(model_name, archive, **kwargs) for name, model_name in model_names.items()}
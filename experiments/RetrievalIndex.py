@@ -0,0 +1,221 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from PromptBudget import count_tokens
+from PromptTemplate import read_cached
+
+# source files of the serverless repositories in the dataset
+SOURCE_EXTENSIONS = (".py", ".js", ".ts", ".jsx", ".tsx", ".mjs", ".cjs", ".json", ".yml", ".yaml", ".go", ".java", ".rb", ".cs")
+SKIPPED_DIRECTORIES = {".git", "node_modules", "__pycache__", ".venv", "venv", "dist", "build", ".serverless", "coverage"}
+
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# splits camelCase, PascalCase and acronyms, e.g. "getHTTPResponse" -> "get", "HTTP", "Response"
+SUB_TOKEN = re.compile(r"[A-Z]+(?=[A-Z][a-z]|\d|\b)|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+# keywords shared by most files, which carry no information about relevance
+STOP_WORDS = {
+    "the", "and", "for", "from", "import", "export", "default", "return", "const", "let", "var", "function", "def", "class", "self", "this",
+    "if", "else", "elif", "true", "false", "none", "null", "undefined", "new", "async", "await", "try", "except", "catch", "finally",
+    "in", "is", "not", "or", "of", "to", "as", "with", "pass", "raise", "throw", "type", "interface", "public", "private", "static", "void",
+}
+
+def tokenize_code(text: str) -> list[str]:
+    """
+    Split source code into lowercase terms: every identifier, and the parts of camelCase and snake_case identifiers.
+
+    Args:
+        text (str): The source code.
+
+    Returns:
+        list[str]: The terms, with repetitions.
+    """
+    terms = []
+    for identifier in IDENTIFIER.findall(text):
+        parts = [part.lower() for piece in identifier.split("_") for part in SUB_TOKEN.findall(piece)]
+        if len(parts) > 1:
+            terms.append(identifier.lower())
+        terms.extend(parts)
+    return [term for term in terms if len(term) > 1 and term not in STOP_WORDS]
+
+
+class RepoIndex():
+    def __init__(self, repo_dir: str, index_dir: str = ".retrieval-index", extensions: tuple = SOURCE_EXTENSIONS, k1: float = 1.5, b: float = 0.75) -> None:
+        """
+        Initialize a persistent BM25 index of the source files of a repository. The index is stored in index_dir and updated incrementally: only files that changed since the last update are tokenized again.
+
+        Args:
+            repo_dir (str): The root of the repository checkout.
+            index_dir (str, optional): The directory to store the index in. Defaults to ".retrieval-index".
+            extensions (tuple, optional): The extensions of the files to index. Defaults to SOURCE_EXTENSIONS.
+            k1 (float, optional): The BM25 term frequency saturation. Defaults to 1.5.
+            b (float, optional): The BM25 length normalization. Defaults to 0.75.
+        """
+        self.repo_dir = os.path.abspath(repo_dir)
+        self.extensions = extensions
+        self.k1 = k1
+        self.b = b
+        self.index_path = os.path.join(index_dir, f"{hashlib.sha256(self.repo_dir.encode('utf-8')).hexdigest()[:16]}.json")
+        self._lock = threading.Lock()
+
+        # path -> {"version": [modification time, size], "length": number of terms, "terms": term -> count}
+        self.documents = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.documents = json.load(f)["documents"]
+        self._document_frequencies = None
+
+    def _source_files(self) -> list[str]:
+        paths = []
+        for root, directories, files in os.walk(self.repo_dir):
+            directories[:] = [directory for directory in directories if directory not in SKIPPED_DIRECTORIES]
+            paths.extend(os.path.join(root, file) for file in files if file.endswith(self.extensions))
+        return paths
+
+    def update(self) -> dict:
+        """
+        Bring the index up to date with the files on disk and save it.
+
+        Returns:
+            dict: The number of files added or changed, removed and unchanged.
+        """
+        with self._lock:
+            counts = {"updated": 0, "removed": 0, "unchanged": 0}
+            paths = self._source_files()
+
+            for path in paths:
+                stat = os.stat(path)
+                version = [stat.st_mtime_ns, stat.st_size]
+                document = self.documents.get(path)
+                if document is not None and document["version"] == version:
+                    counts["unchanged"] += 1
+                    continue
+
+                try:
+                    terms = Counter(tokenize_code(read_cached(path)))
+                except UnicodeDecodeError:
+                    continue
+                self.documents[path] = {"version": version, "length": sum(terms.values()), "terms": dict(terms)}
+                counts["updated"] += 1
+
+            for path in set(self.documents) - set(paths):
+                del self.documents[path]
+                counts["removed"] += 1
+
+            if counts["updated"] or counts["removed"] or not os.path.exists(self.index_path):
+                os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+                tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump({"repo_dir": self.repo_dir, "documents": self.documents}, f)
+                os.replace(tmp_path, self.index_path)
+                self._document_frequencies = None
+
+            return counts
+
+    def _idf(self) -> dict:
+        if self._document_frequencies is None:
+            self._document_frequencies = Counter(term for document in self.documents.values() for term in document["terms"])
+        total = len(self.documents)
+        return {term: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5)) for term, frequency in self._document_frequencies.items()}
+
+    def search(self, query: str, k: int = None, candidates: list[str] = None) -> list[tuple[str, float]]:
+        """
+        Rank the indexed files by their BM25 relevance to a query, e.g. the code of a function.
+
+        Args:
+            query (str): The query text.
+            k (int, optional): The number of files to return. Defaults to None (all files with a positive score).
+            candidates (list[str], optional): Only rank these files, e.g. a hand-curated context-files-paths.txt. Defaults to None (all indexed files).
+
+        Returns:
+            list[tuple[str, float]]: The paths with their scores, best first.
+        """
+        query_terms = set(tokenize_code(query))
+        idf = self._idf()
+        documents = self.documents if candidates is None else {path: self.documents[path] for path in map(os.path.abspath, candidates) if path in self.documents}
+        if not documents:
+            return []
+        average_length = sum(document["length"] for document in documents.values()) / len(documents) or 1
+
+        scores = []
+        for path, document in documents.items():
+            score = 0.0
+            for term in query_terms:
+                frequency = document["terms"].get(term)
+                if frequency:
+                    normalization = self.k1 * (1 - self.b + self.b * document["length"] / average_length)
+                    score += idf.get(term, 0.0) * frequency * (self.k1 + 1) / (frequency + normalization)
+            if score > 0:
+                scores.append((path, score))
+
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores[:k] if k is not None else scores
+
+
+def select_context_files(chosen_function_path: str, repo_dir: str = None, k: int = 10, max_tokens: int = None, model_name: str = "", language: str = "", candidates: list[str] = None, index_dir: str = ".retrieval-index") -> list[str]:
+    """
+    Pick the files of a repository most related to the chosen function, to put into the summarization prompt instead of a whole hand-curated list.
+    The chosen function itself is never picked, since it is the function to be generated.
+
+    Args:
+        chosen_function_path (str): The path to the chosen function.
+        repo_dir (str, optional): The root of the repository checkout. Defaults to the directory shared by the candidates and the chosen function.
+        k (int, optional): The maximum number of files. Defaults to 10.
+        max_tokens (int, optional): The token budget of the picked files as formatted in the summarization prompt. Defaults to None (no budget).
+        model_name (str, optional): The model name of the summarizing model, to count tokens with. Defaults to "" (estimated counts).
+        language (str, optional): The language of the codebase, as used in the prompt's code fences. Defaults to "".
+        candidates (list[str], optional): Only pick from these files. Defaults to None (every source file of the repository).
+        index_dir (str, optional): The directory of the persistent indexes. Defaults to ".retrieval-index".
+
+    Returns:
+        list[str]: The picked paths, most relevant first.
+    """
+    if repo_dir is None:
+        if not candidates:
+            raise ValueError("Pass repo_dir or candidates to select context files")
+        repo_dir = os.path.commonpath([os.path.abspath(path) for path in [*candidates, chosen_function_path]])
+
+    index = RepoIndex(repo_dir, index_dir)
+    index.update()
+    chosen_function_path = os.path.abspath(chosen_function_path)
+
+    selected = []
+    tokens = 0
+    for path, _ in index.search(read_cached(chosen_function_path), candidates=candidates):
+        if path == chosen_function_path:
+            continue
+        if max_tokens is not None:
+            path_tokens = count_tokens(f"\n\n{path}\n```{language}\n{read_cached(path)}\n```", model_name)
+            if tokens + path_tokens > max_tokens:
+                continue
+            tokens += path_tokens
+        selected.append(path)
+        if len(selected) == k:
+            break
+
+    return selected
+
+def select_context_files_for_config(config: dict, save_path: str = None, **kwargs) -> str:
+    """
+    Rank the files of a config's context-files-paths.txt by relevance to its chosen function and write the top ones to a new list, to use as its files_to_summarize_paths.
+
+    Args:
+        config (dict): The experiment config.
+        save_path (str, optional): The path to write the list to. Defaults to context-files-ranked.txt next to the config's list.
+        **kwargs: Other arguments for select_context_files, e.g. k, max_tokens and model_name.
+
+    Returns:
+        str: The path of the written list.
+    """
+    candidates = read_cached(config["files_to_summarize_paths"]).splitlines()
+    selected = select_context_files(config["chosen_function_path"], candidates=candidates, language=config["language"], **kwargs)
+    print(f"Selected {len(selected)} of {len(candidates)} context files")
+
+    save_path = save_path if save_path is not None else os.path.join(os.path.dirname(config["files_to_summarize_paths"]), "context-files-ranked.txt")
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    with open(save_path, "w") as f:
+        f.write("\n".join(selected))
+    return save_path
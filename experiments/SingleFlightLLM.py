@@ -0,0 +1,290 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from CachedLLM import ResponseCache
+from LLMInterface import LLMInterface, accepts_sample_index
+from Telemetry import annotate_record
+
+# request key -> future of the call in flight, shared by every SingleFlightLLM in the process
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+class _LeaderCancelled(Exception):
+    """
+    Set on the future of a call whose leader was cancelled or interrupted, so that a follower calls again as the new leader.
+    """
+
+def _join(key: str) -> tuple[Future, bool]:
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+            # a running future cannot be cancelled by a follower
+            future.set_running_or_notify_cancel()
+        return future, leader
+
+def _leave(key: str, future: Future) -> None:
+    # the call is taken out of flight before its followers wake up, so that a follower calling again becomes the new leader
+    with _inflight_lock:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+
+class SingleFlightLLM(LLMInterface):
+    def __init__(self, backend: LLMInterface, lock_dir: str = None, result_ttl: float = 600) -> None:
+        """
+        Wrap any LLMInterface so that concurrent identical requests (same backend, model, sampling parameters, sample index and prompt) share one underlying call and its result.
+
+        Calls without a sample_index are treated as the same request, so pass distinct sample indices when several samples of a prompt are wanted at once.
+        generate_samples is keyed by the number of samples and is never merged with single generations.
+
+        Args:
+            backend (LLMInterface): The model to coalesce the requests of.
+            lock_dir (str, optional): A directory shared by several processes, e.g. two notebook kernels, to also coalesce requests across them with file locks (Unix only). Defaults to None (only within this process).
+            result_ttl (float, optional): Seconds to keep shared results in lock_dir. Defaults to 600.
+        """
+        self.backend = backend
+        self.max_concurrency = backend.max_concurrency
+        self.model_name = getattr(backend, "model_name", None)
+        self.lock_dir = lock_dir
+        self.result_ttl = result_ttl
+        self.coalesced_count = 0
+
+        if self.lock_dir is not None:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def generation_params(self) -> dict:
+        return self.backend.generation_params()
+
+    def _key(self, prompt: str, sample_index: int, kwargs: dict, samples: int = None) -> str:
+        params = {**self.backend.generation_params(), **kwargs}
+        if samples is not None:
+            params["samples"] = samples
+        return ResponseCache.make_key(type(self.backend).__name__, self.model_name, params, sample_index, prompt)
+
+    def _backend_kwargs(self, sample_index: int, kwargs: dict) -> dict:
+        # wrappers such as CachedLLM take the sample index too, plain backends do not
+        if sample_index is not None and accepts_sample_index(self.backend):
+            return {**kwargs, "sample_index": sample_index}
+        return kwargs
+
+    def _coalesced(self) -> None:
+        self.coalesced_count += 1
+        annotate_record(coalesced=True, input_tokens=0, output_tokens=0)
+
+    def _result_path(self, key: str) -> str:
+        return os.path.join(self.lock_dir, f"{key}.json")
+
+    def _read_shared_result(self, key: str, since: float):
+        """
+        Get the result another process wrote while this request was waiting for the lock, if any.
+        """
+        path = self._result_path(key)
+        try:
+            if os.path.getmtime(path) < since:
+                return None
+            with open(path, "r") as f:
+                return json.load(f)["result"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_shared_result(self, key: str, result) -> None:
+        path = self._result_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"result": result}, f)
+        os.replace(tmp_path, path)
+
+        # drop results old enough that no request waiting for them can still be in flight
+        now = time.time()
+        for file in os.listdir(self.lock_dir):
+            if file.endswith(".json"):
+                try:
+                    if now - os.path.getmtime(os.path.join(self.lock_dir, file)) > self.result_ttl:
+                        os.remove(os.path.join(self.lock_dir, file))
+                except OSError:
+                    pass
+
+    def _call(self, key: str, function):
+        """
+        Run function once for all concurrent calls with the same key, in this process and, with lock_dir, across processes.
+        Errors of the call are raised in every waiting call. If the call is interrupted instead, one of the waiting calls runs function again.
+        """
+        while True:
+            future, leader = _join(key)
+            if not leader:
+                try:
+                    result = future.result()
+                except _LeaderCancelled:
+                    continue
+                except Exception:
+                    self._coalesced()
+                    raise
+                self._coalesced()
+                return result
+
+            try:
+                result = self._call_across_processes(key, function)
+            except Exception as e:
+                _leave(key, future)
+                future.set_exception(e)
+                raise
+            except BaseException:
+                _leave(key, future)
+                future.set_exception(_LeaderCancelled())
+                raise
+            _leave(key, future)
+            future.set_result(result)
+            return result
+
+    def _call_across_processes(self, key: str, function):
+        if self.lock_dir is None:
+            return function()
+
+        # fcntl only exists on Unix, so it is only imported to coalesce across processes
+        import fcntl
+        since = time.time()
+        with open(os.path.join(self.lock_dir, f"{key}.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                result = self._read_shared_result(key, since)
+                if result is not None:
+                    self._coalesced()
+                    return result
+
+                result = function()
+                self._write_shared_result(key, result)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    async def _acall(self, key: str, coroutine_function):
+        """
+        Asynchronous version of _call, awaiting coroutine_function once for all concurrent calls with the same key.
+        A cancelled leader, e.g. the losing call of a HedgedLLM, does not cancel the calls waiting for it: one of them awaits coroutine_function again.
+        """
+        while True:
+            future, leader = _join(key)
+            if not leader:
+                try:
+                    # cancelling one waiting call must not cancel the shared future
+                    result = await asyncio.shield(asyncio.wrap_future(future))
+                except _LeaderCancelled:
+                    continue
+                except Exception:
+                    self._coalesced()
+                    raise
+                self._coalesced()
+                return result
+
+            try:
+                result = await self._acall_across_processes(key, coroutine_function)
+            except Exception as e:
+                _leave(key, future)
+                future.set_exception(e)
+                raise
+            except BaseException:
+                _leave(key, future)
+                future.set_exception(_LeaderCancelled())
+                raise
+            _leave(key, future)
+            future.set_result(result)
+            return result
+
+    async def _acall_across_processes(self, key: str, coroutine_function):
+        if self.lock_dir is None:
+            return await coroutine_function()
+
+        import fcntl
+        since = time.time()
+        with open(os.path.join(self.lock_dir, f"{key}.lock"), "a") as lock_file:
+            # waiting for the lock must not block the event loop
+            await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+            try:
+                result = self._read_shared_result(key, since)
+                if result is not None:
+                    self._coalesced()
+                    return result
+
+                result = await coroutine_function()
+                self._write_shared_result(key, result)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def generate(self, prompt: str, *args, sample_index: int = None, **kwargs) -> str:
+        """
+        Generate text based on the given prompt, sharing the call with identical requests in flight.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            sample_index (int, optional): The index of the sample. Requests with different sample indices are never merged. Defaults to None.
+
+        Returns:
+            str: The string response from the model.
+        """
+        key = self._key(prompt, sample_index, kwargs)
+        backend_kwargs = self._backend_kwargs(sample_index, kwargs)
+        self.response_text = self._call(key, lambda: self.backend.generate(prompt, *args, **backend_kwargs))
+        return self.response_text
+
+    async def agenerate(self, prompt: str, *args, sample_index: int = None, **kwargs) -> str:
+        """
+        Asynchronously generate text based on the given prompt, sharing the call with identical requests in flight.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            sample_index (int, optional): The index of the sample. Requests with different sample indices are never merged. Defaults to None.
+
+        Returns:
+            str: The string response from the model.
+        """
+        key = self._key(prompt, sample_index, kwargs)
+        backend_kwargs = self._backend_kwargs(sample_index, kwargs)
+        self.response_text = await self._acall(key, lambda: self.backend.agenerate(prompt, *args, **backend_kwargs))
+        return self.response_text
+
+    def generate_samples(self, prompt: str, n: int, **kwargs) -> list[str]:
+        """
+        Generate n samples for the given prompt, sharing the call with identical requests for n samples in flight.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            n (int): The number of samples to generate.
+
+        Returns:
+            list[str]: The n responses.
+        """
+        key = self._key(prompt, None, kwargs, samples=n)
+        self.sample_texts = self._call(key, lambda: self.backend.generate_samples(prompt, n, **kwargs))
+        return self.sample_texts
+
+    async def agenerate_samples(self, prompt: str, n: int, **kwargs) -> list[str]:
+        """
+        Asynchronously generate n samples for the given prompt, sharing the call with identical requests for n samples in flight.
+
+        Args:
+            prompt (str): Prompt to pass as user content to the model
+            n (int): The number of samples to generate.
+
+        Returns:
+            list[str]: The n responses.
+        """
+        key = self._key(prompt, None, kwargs, samples=n)
+        self.sample_texts = await self._acall(key, lambda: self.backend.agenerate_samples(prompt, n, **kwargs))
+        return self.sample_texts
+
+    def write_to_file(self, filename: str) -> None:
+        """
+        Write the last generated text to a file.
+
+        Args:
+            filename (str): The path to the file to write to.
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        with open(filename, "w") as f:
+            f.write(self.response_text)
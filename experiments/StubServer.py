@@ -0,0 +1,290 @@
+import json
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_STUB_RESPONSE = "```python\ndef handler(event, context):\n    return {\"statusCode\": 200}\n```\nThis function returns a successful response."
+
+class StubOpenAIServer():
+    def __init__(self, response_text: str = DEFAULT_STUB_RESPONSE, fail_first: int = 0, fail_status: int = 429, retry_after: float = None, delay: float = 0.0, batch_delay: float = 0.0, port: int = 0, slow_every: int = 0, slow_delay: float = 0.0) -> None:
+        """
+        Initialize a local stand-in for an OpenAI-compatible API (e.g. OpenAI or DeepSeek), so that backends can be exercised without network access or API keys.
+        Point a backend at it with base_url=server.base_url.
+
+        Args:
+            response_text (str, optional): The content of every completion. Defaults to a small fenced python function followed by prose.
+            fail_first (int, optional): Number of requests to reject with fail_status before answering normally. Defaults to 0.
+            fail_status (int, optional): The HTTP status of the rejected requests. Defaults to 429.
+            retry_after (float, optional): The Retry-After header to send with rejected requests, in seconds. Defaults to None (no header).
+            delay (float, optional): Seconds to wait before answering each request. Defaults to 0.0.
+            batch_delay (float, optional): Seconds a batch job stays in progress before it completes. Defaults to 0.0.
+            port (int, optional): The port to listen on. Defaults to 0, i.e. any free port.
+            slow_every (int, optional): Make every slow_every-th request wait slow_delay instead of delay, standing in for a provider's occasional slow completions. Defaults to 0 (never).
+            slow_delay (float, optional): Seconds the slow requests wait. Defaults to 0.0.
+        """
+        self.response_text = response_text
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.delay = delay
+        self.batch_delay = batch_delay
+        self.slow_every = slow_every
+        self.slow_delay = slow_delay
+
+        # uploaded and generated files (id -> metadata and content) and batch jobs, for the files and batches endpoints
+        self.files = {}
+        self.batches = {}
+
+        self.request_count = 0
+        self.request_times = []
+        # TCP connections accepted, to tell keep-alive reuse apart from a new connection per request
+        self.connection_count = 0
+        self._lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def start(self) -> "StubOpenAIServer":
+        """
+        Serve requests in a background thread.
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop serving and close the socket.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "StubOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def _next_request(self) -> bool:
+        """
+        Count a request and decide whether it should be rejected.
+        """
+        with self._lock:
+            self.request_count += 1
+            self.request_times.append(time.monotonic())
+            return self.request_count <= self.fail_first
+
+    def _request_delay(self) -> float:
+        if self.slow_every and self.request_count % self.slow_every == 0:
+            return self.slow_delay
+        return self.delay
+
+    def _completion(self, body: dict) -> dict:
+        n = body.get("n", 1)
+        prompt_tokens = sum(len(str(message.get("content", ""))) // 4 for message in body.get("messages", []))
+        completion_tokens = len(self.response_text) // 4
+
+        return {
+            "id": f"chatcmpl-stub-{self.request_count}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [
+                {"index": i, "message": {"role": "assistant", "content": self.response_text}, "finish_reason": "stop"}
+                for i in range(n)
+            ],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens * n, "total_tokens": prompt_tokens + completion_tokens * n},
+        }
+
+    def _create_file(self, filename: str, purpose: str, content: bytes) -> dict:
+        with self._lock:
+            file_id = f"file-stub-{len(self.files) + 1}"
+            self.files[file_id] = {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(content),
+                "created_at": int(time.time()),
+                "filename": filename,
+                "purpose": purpose,
+                "status": "processed",
+                "content": content,
+            }
+        return {key: value for key, value in self.files[file_id].items() if key != "content"}
+
+    def _create_batch(self, body: dict) -> dict:
+        with self._lock:
+            batch_id = f"batch-stub-{len(self.batches) + 1}"
+            self.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": body["endpoint"],
+                "input_file_id": body["input_file_id"],
+                "completion_window": body.get("completion_window", "24h"),
+                "status": "in_progress",
+                "created_at": int(time.time()),
+                "metadata": body.get("metadata"),
+                "output_file_id": None,
+                "error_file_id": None,
+                "_ready_at": time.monotonic() + self.batch_delay,
+            }
+        return self._get_batch(batch_id)
+
+    def _get_batch(self, batch_id: str) -> dict:
+        """
+        Get a batch job, running it once its batch_delay has passed.
+        """
+        with self._batch_lock:
+            return self._run_batch(batch_id)
+
+    def _run_batch(self, batch_id: str) -> dict:
+        batch = self.batches[batch_id]
+        if batch["status"] == "in_progress" and time.monotonic() >= batch["_ready_at"]:
+            output_lines = []
+            input_lines = self.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+            for line in input_lines:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                output_lines.append(json.dumps({
+                    "id": f"batch-req-{request['custom_id']}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "request_id": request["custom_id"], "body": self._completion(request["body"])},
+                    "error": None,
+                }))
+
+            output_file = self._create_file(f"{batch_id}_output.jsonl", "batch_output", "\n".join(output_lines).encode("utf-8"))
+            batch["output_file_id"] = output_file["id"]
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+            batch["request_counts"] = {"total": len(output_lines), "completed": len(output_lines), "failed": 0}
+
+        return {key: value for key, value in batch.items() if not key.startswith("_")}
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connection_count += 1
+
+            def _send_json(self, status: int, payload: dict, headers: dict = None) -> None:
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, body: dict) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                # one chunk per line, so that clients can stop part-way through
+                for line in stub.response_text.splitlines(keepends=True):
+                    chunk = {
+                        "id": "chatcmpl-stub",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", "stub"),
+                        "choices": [{"index": 0, "delta": {"content": line}, "finish_reason": None}],
+                    }
+                    try:
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                    except (BrokenPipeError, ConnectionResetError):
+                        return
+                    time.sleep(stub.delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+
+            def do_GET(self):
+                path = self.path.rstrip("/")
+                parts = path.split("/")
+
+                if "/batches/" in path and parts[-1] in stub.batches:
+                    self._send_json(200, stub._get_batch(parts[-1]))
+                    return
+
+                if path.endswith("/content") and parts[-2] in stub.files:
+                    content = stub.files[parts[-2]]["content"]
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                    return
+
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+            def _upload_file(self, data: bytes) -> None:
+                message = BytesParser(policy=default_policy).parsebytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + data)
+                fields = {}
+                filename = "upload.jsonl"
+                for part in message.iter_parts():
+                    name = part.get_param("name", header="content-disposition")
+                    fields[name] = part.get_payload(decode=True)
+                    if name == "file":
+                        filename = part.get_filename() or filename
+
+                self._send_json(200, stub._create_file(filename, fields.get("purpose", b"batch").decode("utf-8"), fields.get("file", b"")))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                data = self.rfile.read(length)
+
+                if self.path.rstrip("/").endswith("/files"):
+                    self._upload_file(data)
+                    return
+
+                body = json.loads(data or b"{}")
+
+                if self.path.rstrip("/").endswith("/batches"):
+                    self._send_json(200, stub._create_batch(body))
+                    return
+
+                if stub._next_request():
+                    headers = {"Retry-After": str(stub.retry_after)} if stub.retry_after is not None else {}
+                    self._send_json(stub.fail_status, {"error": {"message": "Injected failure", "type": "rate_limit_error", "code": None}}, headers)
+                    return
+
+                if self.path.rstrip("/").endswith("/chat/completions"):
+                    if body.get("stream"):
+                        self._send_stream(body)
+                        return
+
+                    time.sleep(stub._request_delay())
+                    self._send_json(200, stub._completion(body))
+                    return
+
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    with StubOpenAIServer(fail_first=2, retry_after=1) as server:
+        print(f"Stub OpenAI-compatible server listening on {server.base_url}, press Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
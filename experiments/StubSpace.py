@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+from typing import Callable
+import gradio as gr
+from StubServer import DEFAULT_STUB_RESPONSE
+
+class StubSpace():
+    def __init__(self, response_text: str | Callable[[str], str] = DEFAULT_STUB_RESPONSE, delay: float = 0.5, replicas: int = 4, port: int = None) -> None:
+        """
+        Initialize a local gradio app with the same "/predict" API as the CodeQwen and ArtigenzCoder Spaces, so that the gradio backends can be exercised without a Hugging Face account.
+        Point a backend at it with CodeQwen(space=stub.url).
+
+        Args:
+            response_text (str | Callable[[str], str], optional): The response to every prompt, or a function of the prompt returning the response. Defaults to a small fenced python function followed by prose.
+            delay (float, optional): Seconds each job takes, standing in for generation time. Defaults to 0.5.
+            replicas (int, optional): Number of jobs the app runs at once, standing in for the Space's replicas. Defaults to 4.
+            port (int, optional): The port to listen on. Defaults to None, i.e. the first free port from 7860.
+        """
+        self.response_text = response_text
+        self.delay = delay
+        self.port = port
+        self.request_count = 0
+        # jobs running now and the most ever running at once, to check the concurrency cap of the clients
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+        def predict(input_text: str) -> str:
+            with self._lock:
+                self.request_count += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                time.sleep(self.delay)
+                return self.response_text(input_text) if callable(self.response_text) else self.response_text
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+
+        self.app = gr.Interface(fn=predict, inputs=gr.Textbox(label="input_text"), outputs=gr.Textbox(), concurrency_limit=replicas)
+        self.url = None
+
+    def start(self) -> "StubSpace":
+        """
+        Serve the app in a background thread.
+        """
+        try:
+            asyncio.get_event_loop()
+        except RuntimeError:
+            # gradio creates the app's events in the loop of the calling thread, which an earlier asyncio.run leaves unset
+            asyncio.set_event_loop(asyncio.new_event_loop())
+        _, self.url, _ = self.app.queue().launch(server_name="127.0.0.1", server_port=self.port, prevent_thread_lock=True, quiet=True)
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop serving.
+        """
+        self.app.close()
+
+    def __enter__(self) -> "StubSpace":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":
+    from CodeQwen import CodeQwen
+
+    prompts = [f"Write function {i}" for i in range(8)]
+    with StubSpace(delay=0.5, replicas=4) as space:
+        model = CodeQwen(space=space.url, max_concurrency=4)
+
+        start_time = time.perf_counter()
+        for prompt in prompts:
+            model.generate(prompt)
+        print(f"generate, one job at a time: {time.perf_counter() - start_time:.2f}s for {len(prompts)} prompts")
+
+        start_time = time.perf_counter()
+        responses = model.generate_many(prompts)
+        print(f"generate_many, {model.max_concurrency} jobs in flight: {time.perf_counter() - start_time:.2f}s for {len(responses)} prompts")
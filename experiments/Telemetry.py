@@ -0,0 +1,342 @@
+import contextvars
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# USD per million (input, cached input, output) tokens. The longest fragment contained in a model name wins.
+PRICES = {
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+    "gpt-4": (30.00, 30.00, 60.00),
+    "gpt-4-turbo": (10.00, 10.00, 30.00),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "deepseek-chat": (0.14, 0.014, 0.28),
+    "gemini-1.5-pro": (1.25, 0.3125, 5.00),
+}
+
+RECORD_FIELDS = [
+    "timestamp", "backend", "model", "method", "prompt_sha256", "samples",
+    "queue_wait", "time_to_first_token", "total_latency",
+    "input_tokens", "output_tokens", "cached_tokens", "tokens_estimated",
+    "retries", "hedges", "cache_hit", "coalesced", "cost_usd", "error", "tags",
+]
+
+# the record of the call in progress, so that the rate limiter, streams and wrappers can annotate it
+_current_record = contextvars.ContextVar("telemetry_record", default=None)
+# a mutable default would be shared by every context, so the tags are None until telemetry_tags sets a new dict
+_current_tags = contextvars.ContextVar("telemetry_tags", default=None)
+_record_lock = threading.Lock()
+
+
+class JSONLSink():
+    def __init__(self, path: str = ".llm-telemetry/calls.jsonl") -> None:
+        """
+        Initialize a sink that appends every call record as a line of JSON.
+
+        Args:
+            path (str, optional): The JSONL file. Defaults to ".llm-telemetry/calls.jsonl".
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record: dict) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def read(self) -> list[dict]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+class SQLiteSink():
+    def __init__(self, path: str = ".llm-telemetry/calls.sqlite") -> None:
+        """
+        Initialize a sink that inserts every call record as a row of the calls table of an SQLite database.
+
+        Args:
+            path (str, optional): The database file. Defaults to ".llm-telemetry/calls.sqlite".
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS calls ({', '.join(RECORD_FIELDS)})")
+            # databases written before a field was added get its column
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(calls)")}
+            for field in RECORD_FIELDS:
+                if field not in columns:
+                    connection.execute(f"ALTER TABLE calls ADD COLUMN {field}")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def write(self, record: dict) -> None:
+        values = [json.dumps(record[field]) if field == "tags" else record.get(field) for field in RECORD_FIELDS]
+        with self._lock, self._connect() as connection:
+            connection.execute(f"INSERT INTO calls ({', '.join(RECORD_FIELDS)}) VALUES ({', '.join('?' for _ in RECORD_FIELDS)})", values)
+
+    def read(self) -> list[dict]:
+        with self._connect() as connection:
+            rows = connection.execute(f"SELECT {', '.join(RECORD_FIELDS)} FROM calls").fetchall()
+        records = [dict(zip(RECORD_FIELDS, row)) for row in rows]
+        for record in records:
+            record["tags"] = json.loads(record["tags"]) if record["tags"] else {}
+        return records
+
+
+_sink = None
+_sink_configured = False
+
+def configure_telemetry(sink) -> None:
+    """
+    Set the sink every call record is written to.
+
+    Args:
+        sink: A JSONLSink, an SQLiteSink, any object with a write(record) method, or None to turn telemetry off.
+    """
+    global _sink, _sink_configured
+    _sink = sink
+    _sink_configured = True
+
+def get_sink():
+    """
+    Get the sink call records are written to, a JSONLSink in ".llm-telemetry" unless configure_telemetry was called.
+    """
+    global _sink, _sink_configured
+    if not _sink_configured:
+        _sink = JSONLSink()
+        _sink_configured = True
+    return _sink
+
+@contextmanager
+def telemetry_tags(**tags):
+    """
+    Attach tags, e.g. the prompt type or config, to the records of the calls made inside the block.
+    """
+    token = _current_tags.set({**(_current_tags.get() or {}), **tags})
+    try:
+        yield
+    finally:
+        _current_tags.reset(token)
+
+def annotate_record(**fields) -> None:
+    """
+    Set fields of the record of the call in progress, e.g. the time to first token.
+    """
+    record = _current_record.get()
+    if record is None:
+        return
+    with _record_lock:
+        record.update(fields)
+
+def add_to_record(**amounts) -> None:
+    """
+    Add to counters of the record of the call in progress, e.g. retries or queue_wait. A call can make several requests, e.g. to top up samples.
+    """
+    record = _current_record.get()
+    if record is None:
+        return
+    with _record_lock:
+        for field, amount in amounts.items():
+            if amount is not None:
+                record[field] = (record.get(field) or 0) + amount
+
+def get_usage(response) -> tuple:
+    """
+    Get the input, output and cached input tokens reported by an openai or gemini response, if any.
+    """
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+        if cached_tokens is None:
+            # DeepSeek reports its context cache hits separately
+            cached_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+        return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None), cached_tokens or 0
+
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if usage_metadata is not None:
+        return getattr(usage_metadata, "prompt_token_count", None), getattr(usage_metadata, "candidates_token_count", None), getattr(usage_metadata, "cached_content_token_count", None) or 0
+
+    return None, None, None
+
+def record_usage(response) -> None:
+    """
+    Add the token usage of a response to the record of the call in progress.
+    """
+    input_tokens, output_tokens, cached_tokens = get_usage(response)
+    if input_tokens is not None or output_tokens is not None:
+        add_to_record(input_tokens=input_tokens, output_tokens=output_tokens, cached_tokens=cached_tokens)
+
+def estimate_cost(model_name: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> float:
+    """
+    Estimate the cost of a call in USD from the PRICES table.
+
+    Returns:
+        float: The cost, or None if the price of the model is not known.
+    """
+    fragments = [fragment for fragment in PRICES if model_name and fragment in model_name]
+    if not fragments or input_tokens is None:
+        return None
+
+    input_price, cached_price, output_price = PRICES[max(fragments, key=len)]
+    cached_tokens = cached_tokens or 0
+    return ((input_tokens - cached_tokens) * input_price + cached_tokens * cached_price + (output_tokens or 0) * output_price) / 1_000_000
+
+def _finish(record: dict) -> None:
+    result = record.pop("_result", None)
+    prompt = record.pop("_prompt", "")
+    record["total_latency"] = time.perf_counter() - record.pop("_start_time")
+
+    # local and gradio backends report no usage, so their token counts are estimated from the text
+    if record["input_tokens"] is None and record["error"] is None:
+        # imported here because RateLimiter reports to the record of the call in progress
+        from RateLimiter import estimate_tokens
+
+        texts = result if isinstance(result, list) else [result]
+        record["input_tokens"] = estimate_tokens(prompt) * (record["samples"] or 1)
+        record["output_tokens"] = sum(estimate_tokens(text) for text in texts if isinstance(text, str))
+        record["tokens_estimated"] = True
+
+    record["cost_usd"] = estimate_cost(record["model"], record["input_tokens"], record["output_tokens"], record["cached_tokens"])
+
+    sink = get_sink()
+    if sink is not None:
+        try:
+            sink.write(record)
+        except Exception as e:
+            print(f"WARNING: Could not write the telemetry record: {e}")
+
+@contextmanager
+def track_call(model, method: str, prompt: str, samples: int = None):
+    """
+    Record a call to a model and write the record to the sink when the call ends, whether it succeeds or fails.
+    Calls made while another call is tracked, e.g. by a wrapper such as CachedLLM or when topping up samples, are folded into the outer record.
+
+    Args:
+        model (LLMInterface): The model called.
+        method (str): The name of the method called.
+        prompt (str): The prompt.
+        samples (int, optional): The number of samples requested. Defaults to None.
+
+    Yields:
+        dict: The record. Set its "_result" key to the result of the call so that token counts can be estimated when the backend reports no usage.
+    """
+    record = _current_record.get()
+    if record is not None:
+        # the innermost model is the one that actually serves the call
+        record["backend"] = type(model).__name__
+        record["model"] = getattr(model, "model_name", None) or record["model"]
+        yield {}
+        return
+
+    record = {field: None for field in RECORD_FIELDS}
+    record.update({
+        "timestamp": time.time(),
+        "backend": type(model).__name__,
+        "model": getattr(model, "model_name", None),
+        "method": method,
+        "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest() if isinstance(prompt, str) else None,
+        "samples": samples,
+        "queue_wait": 0.0,
+        "retries": 0,
+        "hedges": 0,
+        "cache_hit": False,
+        "coalesced": False,
+        "tags": dict(_current_tags.get() or {}),
+        "_prompt": prompt if isinstance(prompt, str) else "",
+        "_start_time": time.perf_counter(),
+    })
+    token = _current_record.set(record)
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        try:
+            _current_record.reset(token)
+        except ValueError:
+            # a generator closed from another context
+            _current_record.set(None)
+        _finish(record)
+
+def tracked(method):
+    """
+    Wrap a generate, agenerate, generate_samples, agenerate_samples or stream method so that every call writes a record to the telemetry sink.
+    """
+    name = method.__name__
+
+    def samples_of(args, kwargs):
+        if "samples" not in name:
+            return None
+        return kwargs.get("n", args[0] if args else None)
+
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(self, prompt, *args, **kwargs):
+            with track_call(self, name, prompt, samples_of(args, kwargs)) as record:
+                record["_result"] = await method(self, prompt, *args, **kwargs)
+                return record["_result"]
+
+    elif inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def wrapper(self, prompt, *args, **kwargs):
+            with track_call(self, name, prompt) as record:
+                yield from method(self, prompt, *args, **kwargs)
+                record["_result"] = getattr(self, "response_text", None)
+
+    else:
+        @functools.wraps(method)
+        def wrapper(self, prompt, *args, **kwargs):
+            with track_call(self, name, prompt, samples_of(args, kwargs)) as record:
+                record["_result"] = method(self, prompt, *args, **kwargs)
+                return record["_result"]
+
+    wrapper._tracked = True
+    return wrapper
+
+def summarize_records(records: list[dict], key: str = "backend") -> dict:
+    """
+    Aggregate call records, e.g. to find the slowest provider or the most expensive prompt type.
+
+    Args:
+        records (list[dict]): The records, e.g. from JSONLSink().read().
+        key (str, optional): The field or tag to group by. Defaults to "backend".
+
+    Returns:
+        dict: Mapping of group to its call count, error count, mean queue wait, time to first token and latency, total tokens, retries and cost.
+    """
+    groups = {}
+    for record in records:
+        group = record.get(key, (record.get("tags") or {}).get(key))
+        groups.setdefault(group, []).append(record)
+
+    def mean(values):
+        values = [value for value in values if value is not None]
+        return sum(values) / len(values) if values else None
+
+    return {
+        group: {
+            "calls": len(group_records),
+            "errors": sum(1 for record in group_records if record.get("error")),
+            "mean_queue_wait": mean(record.get("queue_wait") for record in group_records),
+            "mean_time_to_first_token": mean(record.get("time_to_first_token") for record in group_records),
+            "mean_latency": mean(record.get("total_latency") for record in group_records),
+            "input_tokens": sum(record.get("input_tokens") or 0 for record in group_records),
+            "output_tokens": sum(record.get("output_tokens") or 0 for record in group_records),
+            "cached_tokens": sum(record.get("cached_tokens") or 0 for record in group_records),
+            "retries": sum(record.get("retries") or 0 for record in group_records),
+            "hedges": sum(record.get("hedges") or 0 for record in group_records),
+            "cost_usd": sum(record.get("cost_usd") or 0 for record in group_records),
+        }
+        for group, group_records in groups.items()
+    }
@@ -0,0 +1,16 @@
+import os
+import sys
+import pytest
+
+# the experiment modules import each other by name, as they do when run from experiments/ or the notebooks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Telemetry import JSONLSink, configure_telemetry
+
+@pytest.fixture(autouse=True)
+def telemetry_sink(tmp_path):
+    # the records of the calls made by the tests go to tmp_path instead of .llm-telemetry in the working directory
+    sink = JSONLSink(str(tmp_path / ".llm-telemetry" / "calls.jsonl"))
+    configure_telemetry(sink)
+    yield sink
+    configure_telemetry(None)
@@ -0,0 +1,74 @@
+import json
+import os
+import pytest
+
+pytest.importorskip("openai")
+
+from HelperFunction import generate_function_matrix_batch, get_function_paths
+from OpenAIModel import OpenAIModel
+from StubServer import DEFAULT_STUB_RESPONSE, StubOpenAIServer
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    with StubOpenAIServer(batch_delay=0.2) as stub:
+        yield stub
+
+def test_batch_job_round_trip(stub, tmp_path):
+    model = OpenAIModel("gpt-4o", base_url=stub.base_url)
+    prompts = {"a": "Write function a", "b": "Write function b"}
+    batch_file_path = str(tmp_path / "batches" / "gpt-4o.jsonl")
+
+    results = model.generate_batch_job(prompts, batch_file_path, poll_interval=0.05, timeout=5)
+
+    assert results == {"a": DEFAULT_STUB_RESPONSE, "b": DEFAULT_STUB_RESPONSE}
+    with open(batch_file_path, "r") as f:
+        requests = [json.loads(line) for line in f]
+    assert [request["custom_id"] for request in requests] == ["a", "b"]
+    assert all(request["url"] == "/v1/chat/completions" and request["body"]["model"] == "gpt-4o" for request in requests)
+    assert [request["body"]["messages"][0]["content"] for request in requests] == ["Write function a", "Write function b"]
+
+    # the uploaded file is the one written to disk
+    uploaded = next(file for file in stub.files.values() if file["purpose"] == "batch")
+    with open(batch_file_path, "rb") as f:
+        assert uploaded["content"] == f.read()
+
+def test_wait_for_batch_times_out(stub, tmp_path):
+    stub.batch_delay = 60
+    model = OpenAIModel("gpt-4o", base_url=stub.base_url)
+    batch_id = model.submit_batch({"a": "Write function a"}, str(tmp_path / "batch.jsonl"))
+
+    with pytest.raises(TimeoutError):
+        model.wait_for_batch(batch_id, poll_interval=0.05, timeout=0.2)
+
+def test_function_matrix_batch_writes_only_missing_functions(stub, tmp_path):
+    prompt_paths = {}
+    for prompt_type in ("type1", "type2", "type3"):
+        prompt_paths[prompt_type] = tmp_path / f"prompt-{prompt_type}.txt"
+        prompt_paths[prompt_type].write_text(f"Write the handler ({prompt_type})")
+    config = {
+        "chosen_function": "handler.py",
+        "original_function_save_path": str(tmp_path / "ORIGINAL-handler.py"),
+        **{f"function_generation_prompt_{prompt_type}_save_path": str(path) for prompt_type, path in prompt_paths.items()},
+        **{f"generated_function_{prompt_type}_save_dir": str(tmp_path / "GENERATED" / prompt_type) for prompt_type in prompt_paths},
+    }
+
+    existing_path = get_function_paths(config, "GPT-4", "type1", 1)["generated"]
+    os.makedirs(os.path.dirname(existing_path))
+    with open(existing_path, "w") as f:
+        f.write("kept")
+
+    model = OpenAIModel("gpt-4", base_url=stub.base_url)
+    save_paths = generate_function_matrix_batch([config], {"GPT-4": model}, str(tmp_path / "batches"), generation_count=2, poll_interval=0.05, timeout=5)
+
+    expected = [get_function_paths(config, "GPT-4", prompt_type, i)["generated"] for prompt_type in prompt_paths for i in (1, 2)]
+    expected.remove(existing_path)
+    assert sorted(save_paths["GPT-4"]) == sorted(expected)
+    for path in expected:
+        assert os.path.exists(path)
+    with open(existing_path, "r") as f:
+        assert f.read() == "kept"
+
+    # a second run finds nothing missing and submits no batch
+    assert generate_function_matrix_batch([config], {"GPT-4": model}, str(tmp_path / "batches"), generation_count=2) == {"GPT-4": []}
+    assert len(stub.batches) == 1
@@ -0,0 +1,39 @@
+from CachedLLM import CachedLLM, ResponseCache
+from LLMInterface import LLMInterface
+
+class CountingLLM(LLMInterface):
+    max_concurrency = 4
+
+    def __init__(self) -> None:
+        self.model_name = "counting"
+        self.calls = 0
+
+    def generate(self, prompt: str, *args, **kwargs) -> str:
+        self.calls += 1
+        self.response_text = f"{prompt} #{self.calls}"
+        return self.response_text
+
+    def write_to_file(self, filename: str) -> None:
+        pass
+
+
+def test_rerunning_a_generation_loop_is_served_from_the_cache(tmp_path):
+    backend = CountingLLM()
+    model = CachedLLM(backend, ResponseCache(str(tmp_path)))
+
+    first = [model.generate("Write a handler", sample_index=i) for i in range(1, 4)]
+    assert len(set(first)) == 3
+
+    # the same loop again, in the same instance and in a new one as after a kernel restart
+    assert [model.generate("Write a handler", sample_index=i) for i in range(1, 4)] == first
+    assert [CachedLLM(backend, ResponseCache(str(tmp_path))).generate("Write a handler", sample_index=i) for i in range(1, 4)] == first
+    assert backend.calls == 3
+
+def test_samples_share_keys_with_generation_indices(tmp_path):
+    backend = CountingLLM()
+    model = CachedLLM(backend, ResponseCache(str(tmp_path)))
+
+    samples = model.generate_samples("Write a handler", 2)
+    assert model.generate("Write a handler", sample_index=2) == samples[1]
+    assert model.generate_samples("Write a handler", 3)[:2] == samples
+    assert backend.calls == 3
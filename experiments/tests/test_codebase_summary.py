@@ -0,0 +1,120 @@
+import os
+import pytest
+import CodebaseSummary
+from CodebaseSummary import SummaryStore, summarize_codebase
+from LLMInterface import LLMInterface
+
+EXPERIMENTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class RecordingLLM(LLMInterface):
+    max_concurrency = 1
+
+    def __init__(self) -> None:
+        self.model_name = "recording"
+        self.prompts = []
+
+    def generate(self, prompt: str, *args, **kwargs) -> str:
+        self.prompts.append(prompt)
+        self.response_text = f"summary {len(self.prompts)}"
+        return self.response_text
+
+    def write_to_file(self, filename: str) -> None:
+        pass
+
+
+@pytest.fixture
+def codebase(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(CodebaseSummary, "UPDATE_PROMPT_TEMPLATE", os.path.join(EXPERIMENTS_DIR, CodebaseSummary.UPDATE_PROMPT_TEMPLATE))
+    with open("summary-template.txt", "w") as f:
+        f.write("Summarize this codebase.")
+    for name in "abcdefg":
+        write_file(f"src/{name}.py", f"def {name}():\n    return '{name}'\n")
+    return tmp_path
+
+def write_file(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+def make_config(name: str, files: str) -> dict:
+    write_file(f"{name}/context-files.txt", "\n".join(f"src/{file}.py" for file in files))
+    return {
+        "language": "python",
+        "codebase_summary_prompt_template": "summary-template.txt",
+        "files_to_summarize_paths": f"{name}/context-files.txt",
+        "codebase_summary_prompt_save_path": f"{name}/summary-prompt.txt",
+        "codebase_summary_save_path": f"{name}/summary.txt",
+    }
+
+def summarize(config: dict, model: LLMInterface, **kwargs) -> str:
+    return summarize_codebase(config, model, SummaryStore(".summary-store"), chunked=False, **kwargs)
+
+
+def test_the_same_context_files_reuse_the_summary(codebase):
+    model = RecordingLLM()
+    assert summarize(make_config("function1", "abcd"), model) == "summary 1"
+    assert summarize(make_config("function2", "dcba"), model) == "summary 1"
+
+    assert len(model.prompts) == 1
+    with open("function2/summary.txt") as f:
+        assert f.read() == "summary 1"
+
+def test_changed_contents_are_not_reused(codebase):
+    model = RecordingLLM()
+    summarize(make_config("function1", "abcd"), model)
+    write_file("src/a.py", "def a():\n    return 'changed a'\n")
+
+    # 3 of 4 files are unchanged, so the summary is updated rather than reused
+    assert summarize(make_config("function1", "abcd"), model) == "summary 2"
+    assert "Since it was written, some files" in model.prompts[1]
+
+def test_overlapping_context_files_only_send_the_difference(codebase):
+    model = RecordingLLM()
+    summarize(make_config("function1", "abcde"), model)
+    write_file("src/d.py", "def d():\n    return 'changed d'\n")
+
+    # a, b and c are shared out of a to f, exactly min_overlap
+    assert summarize(make_config("function2", "abcdf"), model) == "summary 2"
+    prompt = model.prompts[1]
+    assert "summary 1" in prompt
+    removed = prompt.split("These files were removed from the codebase:")[1].split("Please update")[0]
+    assert removed.strip() == "src/e.py"
+    assert "src/d.py\n```python\ndef d():\n    return 'changed d'" in prompt and "src/f.py\n```python" in prompt
+    assert not any(f"src/{name}.py\n```" in prompt for name in "abce")
+    with open("function2/summary-prompt.txt") as f:
+        assert f.read() == prompt
+
+def test_low_overlap_summarizes_from_scratch(codebase):
+    model = RecordingLLM()
+    summarize(make_config("function1", "abcde"), model)
+
+    # b and c are shared out of a to g
+    assert summarize(make_config("function2", "bcfg"), model) == "summary 2"
+    assert model.prompts[1].startswith("Summarize this codebase.")
+    assert all(f"src/{name}.py\n```" in model.prompts[1] for name in "bcfg")
+
+def test_updates_in_a_row_stop_at_max_depth(codebase):
+    model = RecordingLLM()
+    summarize(make_config("function1", "abcd"), model)
+    summarize(make_config("function2", "abcde"), model)
+
+    # the update of function2 overlaps most, but has reached max_depth=1, so the summary of function1 is updated instead
+    summarize(make_config("function3", "abcdef"), model, max_depth=1)
+    assert "summary 1" in model.prompts[2] and "src/e.py\n```" in model.prompts[2]
+
+    # with max_depth=0 every summary is made from scratch
+    summarize(make_config("function4", "abcdeg"), model, max_depth=0)
+    assert model.prompts[3].startswith("Summarize this codebase.")
+
+def test_closest_only_considers_the_same_template_language_and_model(codebase):
+    store = SummaryStore(".summary-store")
+    files = {"src/a.py": "1", "src/b.py": "2"}
+    entry = {"template_sha256": "t", "language": "python", "model_name": "m", "files": files, "summary": "s", "depth": 0}
+    store.put("key", entry)
+
+    assert store.closest("t", "python", "m", {"src/a.py": "1", "src/c.py": "3"}, max_depth=3)["overlap"] == pytest.approx(1 / 3)
+    assert store.closest("t", "JS", "m", files, max_depth=3) is None
+    assert store.closest("t", "python", "other", files, max_depth=3) is None
+    # a changed file is not shared
+    assert store.closest("t", "python", "m", {"src/a.py": "changed"}, max_depth=3) is None
@@ -0,0 +1,80 @@
+import json
+import os
+import pytest
+from ExampleIndex import ExampleIndex, retrieve_example_functions
+
+FUNCTIONS = {
+    # (repository, function): (language, description, code)
+    ("tags", "function1"): ("JS", "Create a tag for a release and store the tag in the tags table", "export const createTag = async (event) => putTag(event.release, event.tag);"),
+    ("tags", "function2"): ("JS", "Delete a tag of a release from the tags table", "export const deleteTag = async (event) => removeTag(event.release, event.tag);"),
+    ("tags", "function3"): ("JS", "List the tags of a release from the tags table", "export const listTags = async (event) => queryTags(event.release);"),
+    ("orders", "function1"): ("JS", "Charge the payment of an order and send a receipt email", "export const chargeOrder = async (event) => charge(event.order, event.payment);"),
+    ("pytags", "function1"): ("python", "Create a tag for a release and store the tag in the tags table", "def create_tag(event, context):\n    return put_tag(event['release'], event['tag'])\n"),
+}
+
+def write_file(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+@pytest.fixture
+def dataset(tmp_path):
+    configs = {}
+    for (repository, function), (language, description, code) in FUNCTIONS.items():
+        function_dir = tmp_path / repository / function
+        config = {
+            "language": language,
+            "function_description_save_path": str(function_dir / "function-description.txt"),
+            "original_function_save_path": str(function_dir / f"ORIGINAL-handler.{'py' if language == 'python' else 'js'}"),
+        }
+        write_file(config["function_description_save_path"], description)
+        write_file(config["original_function_save_path"], code)
+        write_file(str(function_dir / "config.json"), json.dumps(config))
+        configs[(repository, function)] = config
+    return tmp_path, configs
+
+def make_index(dataset_dir) -> ExampleIndex:
+    return ExampleIndex(str(dataset_dir), str(dataset_dir / ".example-index" / "index.json"))
+
+def test_examples_are_the_most_similar_functions_of_the_same_language(dataset):
+    dataset_dir, configs = dataset
+    config = configs[("tags", "function1")]
+
+    examples = retrieve_example_functions(config, k=2, index=make_index(dataset_dir))
+    # the chosen function itself and the python function with the same description are never picked
+    assert [code for _, code in examples] == [configs[("tags", "function2")]["original_function_save_path"], configs[("tags", "function3")]["original_function_save_path"]]
+    assert [description for description, _ in examples] == [configs[("tags", function)]["function_description_save_path"] for function in ("function2", "function3")]
+
+def test_functions_outside_the_index_are_searched_by_description(dataset):
+    dataset_dir, configs = dataset
+    index = make_index(dataset_dir)
+    config = {**configs[("tags", "function1")], "original_function_save_path": str(dataset_dir / "new" / "handler.js")}
+
+    examples = retrieve_example_functions(config, k=1, index=index)
+    # the most similar function is now tags/function1 itself
+    assert examples == [[configs[("tags", "function1")]["function_description_save_path"], configs[("tags", "function1")]["original_function_save_path"]]]
+
+def test_examples_beyond_the_token_budget_are_skipped(dataset):
+    dataset_dir, configs = dataset
+    index = make_index(dataset_dir)
+    write_file(configs[("tags", "function2")]["original_function_save_path"], "export const deleteTag = async (event) => removeTag(event.release, event.tag);\n" * 50)
+    index.update()
+
+    # function2 no longer fits, and the order function shares no term with the description
+    examples = retrieve_example_functions(configs[("tags", "function1")], k=2, max_tokens=200, index=index)
+    assert [code for _, code in examples] == [configs[("tags", "function3")]["original_function_save_path"]]
+    assert len(retrieve_example_functions(configs[("tags", "function1")], k=2, index=index)) == 2
+
+def test_broken_configs_are_skipped_with_a_warning(dataset, capsys):
+    dataset_dir, configs = dataset
+    write_file(str(dataset_dir / "broken" / "function1" / "config.json"), "{\"language\": ")
+    write_file(str(dataset_dir / "broken" / "function2" / "config.json"), json.dumps({"language": "JS"}))
+    write_file(str(dataset_dir / "broken" / "function3" / "config.json"), json.dumps(["not", "a", "config"]))
+
+    index = make_index(dataset_dir)
+    output = capsys.readouterr().out
+    assert "function1/config.json, its function is not indexed" in output
+    assert "function2/config.json has no function_description_save_path, original_function_save_path" in output
+    assert "function3/config.json has no language" in output
+    assert len(index.functions) == len(FUNCTIONS)
+    assert len(retrieve_example_functions(configs[("tags", "function1")], k=2, index=index)) == 2
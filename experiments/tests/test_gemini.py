@@ -0,0 +1,96 @@
+import importlib
+import sys
+import types
+import pytest
+
+pytest.importorskip("dotenv")
+
+class FakeChunk():
+    def __init__(self, text: str = None) -> None:
+        self._text = text
+
+    @property
+    def text(self) -> str:
+        # as in google-generativeai, chunks without text parts raise instead of returning ""
+        if self._text is None:
+            raise ValueError("The `response.text` quick accessor only works when the response contains a valid `Part`")
+        return self._text
+
+class FakeStream():
+    def __init__(self, chunks: list) -> None:
+        self.chunks = iter(chunks)
+        self.read = 0
+        self.cancelled = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = next(self.chunks)
+        self.read += 1
+        return chunk
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+class FakeResponse():
+    def __init__(self, chunks: list) -> None:
+        self._iterator = FakeStream(chunks)
+
+    def __iter__(self):
+        for chunk in self._iterator:
+            yield chunk
+
+class FakeGenerativeModel():
+    def __init__(self, model_name: str) -> None:
+        self.model_name = model_name
+        self.responses = []
+
+    def generate_content(self, prompt: str, stream: bool = False):
+        return self.responses.pop(0)
+
+@pytest.fixture
+def gemini(monkeypatch):
+    genai = types.ModuleType("google.generativeai")
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = FakeGenerativeModel
+    google = types.ModuleType("google")
+    google.generativeai = genai
+    monkeypatch.setitem(sys.modules, "google", google)
+    monkeypatch.setitem(sys.modules, "google.generativeai", genai)
+    monkeypatch.delitem(sys.modules, "Gemini", raising=False)
+
+    module = importlib.import_module("Gemini")
+    yield module.Gemini()
+    sys.modules.pop("Gemini", None)
+
+TEXTS = ["Here is the handler:\n```python\n", "def handler(event, context):\n    return 1\n``", "`\nIt returns 1.", " More prose."]
+# the last chunk only carries the finish reason
+CHUNKS = [*(FakeChunk(text) for text in TEXTS), FakeChunk()]
+
+def test_stream_stops_and_cancels_at_the_closing_fence(gemini):
+    response = FakeResponse(CHUNKS)
+    gemini.model.responses.append(response)
+
+    # the closing fence is split across two chunks
+    assert gemini.generate_streaming("Write a handler") == "Here is the handler:\n```python\ndef handler(event, context):\n    return 1\n```"
+    assert gemini.stream_stats["stopped_early"]
+    assert response._iterator.cancelled
+    assert response._iterator.read == 3
+
+def test_stream_skips_chunks_without_text(gemini):
+    response = FakeResponse(CHUNKS)
+    gemini.model.responses.append(response)
+
+    assert "".join(gemini.stream("Write a handler")) == "".join(TEXTS)
+    assert not gemini.stream_stats["stopped_early"]
+    assert not response._iterator.cancelled
+    assert gemini.response_text == "".join(TEXTS)
+
+def test_stream_without_a_cancel_hook_warns(gemini, capsys):
+    response = FakeResponse(CHUNKS)
+    response._iterator = iter(CHUNKS[:3])
+    gemini.model.responses.append(response)
+
+    assert gemini.generate_streaming("Write a handler").endswith("```")
+    assert "Could not cancel the Gemini stream" in capsys.readouterr().out
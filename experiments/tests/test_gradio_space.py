@@ -0,0 +1,55 @@
+import asyncio
+import time
+import pytest
+
+pytest.importorskip("gradio")
+pytest.importorskip("gradio_client")
+
+from CodeQwen import CodeQwen
+from StubSpace import StubSpace
+
+@pytest.fixture(scope="module")
+def space():
+    # answers every prompt with its reversal, so that results can be matched to their prompts
+    with StubSpace(response_text=lambda prompt: prompt[::-1], delay=0.3, replicas=4) as space:
+        yield space
+
+@pytest.fixture(autouse=True)
+def reset_counts(space):
+    space.request_count = 0
+    space.max_in_flight = 0
+
+def test_generate_submits_and_polls_a_job(space):
+    model = CodeQwen(space=space.url)
+
+    assert model.generate("Write function 0") == "0 noitcnuf etirW"
+    assert asyncio.run(model.agenerate("Write function 1")) == "1 noitcnuf etirW"
+    assert model.response_text == "1 noitcnuf etirW"
+    assert space.request_count == 2
+
+def test_generate_many_returns_results_in_order_under_the_cap(space):
+    model = CodeQwen(space=space.url, max_concurrency=2)
+    prompts = [f"Write function {i}" for i in range(6)]
+
+    start_time = time.perf_counter()
+    responses = model.generate_many(prompts)
+    elapsed = time.perf_counter() - start_time
+
+    assert responses == [prompt[::-1] for prompt in prompts]
+    assert space.request_count == 6
+    # the Space runs 4 jobs at once, but the client keeps at most 2 in flight
+    assert space.max_in_flight == 2
+    assert elapsed >= 3 * space.delay
+
+def test_instances_of_a_space_share_its_cap(space):
+    models = [CodeQwen(space=space.url, max_concurrency=3) for _ in range(2)]
+
+    async def generate_all():
+        return await asyncio.gather(*(models[i % 2].agenerate(f"Write function {i}") for i in range(6)))
+
+    assert asyncio.run(generate_all()) == [f"Write function {i}"[::-1] for i in range(6)]
+    assert space.max_in_flight == 3
+
+def test_extra_positional_arguments_are_rejected(space):
+    with pytest.raises(TypeError):
+        CodeQwen(space.url, 2, "unexpected")
@@ -0,0 +1,111 @@
+import time
+import pytest
+from HedgedLLM import CircuitBreaker, HedgedLLM
+
+def test_circuit_breaker_opens_and_closes_after_a_trial_call():
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=2, cooldown=0.1)
+
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.1)
+    # a single trial call once the cooldown is over
+    assert breaker.allow()
+    assert breaker.state == "half-open"
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+def test_circuit_breaker_opens_again_when_the_trial_call_fails():
+    breaker = CircuitBreaker(min_calls=1, cooldown=0.05)
+    breaker.record_failure()
+    time.sleep(0.05)
+
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    pytest.importorskip("openai")
+    from StubServer import StubOpenAIServer
+
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    servers = []
+
+    def start(**kwargs):
+        servers.append(StubOpenAIServer(**kwargs).start())
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
+
+def openai_model(server, **limits):
+    from OpenAIModel import OpenAIModel
+    from RateLimiter import ProviderRateLimiter
+
+    # a rate limiter per model, so that the stub servers do not share backoff
+    return OpenAIModel("gpt-4", base_url=server.base_url, rate_limiter=ProviderRateLimiter(**limits))
+
+def test_slow_call_is_hedged_to_the_next_backend(stub_server):
+    slow, fast = stub_server(delay=2.0), stub_server(delay=0.05)
+    model = HedgedLLM([openai_model(slow), openai_model(fast)], initial_hedge_delay=0.2)
+
+    start_time = time.perf_counter()
+    model.generate("Write a handler")
+    elapsed = time.perf_counter() - start_time
+
+    assert 0.2 <= elapsed < 1.5
+    assert model.hedge_count == 1
+    assert slow.request_count == 1 and fast.request_count == 1
+    # the cancelled slow call is recorded as at least as slow as the hedge delay
+    assert len(model.latencies[0]) == 1
+    assert model.latencies[0].percentile(50) >= 0.2
+
+def test_hedge_delay_follows_observed_latencies_including_cancelled_calls(stub_server):
+    primary = stub_server(delay=0.05, slow_every=4, slow_delay=2.0)
+    secondary = stub_server(delay=0.05)
+    model = HedgedLLM([openai_model(primary), openai_model(secondary)], hedge_percentile=90, initial_hedge_delay=0.3, min_observations=4)
+
+    for i in range(8):
+        model.generate(f"Write function {i}")
+
+    # every 4th primary call was slow and got hedged, its cut-off latency keeping the tail of the distribution
+    assert model.hedge_count == 2
+    assert model.hedge_delay(0) >= 0.3
+    assert model.latencies[0].percentile(0) < 0.3
+
+def test_failing_backend_falls_back_and_opens_its_breaker(stub_server):
+    failing = stub_server(fail_first=100, fail_status=500)
+    healthy = stub_server()
+    model = HedgedLLM(
+        [openai_model(failing, max_retries=0), openai_model(healthy)],
+        breaker_kwargs={"failure_rate": 0.5, "window": 4, "min_calls": 2, "cooldown": 60},
+    )
+
+    for i in range(4):
+        model.generate(f"Write function {i}")
+
+    # the breaker opened after 2 failures, so later calls went straight to the healthy backend
+    assert failing.request_count == 2
+    assert healthy.request_count == 4
+    assert model.fallback_count == 2
+    assert model.breakers[0].state == "open"
+
+def test_all_breakers_open_raises(stub_server):
+    failing = stub_server(fail_first=100, fail_status=500)
+    model = HedgedLLM([openai_model(failing, max_retries=0)], breaker_kwargs={"min_calls": 1, "cooldown": 60})
+
+    with pytest.raises(Exception):
+        model.generate("Write a handler")
+    with pytest.raises(RuntimeError, match="circuit breakers are open"):
+        model.generate("Write a handler")
+    assert failing.request_count == 1
@@ -0,0 +1,68 @@
+import os
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("accelerate")
+
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+from LocalLLM import LocalLLM
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    # a tiny random model with a byte-level BPE tokenizer and a chat template, so that nothing is downloaded
+    path = str(tmp_path_factory.mktemp("tiny-llama"))
+    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), "LocalLLM.py")) as f:
+        text = f.read()
+
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator([text], trainers.BpeTrainer(vocab_size=400, special_tokens=["<unk>", "<s>", "</s>"], initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", unk_token="<unk>")
+    tokenizer.chat_template = "{% for m in messages %}<s>{{ m['role'] }}: {{ m['content'] }}\n{% endfor %}{% if add_generation_prompt %}assistant:{% endif %}"
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(0)
+    config = LlamaConfig(vocab_size=len(tokenizer), hidden_size=64, intermediate_size=128, num_hidden_layers=2, num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=4096, bos_token_id=1, eos_token_id=2)
+    LlamaForCausalLM(config).save_pretrained(path)
+    return path
+
+SHARED = "Here is the summary of the codebase:\n" + "def handler(event, context): return {'statusCode': 200}\n" * 20
+
+def make_model(model_dir: str, **kwargs) -> LocalLLM:
+    # greedy decoding, so that both paths must produce the same tokens
+    return LocalLLM(model_dir, max_new_tokens=12, do_sample=False, temperature=None, top_p=None, top_k=None, pipeline_kwargs={"no_repeat_ngram_size": 1}, **kwargs)
+
+def test_prefix_caching_is_off_by_default(model_dir):
+    model = make_model(model_dir)
+    model.generate(SHARED + "Write the create handler.")
+    assert model.prefix_cache_stats == {"hits": 0, "misses": 0, "prefix_tokens": 0, "prompt_tokens": 0}
+
+def test_cached_prefixes_give_the_pipeline_output(model_dir):
+    pipeline_model = make_model(model_dir)
+    cached_model = make_model(model_dir, prefix_cache_bytes=64 * 1024 ** 2, min_prefix_tokens=16)
+    prompts = [SHARED + "Write the create handler.", SHARED + "Write the delete handler."]
+
+    for prompt in prompts:
+        assert cached_model.generate(prompt) == pipeline_model.generate(prompt)
+    samples = []
+    for model in (cached_model, pipeline_model):
+        torch.manual_seed(0)
+        samples.append(model.generate_samples(prompts[0], 2, do_sample=True))
+    assert samples[0] == samples[1]
+
+    stats = cached_model.prefix_cache_stats
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    # the second and third prompts reuse everything up to the end of the shared part, and the counts add up over the calls
+    prompt_tokens = [len(cached_model.tokenizer.apply_chat_template(cached_model._messages(prompt), add_generation_prompt=True)) for prompt in prompts]
+    assert stats["prompt_tokens"] == prompt_tokens[0] * 2 + prompt_tokens[1]
+    assert len(cached_model.tokenizer(SHARED).input_ids) < stats["prefix_tokens"] < stats["prompt_tokens"] - prompt_tokens[0]
+
+def test_prefixes_larger_than_the_cache_are_reported(model_dir, capsys):
+    model = make_model(model_dir, prefix_cache_bytes=1024)
+    model.generate(SHARED + "Write the create handler.")
+
+    assert "not cached" in capsys.readouterr().out
+    assert len(model._prefix_cache) == 0
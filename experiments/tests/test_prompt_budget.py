@@ -0,0 +1,35 @@
+import pytest
+import PromptBudget
+from PromptBudget import check_prompt_length
+
+def test_prompt_length_is_not_checked_on_an_estimate(monkeypatch):
+    monkeypatch.setattr(PromptBudget, "get_tokenizer", lambda model_name, local_files_only=False: None)
+    # about 100000 tokens by the estimate, over the 8192 token window
+    check_prompt_length("gpt-4", "word " * 80000)
+
+def test_prompt_length_is_checked_without_downloading_a_tokenizer(monkeypatch):
+    calls = []
+
+    def get_tokenizer(model_name, local_files_only=False):
+        calls.append(local_files_only)
+        return str.split
+
+    monkeypatch.setattr(PromptBudget, "get_tokenizer", get_tokenizer)
+    check_prompt_length("gpt-4", "word " * 8000)
+    with pytest.raises(ValueError, match="8192 token context window"):
+        check_prompt_length("gpt-4", "word " * 9000)
+    assert calls == [True, True]
+
+def test_tokenizer_load_failures_fall_back_to_estimates(monkeypatch):
+    transformers = pytest.importorskip("transformers")
+
+    def from_pretrained(*args, **kwargs):
+        raise RuntimeError("no network")
+
+    monkeypatch.setattr(transformers.AutoTokenizer, "from_pretrained", from_pretrained)
+    PromptBudget.get_tokenizer.cache_clear()
+    try:
+        assert PromptBudget.get_tokenizer("deepseek-chat") is None
+        assert PromptBudget.count_tokens("word " * 100, "deepseek-chat") == len("word " * 100) // 4 + 1
+    finally:
+        PromptBudget.get_tokenizer.cache_clear()
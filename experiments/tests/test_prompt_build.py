@@ -0,0 +1,154 @@
+import hashlib
+import os
+import shutil
+import pytest
+from LLMInterface import LLMInterface
+from PromptBuild import BuildManifest, build_prompts
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompt-templates")
+
+class HashingLLM(LLMInterface):
+    max_concurrency = 1
+
+    def __init__(self, model_name: str = "hashing") -> None:
+        self.model_name = model_name
+        self.prompts = []
+
+    def generate(self, prompt: str, *args, **kwargs) -> str:
+        # the same prompt gives the same output, so that unchanged prompts give unchanged summaries
+        self.prompts.append(prompt)
+        self.response_text = f"output of {hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]}"
+        return self.response_text
+
+    def write_to_file(self, filename: str) -> None:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            f.write(self.response_text)
+
+
+def write_file(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shutil.copytree(TEMPLATES_DIR, "prompt-templates")
+    write_file("repo/README.md", "# Serverless tags\nHandlers for tags.\n")
+    write_file("repo/src/get.js", "export const get = async () => ({ statusCode: 200 });\n")
+    write_file("repo/src/put.js", "export const put = async () => ({ statusCode: 201 });\n")
+    write_file("repo/function1/context-files.txt", "repo/src/get.js\nrepo/src/put.js")
+    write_file("repo/src/delete.js", "export const del = async () => ({ statusCode: 204 });\n")
+
+    return {
+        "language": "JS",
+        "files_to_summarize_paths": "repo/function1/context-files.txt",
+        "codebase_summary_prompt_template": "prompt-templates/codebase-summarization-prompt-template.txt",
+        "codebase_summary_prompt_save_path": "repo/function1/PROMPTS/summary-prompt.txt",
+        "codebase_summary_save_path": "repo/function1/codebase-summary.txt",
+        "function_description_prompt_template": "prompt-templates/function-description-prompt-template.txt",
+        "chosen_function_path": "repo/src/delete.js",
+        "function_description_prompt_save_path": "repo/function1/PROMPTS/description-prompt.txt",
+        "function_description_save_path": "repo/function1/function-description.txt",
+        "codebase_readme_path": "repo/README.md",
+        "function_generation_prompt_template_type1": "prompt-templates/function-generation-prompt-template/type1.txt",
+        "function_generation_prompt_type1_save_path": "repo/function1/PROMPTS/type1.txt",
+        "function_generation_prompt_template_type2": "prompt-templates/function-generation-prompt-template/type2.txt",
+        "function_generation_prompt_type2_save_path": "repo/function1/PROMPTS/type2.txt",
+        "function_generation_prompt_type3_save_path": "",
+    }
+
+def names(rebuilt: list[tuple[str, str]]) -> list[str]:
+    return [name for name, _ in rebuilt]
+
+ALL = ["summary_prompt", "description_prompt", "codebase_summary", "function_description", "type1_prompt", "type2_prompt"]
+
+
+def test_unchanged_inputs_rebuild_nothing(config):
+    model = HashingLLM()
+    assert names(build_prompts(config, model)) == ALL
+    assert len(model.prompts) == 2
+
+    assert build_prompts(config, model) == []
+    assert len(model.prompts) == 2
+
+def test_an_edited_template_only_rebuilds_its_prompt(config):
+    model = HashingLLM()
+    build_prompts(config, model)
+    with open(config["function_generation_prompt_template_type1"], "a") as f:
+        f.write("\nAnswer in JavaScript.")
+
+    assert build_prompts(config, model) == [("type1_prompt", f"{config['function_generation_prompt_template_type1']} changed")]
+    with open(config["function_generation_prompt_type1_save_path"]) as f:
+        assert f.read().endswith("Answer in JavaScript.")
+
+def test_an_edited_context_file_rebuilds_the_summary_and_what_uses_it(config):
+    model = HashingLLM()
+    build_prompts(config, model)
+    write_file("repo/src/put.js", "export const put = async () => ({ statusCode: 200 });\n")
+
+    assert names(build_prompts(config, model)) == ["summary_prompt", "codebase_summary", "type2_prompt"]
+    assert len(model.prompts) == 3
+
+def test_a_touched_file_with_the_same_contents_rebuilds_nothing(config):
+    model = HashingLLM()
+    build_prompts(config, model)
+    with open(config["codebase_readme_path"]) as f:
+        readme = f.read()
+    write_file(config["codebase_readme_path"], readme)
+    os.utime(config["codebase_readme_path"], (0, 0))
+
+    assert build_prompts(config, model) == []
+
+def test_a_rebuilt_output_with_the_same_contents_stops_the_rebuild(config):
+    model = HashingLLM()
+    build_prompts(config, model)
+    # the summary is rebuilt because it is missing, but comes out the same, so the type2 prompt made from it is not
+    os.remove(config["codebase_summary_save_path"])
+
+    assert build_prompts(config, model) == [("codebase_summary", "output missing")]
+
+def test_a_dry_run_lists_the_stale_outputs_without_building_them(config):
+    model = HashingLLM()
+    build_prompts(config, model)
+    write_file("repo/src/put.js", "export const put = async () => ({ statusCode: 200 });\n")
+    with open(config["codebase_summary_save_path"]) as f:
+        summary = f.read()
+
+    # the type2 prompt is listed since the summary it depends on would be rebuilt
+    assert build_prompts(config, model, dry_run=True) == [
+        ("summary_prompt", "repo/src/put.js changed"),
+        ("codebase_summary", "repo/src/put.js changed"),
+        ("type2_prompt", f"{config['codebase_summary_save_path']} is rebuilt"),
+    ]
+    assert len(model.prompts) == 2
+    with open(config["codebase_summary_save_path"]) as f:
+        assert f.read() == summary
+
+    # nothing was recorded, so the real build still rebuilds them
+    assert names(build_prompts(config, model)) == ["summary_prompt", "codebase_summary", "type2_prompt"]
+
+def test_a_dry_run_notices_a_change_of_model(config):
+    build_prompts(config, HashingLLM())
+
+    assert build_prompts(config, HashingLLM("other"), dry_run=True)[:2] == [("codebase_summary", "parameters changed"), ("function_description", "parameters changed")]
+    assert build_prompts(config, None, dry_run=True) == []
+
+def test_existing_outputs_are_adopted_instead_of_rebuilt(config):
+    model = HashingLLM()
+    build_prompts(config, model)
+    manifest = BuildManifest(".prompt-build/other-manifest.json")
+
+    assert build_prompts(config, model, manifest=manifest, dry_run=True) == [(name, "not built before") for name in ALL]
+    assert build_prompts(config, model, manifest=manifest, adopt_existing=True) == []
+    assert len(model.prompts) == 2
+
+    # adopted outputs are rebuilt as usual once their inputs change
+    with open(config["function_generation_prompt_template_type2"], "a") as f:
+        f.write("\nAnswer in JavaScript.")
+    assert names(build_prompts(config, model, manifest=manifest)) == ["type2_prompt"]
+
+def test_outputs_that_call_a_model_need_one(config):
+    with pytest.raises(ValueError, match="codebase_summary calls a model"):
+        build_prompts(config)
@@ -0,0 +1,122 @@
+import asyncio
+import time
+import pytest
+from RateLimiter import ProviderRateLimiter, default_rate_limits
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def fail_first(failures: int, error: type = RateLimitError):
+    calls = []
+
+    def function():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise error()
+        return "ok"
+
+    return function, calls
+
+def test_failed_attempts_give_back_their_tokens():
+    limiter = ProviderRateLimiter(tokens_per_minute=600, base_delay=0.0)
+    function, calls = fail_first(2)
+
+    assert limiter.call(function, estimated_tokens=100) == "ok"
+    assert len(calls) == 3
+    assert limiter.retries == 2
+    # only the successful attempt keeps its reservation, refilled at 10 tokens per second for the duration of the test
+    assert 500 <= limiter.token_bucket.tokens < 505
+
+def test_async_failed_attempts_give_back_their_tokens():
+    limiter = ProviderRateLimiter(tokens_per_minute=600, base_delay=0.0)
+    function, calls = fail_first(2)
+
+    async def coroutine():
+        return function()
+
+    assert asyncio.run(limiter.acall(coroutine, estimated_tokens=100)) == "ok"
+    assert len(calls) == 3
+    assert 500 <= limiter.token_bucket.tokens < 505
+
+def test_errors_that_are_not_retried_give_back_their_tokens():
+    limiter = ProviderRateLimiter(tokens_per_minute=600, base_delay=0.0)
+    function, calls = fail_first(1, ValueError)
+
+    with pytest.raises(ValueError):
+        limiter.call(function, estimated_tokens=100)
+    assert len(calls) == 1
+    assert limiter.token_bucket.tokens == pytest.approx(600)
+
+def test_default_limits_are_unlimited_unless_set_in_the_environment(monkeypatch):
+    monkeypatch.delenv("OPENAI_REQUESTS_PER_MINUTE", raising=False)
+    monkeypatch.delenv("OPENAI_TOKENS_PER_MINUTE", raising=False)
+    assert default_rate_limits("openai") == {"requests_per_minute": None, "tokens_per_minute": None}
+
+    monkeypatch.setenv("OPENAI_TOKENS_PER_MINUTE", "30000")
+    limiter = ProviderRateLimiter(**default_rate_limits("openai"))
+    assert limiter.request_bucket is None
+    assert limiter.token_bucket.capacity == 30000
+
+
+@pytest.fixture
+def stub_server():
+    pytest.importorskip("openai")
+    from StubServer import StubOpenAIServer
+
+    servers = []
+
+    def start(**kwargs):
+        servers.append(StubOpenAIServer(**kwargs).start())
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
+
+@pytest.fixture
+def openai_model(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    from OpenAIModel import OpenAIModel
+    return OpenAIModel
+
+def test_openai_model_retries_injected_429s_after_retry_after(stub_server, openai_model):
+    from StubServer import DEFAULT_STUB_RESPONSE
+
+    stub = stub_server(fail_first=2, retry_after=0.3)
+    # a long backoff would fail the test if the Retry-After header were ignored
+    limiter = ProviderRateLimiter(tokens_per_minute=600, base_delay=30.0)
+    model = openai_model("gpt-4o", base_url=stub.base_url, rate_limiter=limiter)
+
+    start_time = time.monotonic()
+    assert model.generate("Write a handler") == DEFAULT_STUB_RESPONSE
+    assert time.monotonic() - start_time < 5
+
+    assert stub.request_count == 3
+    assert limiter.retries == 2
+    gaps = [later - earlier for earlier, later in zip(stub.request_times, stub.request_times[1:])]
+    assert all(gap >= 0.3 for gap in gaps)
+
+def test_async_openai_model_retries_injected_429s_after_retry_after(stub_server, openai_model):
+    from StubServer import DEFAULT_STUB_RESPONSE
+
+    stub = stub_server(fail_first=2, retry_after=0.3)
+    limiter = ProviderRateLimiter(base_delay=30.0)
+    model = openai_model("gpt-4o", base_url=stub.base_url, rate_limiter=limiter)
+
+    assert asyncio.run(model.agenerate("Write a handler")) == DEFAULT_STUB_RESPONSE
+    assert stub.request_count == 3
+    assert limiter.retries == 2
+    gaps = [later - earlier for earlier, later in zip(stub.request_times, stub.request_times[1:])]
+    assert all(gap >= 0.3 for gap in gaps)
+
+def test_openai_model_gives_up_after_max_retries(stub_server, openai_model):
+    import openai
+
+    stub = stub_server(fail_first=5, retry_after=0.0)
+    limiter = ProviderRateLimiter(max_retries=2)
+    model = openai_model("gpt-4o", base_url=stub.base_url, rate_limiter=limiter)
+
+    with pytest.raises(openai.RateLimitError):
+        model.generate("Write a handler")
+    assert stub.request_count == 3
@@ -0,0 +1,141 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+import pytest
+from LLMInterface import LLMInterface
+from SingleFlightLLM import SingleFlightLLM, _inflight
+
+class SlowLLM(LLMInterface):
+    max_concurrency = 8
+
+    def __init__(self, delay: float = 0.2, error: Exception = None, calls_path: str = None) -> None:
+        self.model_name = "slow"
+        self.delay = delay
+        self.error = error
+        # calls are also appended to calls_path, to count them across processes
+        self.calls_path = calls_path
+        self.calls = 0
+
+    def _record(self, prompt: str) -> str:
+        self.calls += 1
+        if self.calls_path is not None:
+            with open(self.calls_path, "a") as f:
+                f.write(f"{os.getpid()}\n")
+        if self.error is not None:
+            raise self.error
+        return f"{prompt} #{self.calls}"
+
+    def generate(self, prompt: str, *args, **kwargs) -> str:
+        time.sleep(self.delay)
+        return self._record(prompt)
+
+    async def agenerate(self, prompt: str, *args, **kwargs) -> str:
+        await asyncio.sleep(self.delay)
+        return self._record(prompt)
+
+    def write_to_file(self, filename: str) -> None:
+        pass
+
+
+def test_concurrent_identical_requests_share_one_call():
+    backend = SlowLLM()
+    model = SingleFlightLLM(backend)
+
+    async def generate_all():
+        return await asyncio.gather(*(model.agenerate("Write a handler") for _ in range(5)))
+
+    assert asyncio.run(generate_all()) == ["Write a handler #1"] * 5
+    assert backend.calls == 1
+    assert model.coalesced_count == 4
+    assert not _inflight
+
+def test_concurrent_identical_threads_share_one_call():
+    backend = SlowLLM()
+    model = SingleFlightLLM(backend)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(model.generate("Write a handler"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["Write a handler #1"] * 4
+    assert backend.calls == 1
+
+def test_different_sample_indices_are_not_merged():
+    backend = SlowLLM()
+    model = SingleFlightLLM(backend)
+
+    async def generate_all():
+        return await asyncio.gather(*(model.agenerate("Write a handler", sample_index=i) for i in range(3)))
+
+    assert sorted(asyncio.run(generate_all())) == [f"Write a handler #{i}" for i in range(1, 4)]
+    assert backend.calls == 3
+
+def test_errors_of_the_leader_are_raised_in_its_followers():
+    backend = SlowLLM(error=ValueError("prompt too long"))
+    model = SingleFlightLLM(backend)
+
+    async def generate_all():
+        return await asyncio.gather(*(model.agenerate("Write a handler") for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(generate_all())
+    assert all(isinstance(result, ValueError) and str(result) == "prompt too long" for result in results)
+    assert backend.calls == 1
+    assert not _inflight
+
+def test_followers_of_a_cancelled_leader_complete():
+    backend = SlowLLM()
+    model = SingleFlightLLM(backend)
+
+    async def generate_all():
+        leader = asyncio.create_task(model.agenerate("Write a handler"))
+        await asyncio.sleep(0.05)
+        followers = [asyncio.create_task(model.agenerate("Write a handler")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        # e.g. the losing call of a HedgedLLM
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    # the first follower calls again as the new leader and the others share its call
+    assert asyncio.run(generate_all()) == ["Write a handler #1"] * 3
+    assert backend.calls == 1
+    assert model.coalesced_count == 2
+    assert not _inflight
+
+def test_a_cancelled_follower_does_not_cancel_the_call():
+    backend = SlowLLM()
+    model = SingleFlightLLM(backend)
+
+    async def generate_all():
+        leader = asyncio.create_task(model.agenerate("Write a handler"))
+        await asyncio.sleep(0.05)
+        follower = asyncio.create_task(model.agenerate("Write a handler"))
+        await asyncio.sleep(0.05)
+        follower.cancel()
+        return await leader
+
+    assert asyncio.run(generate_all()) == "Write a handler #1"
+    assert not _inflight
+
+def _generate_in_process(lock_dir: str, calls_path: str, results) -> None:
+    results.put(SingleFlightLLM(SlowLLM(delay=0.5, calls_path=calls_path), lock_dir=lock_dir).generate("Write a handler"))
+
+def test_lock_dir_shares_one_call_across_processes(tmp_path):
+    pytest.importorskip("fcntl")
+    context = multiprocessing.get_context("fork")
+    lock_dir, calls_path = str(tmp_path / "locks"), str(tmp_path / "calls.txt")
+    results = context.Queue()
+    processes = [context.Process(target=_generate_in_process, args=(lock_dir, calls_path, results)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=10)
+
+    assert [results.get(timeout=1) for _ in processes] == ["Write a handler #1"] * 2
+    with open(calls_path) as f:
+        assert len(f.readlines()) == 1
@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+from CachedLLM import CachedLLM, ResponseCache
+from LLMInterface import LLMInterface
+from Telemetry import estimate_cost, summarize_records, telemetry_tags, track_call
+
+class EchoLLM(LLMInterface):
+    max_concurrency = 4
+
+    def __init__(self, model_name: str = "gpt-4o-2024-08-06") -> None:
+        self.model_name = model_name
+
+    def generate(self, prompt: str, *args, **kwargs) -> str:
+        if prompt == "fail":
+            raise ValueError("bad prompt")
+        self.response_text = prompt.upper()
+        return self.response_text
+
+    def write_to_file(self, filename: str) -> None:
+        pass
+
+
+def test_calls_are_recorded_with_estimated_tokens(telemetry_sink):
+    EchoLLM().generate("Write a handler")
+
+    [record] = telemetry_sink.read()
+    assert (record["backend"], record["model"], record["method"]) == ("EchoLLM", "gpt-4o-2024-08-06", "generate")
+    assert record["tokens_estimated"] and record["input_tokens"] > 0 and record["output_tokens"] > 0
+    assert record["cost_usd"] == estimate_cost("gpt-4o", record["input_tokens"], record["output_tokens"])
+    assert record["error"] is None
+
+def test_failed_calls_are_recorded_with_their_error(telemetry_sink):
+    with pytest.raises(ValueError):
+        EchoLLM().generate("fail")
+
+    [record] = telemetry_sink.read()
+    assert record["error"] == "ValueError: bad prompt"
+    assert record["input_tokens"] is None
+
+def test_nested_calls_are_folded_into_the_outer_record(telemetry_sink, tmp_path):
+    model = CachedLLM(EchoLLM(), ResponseCache(str(tmp_path / "cache")))
+    model.generate("Write a handler")
+    model.generate("Write a handler")
+
+    records = telemetry_sink.read()
+    # one record per call to the wrapper, named after whatever served it: the backend, then the cache
+    assert [record["backend"] for record in records] == ["EchoLLM", "CachedLLM"]
+    assert [record["cache_hit"] for record in records] == [False, True]
+
+def test_track_call_keeps_the_outer_method_and_prompt(telemetry_sink):
+    outer, inner = EchoLLM("wrapper"), EchoLLM("deepseek-chat")
+    with track_call(outer, "agenerate", "outer prompt") as record:
+        with track_call(inner, "generate", "inner prompt") as inner_record:
+            assert inner_record == {}
+        record["_result"] = "done"
+
+    [record] = telemetry_sink.read()
+    assert (record["backend"], record["model"], record["method"]) == ("EchoLLM", "deepseek-chat", "agenerate")
+
+def test_tags_apply_to_the_calls_inside_the_block_only(telemetry_sink):
+    model = EchoLLM()
+    with telemetry_tags(prompt_type="type1"):
+        with telemetry_tags(config="repo/function1"):
+            model.generate("a")
+        model.generate("b")
+    model.generate("c")
+
+    assert [record["tags"] for record in telemetry_sink.read()] == [{"prompt_type": "type1", "config": "repo/function1"}, {"prompt_type": "type1"}, {}]
+
+def test_tags_are_not_shared_between_tasks():
+    async def tag(name: str) -> dict:
+        with telemetry_tags(task=name):
+            await asyncio.sleep(0.01)
+            with track_call(EchoLLM(), "generate", name) as record:
+                return dict(record["tags"])
+
+    async def tag_all():
+        return await asyncio.gather(tag("a"), tag("b"))
+
+    assert asyncio.run(tag_all()) == [{"task": "a"}, {"task": "b"}]
+
+def test_estimate_cost_uses_the_longest_matching_price():
+    # gpt-4o, not gpt-4, with the cached input tokens at the cached price
+    assert estimate_cost("gpt-4o-mini", 1_000_000, 1_000_000, cached_tokens=400_000) == pytest.approx(0.6 * 2.50 + 0.4 * 1.25 + 10.00)
+    assert estimate_cost("gpt-4-0613", 1000, 500) == pytest.approx((1000 * 30.00 + 500 * 60.00) / 1_000_000)
+    assert estimate_cost("CodeQwen1.5-7B-Chat", 1000, 500) is None
+    assert estimate_cost("gpt-4", None, None) is None
+
+def test_summarize_records_groups_by_field_or_tag():
+    records = [
+        {"backend": "OpenAIModel", "total_latency": 1.0, "queue_wait": 0.5, "time_to_first_token": None, "input_tokens": 100, "output_tokens": 10, "retries": 1, "cost_usd": 0.01, "error": None, "tags": {"prompt_type": "type1"}},
+        {"backend": "OpenAIModel", "total_latency": 3.0, "queue_wait": None, "time_to_first_token": 0.2, "input_tokens": 200, "output_tokens": 20, "retries": 0, "cost_usd": None, "error": "RateLimitError: 429", "tags": {"prompt_type": "type2"}},
+        {"backend": "DeepSeek", "total_latency": 2.0, "input_tokens": 50, "output_tokens": 5, "cached_tokens": 40, "hedges": 1, "tags": {"prompt_type": "type1"}},
+    ]
+
+    by_backend = summarize_records(records)
+    assert by_backend["OpenAIModel"] == {
+        "calls": 2, "errors": 1, "mean_queue_wait": 0.5, "mean_time_to_first_token": 0.2, "mean_latency": 2.0,
+        "input_tokens": 300, "output_tokens": 30, "cached_tokens": 0, "retries": 1, "hedges": 0, "cost_usd": 0.01,
+    }
+    assert by_backend["DeepSeek"]["mean_queue_wait"] is None
+    assert by_backend["DeepSeek"]["cached_tokens"] == 40
+
+    by_prompt_type = summarize_records(records, key="prompt_type")
+    assert {group: summary["calls"] for group, summary in by_prompt_type.items()} == {"type1": 2, "type2": 1}
+    assert by_prompt_type["type1"]["input_tokens"] == 150